@@ -0,0 +1,104 @@
+"""
+Benchmark suite for the NATS clients and FastStream subscribers.
+Run: python -m src.benchmarks [--target nats|faststream|all] [--server URL | --nats-server-bin PATH | --transport memory]
+Results are printed and saved as JSON (commit, platform, msgs/s, p50/p99, peak allocations);
+pass --compare <old.json> to flag throughput regressions between commits.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import sys
+
+from src.benchmarks import core, faststream_cases, nats_cases
+from src.benchmarks.server import nats_server
+from src.infrastructure.logger.main import LoggerReg, SetupLogger
+
+
+def _ints(value: str) -> list[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m src.benchmarks", description=__doc__.splitlines()[1])
+    parser.add_argument("--target", choices=("nats", "faststream", "all"), default="all")
+    parser.add_argument("--server", help="URL of a running nats-server with JetStream")
+    parser.add_argument("--nats-server-bin", help="nats-server binary to start for the session")
+    parser.add_argument(
+        "--transport", choices=("nats", "memory"), default="nats",
+        help="memory: NATS cases on the in-process JetStream, without network and server",
+    )
+    parser.add_argument("--cases", help="comma-separated case names, default: all of the target")
+    parser.add_argument("--payloads", type=_ints, default=[64, 1024, 16384], help="payload sizes in bytes")
+    parser.add_argument("--concurrency", type=_ints, default=[1, 16, 128], help="concurrency levels")
+    parser.add_argument("--messages", type=int, default=2000, help="messages per run")
+    parser.add_argument("--alloc-messages", type=int, default=200, help="messages in the tracemalloc run, 0 disables")
+    parser.add_argument("--out", help="result file, default: bench_results/<commit>.json")
+    parser.add_argument("--compare", help="previous result file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="throughput drop reported as regression")
+    return parser.parse_args(argv)
+
+
+def select_cases(args: argparse.Namespace) -> dict:
+    cases = {}
+    if args.target in ("nats", "all"):
+        cases.update(nats_cases.CASES)
+    if args.target in ("faststream", "all"):
+        cases.update(faststream_cases.CASES)
+    if args.cases:
+        names = args.cases.split(",")
+        unknown = set(names) - set(cases)
+        if unknown:
+            raise SystemExit(f"Unknown cases: {', '.join(sorted(unknown))}")
+        cases = {name: cases[name] for name in names}
+    return cases
+
+
+async def run(args: argparse.Namespace, server) -> list[core.BenchResult]:
+    results = []
+    for name, case in select_cases(args).items():
+        needs_server = name in nats_cases.CASES
+        for payload_size in args.payloads:
+            for concurrency in args.concurrency:
+                result = await core.run_case(
+                    name, case, server if needs_server else None,
+                    payload_size, concurrency, args.messages, args.alloc_messages, args.transport,
+                )
+                print(core.render([result]).splitlines()[-1], flush=True)
+                results.append(result)
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Логи клиентов не должны попадать в замеры
+    SetupLogger(
+        [LoggerReg(name=name, level=LoggerReg.Level.WARNING) for name in ("MAIN", "NATSClient")],
+        select_format="jsonformat",
+        profile="production",
+    )
+    logging.getLogger("faststream").setLevel(logging.WARNING)
+
+    with contextlib.ExitStack() as stack:
+        server = args.server
+        if server is None and args.transport == "nats" and args.target in ("nats", "all"):
+            server = stack.enter_context(nats_server(args.nats_server_bin))
+        print(core.render([]).splitlines()[0])
+        results = asyncio.run(run(args, server))
+
+    out = args.out or os.path.join("bench_results", f"{core.git_commit()}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    core.save(results, out, args.target)
+    print(f"\nSaved {len(results)} results to {out}")
+
+    if args.compare:
+        table, regressed = core.compare(core.load(args.compare), results, args.threshold)
+        print(f"\nCompared with {args.compare}:\n{table}")
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Benchmark runner primitives: cases, measurement and machine-readable results.
+"""
+
+import asyncio
+import dataclasses
+import datetime
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Optional
+
+from src.main.new_app.metrics import Histogram
+
+
+@dataclasses.dataclass(slots=True)
+class CaseContext:
+    """
+    Parameters of one benchmark run.
+    Attributes
+    ----------
+    server (Optional[str]): NATS server URL, None for in-process targets.
+    payload_size (int): Size of the payload body in bytes.
+    concurrency (int): Number of concurrent workers / in-flight messages.
+    messages (int): Number of messages to process.
+    transport (Optional[str]): Client transport, "memory" runs NATS cases without a server.
+    latency (Histogram): Per-message latencies recorded by the case, in seconds.
+    """
+
+    server: Optional[str]
+    payload_size: int
+    concurrency: int
+    messages: int
+    transport: Optional[str] = None
+    latency: Histogram = dataclasses.field(default_factory=Histogram)
+
+    def payload(self) -> dict:
+        # Отметка времени внутри сообщения позволяет мерить задержку доставки
+        return {"ts": time.perf_counter(), "body": "x" * self.payload_size}
+
+    def per_worker(self) -> list[int]:
+        base, extra = divmod(self.messages, self.concurrency)
+        return [base + (1 if i < extra else 0) for i in range(self.concurrency)]
+
+
+# Кейс выполняет нагрузку и возвращает время горячей части в секундах
+Case = Callable[[CaseContext], Awaitable[float]]
+
+
+@dataclasses.dataclass(slots=True)
+class BenchResult:
+    case: str
+    payload_size: int
+    concurrency: int
+    messages: int
+    seconds: float
+    msgs_per_s: float
+    p50_ms: float
+    p99_ms: float
+    alloc_peak_kib: Optional[float] = None
+
+    @property
+    def key(self) -> tuple:
+        return self.case, self.payload_size, self.concurrency
+
+
+async def run_case(
+        name: str,
+        case: Case,
+        server: Optional[str],
+        payload_size: int,
+        concurrency: int,
+        messages: int,
+        alloc_messages: int = 0,
+        transport: Optional[str] = None
+) -> BenchResult:
+    ctx = CaseContext(server, payload_size, concurrency, messages, transport)
+    seconds = await case(ctx)
+    alloc_peak = None
+    if alloc_messages:
+        # Отдельный короткий прогон под tracemalloc, чтобы не искажать время
+        tracemalloc.start()
+        try:
+            await case(CaseContext(server, payload_size, concurrency, alloc_messages, transport))
+            alloc_peak = tracemalloc.get_traced_memory()[1] / 1024
+        finally:
+            tracemalloc.stop()
+    return BenchResult(
+        case=name,
+        payload_size=payload_size,
+        concurrency=concurrency,
+        messages=messages,
+        seconds=seconds,
+        msgs_per_s=messages / seconds if seconds else 0.0,
+        p50_ms=ctx.latency.percentile(50) * 1000,
+        p99_ms=ctx.latency.percentile(99) * 1000,
+        alloc_peak_kib=alloc_peak,
+    )
+
+
+async def gather_workers(ctx: CaseContext, worker: Callable[[int], Awaitable[Any]]) -> float:
+    """Runs `worker(count)` for every worker share and returns the wall time."""
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(count) for count in ctx.per_worker() if count))
+    return time.perf_counter() - started
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save(results: list[BenchResult], path: str, target: str):
+    document = {
+        "commit": git_commit(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "target": target,
+        "results": [dataclasses.asdict(result) for result in results],
+    }
+    with open(path, "w") as file:
+        json.dump(document, file, indent=2)
+
+
+def load(path: str) -> list[BenchResult]:
+    with open(path) as file:
+        return [BenchResult(**item) for item in json.load(file)["results"]]
+
+
+def render(results: list[BenchResult]) -> str:
+    header = f"{'case':<28} {'payload':>8} {'conc':>5} {'msgs/s':>12} {'p50 ms':>9} {'p99 ms':>9} {'peak KiB':>9}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        alloc = f"{r.alloc_peak_kib:>9.0f}" if r.alloc_peak_kib is not None else f"{'-':>9}"
+        lines.append(
+            f"{r.case:<28} {r.payload_size:>8} {r.concurrency:>5} {r.msgs_per_s:>12.0f} "
+            f"{r.p50_ms:>9.3f} {r.p99_ms:>9.3f} {alloc}"
+        )
+    return "\n".join(lines)
+
+
+def compare(baseline: list[BenchResult], current: list[BenchResult], threshold: float = 0.1) -> tuple[str, bool]:
+    """Returns a comparison table and whether any throughput dropped by more than `threshold`."""
+    previous = {result.key: result for result in baseline}
+    lines = [f"{'case':<28} {'payload':>8} {'conc':>5} {'msgs/s':>12} {'change':>8}"]
+    regressed = False
+    for r in current:
+        old = previous.get(r.key)
+        if old is None or not old.msgs_per_s:
+            change = "new"
+        else:
+            delta = r.msgs_per_s / old.msgs_per_s - 1
+            change = f"{delta:+.1%}"
+            if delta < -threshold:
+                change += " !"
+                regressed = True
+        lines.append(f"{r.case:<28} {r.payload_size:>8} {r.concurrency:>5} {r.msgs_per_s:>12.0f} {change:>8}")
+    return "\n".join(lines), regressed
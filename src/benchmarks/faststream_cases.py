@@ -0,0 +1,115 @@
+"""
+Benchmark cases for the FastStream subscribers of src/main/subs.py.
+They run in-process through TestNatsBroker, no server is required.
+"""
+
+import asyncio
+import time
+
+from dishka import FromDishka, make_async_container
+from dishka.integrations.faststream import FastStreamProvider, inject, setup_dishka
+from faststream import FastStream, context
+from faststream.nats import NatsBroker, TestNatsBroker
+from nats.js.kv import KeyValue
+
+from src.benchmarks.core import CaseContext, gather_workers
+from src.main.di import StateProvider
+from src.main import subs
+from src.main.injection import PrecompiledInjector, setup_injection
+from src.main.new_app.state import StateStore
+
+
+async def miniapp_sub(ctx: CaseContext) -> float:
+    # Обработчик через DishkaMiddleware + inject: контейнер запроса на каждое сообщение
+    return await _miniapp_sub(ctx, precompiled=False)
+
+
+async def miniapp_sub_precompiled(ctx: CaseContext) -> float:
+    # Тот же обработчик через setup_injection: StateStore связан один раз
+    return await _miniapp_sub(ctx, precompiled=True)
+
+
+async def _miniapp_sub(ctx: CaseContext, precompiled: bool) -> float:
+    # KV-подписчик получает KeyValue.Entry напрямую: TestNatsBroker.publish
+    # передаёт обычное сообщение, которое парсер KV-подписки не принимает
+    broker = NatsBroker(logger=None)
+    broker.include_router(subs.create_router())
+    app = FastStream(broker, logger=None)
+    container = make_async_container(FastStreamProvider(), StateProvider())
+    if precompiled:
+        injector = setup_injection(container, app)
+    else:
+        setup_dishka(container=container, app=app, auto_inject=True)
+    revision = 0
+
+    async with TestNatsBroker(broker):
+        if precompiled:
+            await injector.resolve()  # after_startup приложения здесь не вызывается
+        subscriber = next(
+            sub for sub in broker._subscribers.values() if getattr(sub, "kv_watch", None) is not None
+        )
+        body = str(ctx.payload_size).encode()
+
+        async def worker(count):
+            nonlocal revision
+            for _ in range(count):
+                revision += 1
+                entry = KeyValue.Entry(
+                    bucket="miniapp", key="result", value=body,
+                    revision=revision, delta=0, created=None, operation=None,
+                )
+                started = time.perf_counter()
+                await subscriber.process_message(entry)
+                ctx.latency.record(time.perf_counter() - started)
+
+        seconds = await gather_workers(ctx, worker)
+        await asyncio.sleep(0)
+        return seconds
+
+
+async def _handler(value: int, state: FromDishka[StateStore]):
+    state.set("result", value)
+
+
+async def di_request_scope(ctx: CaseContext) -> float:
+    # Только слой DI, без брокера: то, что DishkaMiddleware + inject делают на каждое сообщение
+    container = make_async_container(FastStreamProvider(), StateProvider())
+    handler = inject(_handler)
+
+    async def worker(count):
+        for i in range(count):
+            started = time.perf_counter()
+            async with container({}) as request_container:
+                with context.scope("dishka", request_container):
+                    await handler(i)
+            ctx.latency.record(time.perf_counter() - started)
+
+    seconds = await gather_workers(ctx, worker)
+    await container.close()
+    return seconds
+
+
+async def di_precompiled(ctx: CaseContext) -> float:
+    # Тот же обработчик через PrecompiledInjector: зависимость связана заранее
+    container = make_async_container(FastStreamProvider(), StateProvider())
+    injector = PrecompiledInjector(container)
+    handler = injector.inject(_handler)
+    await injector.resolve()
+
+    async def worker(count):
+        for i in range(count):
+            started = time.perf_counter()
+            await handler(i)
+            ctx.latency.record(time.perf_counter() - started)
+
+    seconds = await gather_workers(ctx, worker)
+    await container.close()
+    return seconds
+
+
+CASES = {
+    "faststream.miniapp_sub": miniapp_sub,
+    "faststream.miniapp_sub_precompiled": miniapp_sub_precompiled,
+    "faststream.di_request_scope": di_request_scope,
+    "faststream.di_precompiled": di_precompiled,
+}
@@ -0,0 +1,85 @@
+"""
+Per-call cost of the logging profiles.
+Run: python -m src.benchmarks.logger_profiles [--number N]
+Records are rendered as JSON into os.devnull, so the numbers are the cost
+of the processor chain and the handler, not of the terminal.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import timeit
+
+import structlog
+
+from src.infrastructure.logger.main import LoggerReg, SetupLogger
+from src.infrastructure.logger.profiles import PROFILES
+
+BENCH_LOGGER = "BENCH"
+
+
+@contextlib.contextmanager
+def devnull_stderr():
+    stderr = sys.stderr
+    with open(os.devnull, "w") as sink:
+        sys.stderr = sink
+        try:
+            yield
+        finally:
+            sys.stderr = stderr
+
+
+def measure(profile: str, queue_mode: bool, number: int) -> dict[str, float]:
+    setup = SetupLogger(
+        [LoggerReg(name=BENCH_LOGGER, level=LoggerReg.Level.INFO)],
+        select_format="jsonformat",
+        queue_mode=queue_mode,
+        queue_size=number * 4,
+        profile=profile,
+    )
+    logger = structlog.getLogger(BENCH_LOGGER)
+
+    async def adebug():
+        for _ in range(number):
+            await logger.adebug("disabled", key="value")
+
+    async def ainfo():
+        for _ in range(number):
+            await logger.ainfo("enabled", key="value")
+
+    cases = {
+        "debug (disabled)": lambda: logger.debug("disabled", key="value"),
+        "info": lambda: logger.info("enabled", key="value"),
+        "warning": lambda: logger.warning("enabled", key="value"),
+    }
+    result = {name: timeit.timeit(call, number=number) / number * 1e9 for name, call in cases.items()}
+    for name, coro in (("adebug (disabled)", adebug), ("ainfo", ainfo)):
+        start = timeit.default_timer()
+        asyncio.run(coro())
+        result[name] = (timeit.default_timer() - start) / number * 1e9
+    if setup.log_queue is not None:
+        setup.log_queue.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=20000, help="calls per case")
+    args = parser.parse_args()
+
+    rows = []
+    with devnull_stderr():
+        for profile in PROFILES:
+            for queue_mode in (False, True):
+                rows.append((profile, queue_mode, measure(profile, queue_mode, args.number)))
+
+    cases = list(rows[0][2])
+    print(f"{'profile':<12} {'queue':<6} " + " ".join(f"{case:>18}" for case in cases))
+    for profile, queue_mode, result in rows:
+        print(f"{profile:<12} {str(queue_mode):<6} " + " ".join(f"{result[c]:>15.0f} ns" for c in cases))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Benchmark cases for NATSClient and NATSKeyValueClient against a NATS server with JetStream
+or the in-process transport (--transport memory).
+"""
+
+import asyncio
+import time
+import uuid
+
+from src.benchmarks.core import CaseContext, gather_workers
+from src.main.new_app.consumer import PullSettings
+from src.main.new_app.metrics import Metrics
+from src.main.new_app.nats_app import NATSKeyValueClient
+from src.main.new_app.nats_stream import NATSClient
+
+
+def _name(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:8]}"
+
+
+async def _stream_client(ctx: CaseContext, **kwargs) -> tuple[NATSClient, str, str]:
+    client = NATSClient(servers=[ctx.server], metrics=Metrics(), transport=ctx.transport, **kwargs)
+    await client.connect()
+    stream = _name("BENCH")
+    subject = f"{stream}.data"
+    await client.create_stream(name=stream, subjects=[subject])
+    return client, stream, subject
+
+
+async def _close_stream_client(client: NATSClient, stream: str):
+    await client.js.delete_stream(stream)
+    await client.disconnect()
+
+
+async def publish(ctx: CaseContext) -> float:
+    # NATSClient.publish: каждый воркер ждёт PubAck на каждое сообщение
+    client, stream, subject = await _stream_client(ctx)
+
+    async def worker(count):
+        for _ in range(count):
+            started = time.perf_counter()
+            await client.publish(subject, ctx.payload())
+            ctx.latency.record(time.perf_counter() - started)
+
+    try:
+        return await gather_workers(ctx, worker)
+    finally:
+        await _close_stream_client(client, stream)
+
+
+async def publish_many(ctx: CaseContext) -> float:
+    # Конвейер публикаций с окном в `concurrency` неподтверждённых сообщений
+    client, stream, subject = await _stream_client(ctx, publish_window=ctx.concurrency)
+    try:
+        started = time.perf_counter()
+        await client.publish_many(subject, (ctx.payload() for _ in range(ctx.messages)))
+        seconds = time.perf_counter() - started
+        ctx.latency = client.metrics.histogram("nats_publish_ack_seconds", client=client.name)
+        return seconds
+    finally:
+        await _close_stream_client(client, stream)
+
+
+async def process_messages(ctx: CaseContext) -> float:
+    # Выборка заранее опубликованных сообщений: batch и max_in_flight равны `concurrency`
+    client, stream, subject = await _stream_client(ctx, publish_window=256)
+    done = asyncio.Event()
+    received = 0
+
+    async def callback(msg):
+        nonlocal received
+        msg.payload  # Декодирование входит в стоимость обработки
+        await msg.ack()
+        received += 1
+        if received >= ctx.messages:
+            done.set()
+
+    durable = _name("bench")
+    try:
+        await client.publish_many(subject, (ctx.payload() for _ in range(ctx.messages)))
+        started = time.perf_counter()
+        await client.add_subscription(
+            subject,
+            durable_name=durable,
+            callback=callback,
+            settings=PullSettings(batch_size=ctx.concurrency, max_in_flight=ctx.concurrency),
+        )
+        await done.wait()
+        seconds = time.perf_counter() - started
+        ctx.latency = client.metrics.histogram("nats_queue_wait_seconds", consumer=durable)
+        return seconds
+    finally:
+        await _close_stream_client(client, stream)
+
+
+async def _kv_client(ctx: CaseContext, **kwargs) -> tuple[NATSKeyValueClient, str]:
+    client = NATSKeyValueClient(servers=[ctx.server], metrics=Metrics(), transport=ctx.transport, **kwargs)
+    await client.connect()
+    bucket = _name("bench")
+    await client.create_bucket(bucket)
+    return client, bucket
+
+
+async def _close_kv_client(client: NATSKeyValueClient, bucket: str):
+    await client.watcher.close()
+    await client.js.delete_key_value(bucket)
+    await client.disconnect()
+
+
+async def kv_put_value(ctx: CaseContext) -> float:
+    client, bucket = await _kv_client(ctx)
+
+    async def worker(count):
+        key = _name("key")
+        for _ in range(count):
+            started = time.perf_counter()
+            await client.put_value(key, ctx.payload())
+            ctx.latency.record(time.perf_counter() - started)
+
+    try:
+        return await gather_workers(ctx, worker)
+    finally:
+        await _close_kv_client(client, bucket)
+
+
+async def _kv_get(ctx: CaseContext, **kwargs) -> float:
+    client, bucket = await _kv_client(ctx, **kwargs)
+
+    async def worker(count):
+        key = _name("key")
+        await client.put_value(key, ctx.payload())
+        for _ in range(count):
+            started = time.perf_counter()
+            await client.get_value(key)
+            ctx.latency.record(time.perf_counter() - started)
+
+    try:
+        return await gather_workers(ctx, worker)
+    finally:
+        await _close_kv_client(client, bucket)
+
+
+async def kv_get_value(ctx: CaseContext) -> float:
+    return await _kv_get(ctx)
+
+
+async def kv_get_value_cached(ctx: CaseContext) -> float:
+    return await _kv_get(ctx, cache_size=1024)
+
+
+async def kv_watch_bucket(ctx: CaseContext) -> float:
+    # Задержка от put_value до вызова коллбека наблюдателя
+    client, bucket = await _kv_client(ctx)
+    done = asyncio.Event()
+    received = 0
+
+    async def callback(event):
+        nonlocal received
+        ctx.latency.record(time.perf_counter() - event.value["ts"])
+        received += 1
+        if received >= ctx.messages:
+            done.set()
+
+    async def worker(count):
+        key = _name("key")
+        for _ in range(count):
+            await client.put_value(key, ctx.payload())
+
+    try:
+        await client.watch_bucket(bucket, callback)
+        started = time.perf_counter()
+        await gather_workers(ctx, worker)
+        await done.wait()
+        return time.perf_counter() - started
+    finally:
+        await _close_kv_client(client, bucket)
+
+
+CASES = {
+    "nats.publish": publish,
+    "nats.publish_many": publish_many,
+    "nats.process_messages": process_messages,
+    "kv.put_value": kv_put_value,
+    "kv.get_value": kv_get_value,
+    "kv.get_value_cached": kv_get_value_cached,
+    "kv.watch_bucket": kv_watch_bucket,
+}
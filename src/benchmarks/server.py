@@ -0,0 +1,47 @@
+"""
+Starts a throwaway `nats-server -js` for a benchmark session.
+"""
+
+import contextlib
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from typing import Iterator, Optional
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_port(port: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), timeout=0.2):
+            return
+        time.sleep(0.05)
+    raise TimeoutError(f"nats-server did not start on port {port}")
+
+
+@contextlib.contextmanager
+def nats_server(binary: Optional[str] = None, timeout: float = 10.0) -> Iterator[str]:
+    """Yields the URL of a local JetStream server with storage in a temporary directory."""
+    binary = binary or shutil.which("nats-server")
+    if binary is None:
+        raise FileNotFoundError("nats-server binary not found, pass --nats-server-bin or --server")
+    port = _free_port()
+    with tempfile.TemporaryDirectory(prefix="nats-bench-") as store_dir:
+        process = subprocess.Popen(
+            [binary, "-js", "-a", "127.0.0.1", "-p", str(port), "-sd", store_dir],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            _wait_port(port, timeout)
+            yield f"nats://127.0.0.1:{port}"
+        finally:
+            process.terminate()
+            process.wait(timeout)
@@ -0,0 +1,324 @@
+"""
+Non-blocking logging handlers.
+Records are put on a bounded queue by a lightweight handler and written by a
+single background thread, so the event loop never waits on stream I/O.
+The file sink buffers lines, rotates by size and time and compresses
+rotated segments in a background thread.
+"""
+
+import dataclasses
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Optional
+
+import structlog
+
+# Queue overflow policies
+DROP_POLICY = "drop"
+BLOCK_POLICY = "block"
+
+_STOP = object()
+
+
+class LogQueue:
+    """
+    Bounded queue of log records drained by one writer thread.
+    Attributes
+    ----------
+    maxsize (int): Maximum number of queued records.
+    policy (str): What to do when the queue is full: "drop" the record or "block" the caller.
+    dropped (int): Number of records dropped because the queue was full.
+    written (int): Number of records passed to the target handlers.
+    """
+
+    def __init__(self, maxsize: int = 10000, policy: str = DROP_POLICY) -> None:
+        if policy not in (DROP_POLICY, BLOCK_POLICY):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.queue: queue.Queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.written = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def __repr__(self) -> str:
+        return f"<{__class__.__name__} {self.policy} size:{self.queue.qsize()}/{self.maxsize} dropped:{self.dropped}>"
+
+    def handler(self, targets: list[logging.Handler]) -> "QueueHandler":
+        """Returns a handler that forwards records of one logger to its target handlers."""
+        return QueueHandler(self, targets)
+
+    def put(self, targets: list[logging.Handler], record: logging.LogRecord) -> None:
+        item = (targets, record)
+        if self.policy == BLOCK_POLICY:
+            self.queue.put(item)
+            return
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Writes out all queued records and stops the writer thread."""
+        if self._thread is None:
+            return
+        self.queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            targets, record = item
+            for handler in targets:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+            self.written += 1
+
+
+class QueueHandler(logging.Handler):
+    """
+    Handler that only enqueues records; formatting happens in the writer thread.
+    Attributes
+    ----------
+    log_queue (LogQueue): Shared queue.
+    targets (list[logging.Handler]): Handlers that actually write the record.
+    """
+
+    def __init__(self, log_queue: LogQueue, targets: list[logging.Handler]) -> None:
+        super().__init__()
+        self.log_queue = log_queue
+        self.targets = targets
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.log_queue.put(self.targets, record)
+
+
+class QueueBoundLogger(structlog.stdlib.BoundLogger):
+    """
+    BoundLogger whose async methods log in place instead of hopping to a thread pool.
+    With a QueueHandler the synchronous call only puts the record on a queue,
+    so the executor round trip would cost more than the call itself.
+    """
+
+    async def adebug(self, event: str, *args: Any, **kw: Any) -> None:
+        self.debug(event, *args, **kw)
+
+    async def ainfo(self, event: str, *args: Any, **kw: Any) -> None:
+        self.info(event, *args, **kw)
+
+    async def awarning(self, event: str, *args: Any, **kw: Any) -> None:
+        self.warning(event, *args, **kw)
+
+    async def aerror(self, event: str, *args: Any, **kw: Any) -> None:
+        self.error(event, *args, **kw)
+
+    async def acritical(self, event: str, *args: Any, **kw: Any) -> None:
+        self.critical(event, *args, **kw)
+
+    async def afatal(self, event: str, *args: Any, **kw: Any) -> None:
+        self.critical(event, *args, **kw)
+
+    async def aexception(self, event: str, *args: Any, **kw: Any) -> None:
+        # Called in the same frame, so exception() picks up the exception being handled
+        self.exception(event, *args, **kw)
+
+    async def alog(self, level: Any, event: str, *args: Any, **kw: Any) -> None:
+        self.log(level, event, *args, **kw)
+
+
+@dataclasses.dataclass(slots=True)
+class FileSink:
+    """
+    File sink settings of a logger.
+    Attributes
+    ----------
+    filename (Optional[str]): Log file path. Default is "<logs_dir>/<logger name>.log".
+    max_bytes (int): Rotate when the file grows beyond this size, 0 disables. Default is 100 MB.
+    rotate_interval (Optional[float]): Rotate every N seconds, None disables. Default is None.
+    backup_count (int): Number of rotated segments to keep, 0 keeps all. Default is 10.
+    compress (bool): Flag to gzip rotated segments in a background thread. Default is True.
+    buffer_records (int): Flush after this many buffered records. Default is 256.
+    flush_interval (float): Maximum time in seconds a record stays in the buffer. Default is 1.0.
+    """
+
+    filename: Optional[str] = None
+    max_bytes: int = 100 * 1024 * 1024
+    rotate_interval: Optional[float] = None
+    backup_count: int = 10
+    compress: bool = True
+    buffer_records: int = 256
+    flush_interval: float = 1.0
+
+
+class BufferedRotatingFileHandler(logging.Handler):
+    """
+    File handler that writes buffered lines in one call and rotates by size and time.
+    Records of ERROR and above are flushed immediately.
+    Attributes
+    ----------
+    sink (FileSink): Sink settings.
+    rotations (int): Number of performed rotations.
+    """
+
+    def __init__(self, sink: FileSink) -> None:
+        super().__init__()
+        if not sink.filename:
+            raise ValueError("FileSink.filename is required")
+        self.sink = sink
+        self.filename = os.path.abspath(sink.filename)
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self.rotations = 0
+        self._buffer: list[str] = []
+        self._stream = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._open()
+        self._compressors: list[threading.Thread] = []
+        self._prune_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name="log-flush", daemon=True)
+        self._flusher.start()
+
+    def __repr__(self) -> str:
+        return f"<{__class__.__name__} {self.filename} ({logging.getLevelName(self.level)})>"
+
+    def _open(self) -> None:
+        self._stream = open(self.filename, "a", encoding="utf-8")
+        self._size = self._stream.tell()
+        self._opened_at = time.time()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            line = self.format(record) + "\n"
+        except Exception:
+            self.handleError(record)
+            return
+        self.acquire()
+        try:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.sink.buffer_records or record.levelno >= logging.ERROR:
+                self._write()
+        finally:
+            self.release()
+
+    def flush(self) -> None:
+        self.acquire()
+        try:
+            self._write()
+        finally:
+            self.release()
+
+    def _write(self) -> None:
+        if not self._buffer or self._stream is None:
+            return
+        data = "".join(self._buffer)
+        self._buffer.clear()
+        self._stream.write(data)
+        self._stream.flush()
+        # Размер в символах: для ротации достаточно оценки, без повторного кодирования
+        self._size += len(data)
+        if self._should_rotate():
+            self._rotate()
+
+    def _should_rotate(self) -> bool:
+        if self.sink.max_bytes and self._size >= self.sink.max_bytes:
+            return True
+        if self.sink.rotate_interval and self._size and time.time() - self._opened_at >= self.sink.rotate_interval:
+            return True
+        return False
+
+    def _rotate(self) -> None:
+        self._stream.close()
+        segment = f"{self.filename}.{time.strftime('%Y%m%d-%H%M%S')}.{self.rotations}"
+        os.replace(self.filename, segment)
+        self.rotations += 1
+        self._open()
+        if self.sink.compress:
+            # Not an executor: rotation may happen while the interpreter shuts down
+            self._compressors = [thread for thread in self._compressors if thread.is_alive()]
+            thread = threading.Thread(target=self._compress, args=(segment,), name="log-compress")
+            thread.start()
+            self._compressors.append(thread)
+        else:
+            self._prune()
+
+    def _compress(self, segment: str) -> None:
+        # Imported on the first rotation, not at logger setup
+        import gzip
+        import shutil
+
+        # Written under a temporary name: pruning only sees complete archives
+        with open(segment, "rb") as src, gzip.open(f"{segment}.gz.tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(f"{segment}.gz.tmp", f"{segment}.gz")
+        os.remove(segment)
+        self._prune()
+
+    def _prune(self) -> None:
+        if not self.sink.backup_count:
+            return
+        # Compressors of several rotations may prune at the same time
+        pattern = f"{glob.escape(self.filename)}.*.gz" if self.sink.compress else f"{glob.escape(self.filename)}.*"
+        with self._prune_lock:
+            segments = sorted(glob.glob(pattern), key=os.path.getmtime)
+            for segment in segments[:-self.sink.backup_count]:
+                try:
+                    os.remove(segment)
+                except FileNotFoundError:
+                    pass
+
+    def _flush_periodically(self) -> None:
+        while not self._stopping.wait(self.sink.flush_interval):
+            self.flush()
+            if not self.sink.rotate_interval:
+                continue
+            self.acquire()
+            try:
+                # Checked under the lock: emit() may have rotated already, or close() closed the stream
+                if self._stream is not None and self._should_rotate():
+                    self._rotate()
+            finally:
+                self.release()
+
+    def close(self) -> None:
+        self._stopping.set()
+        self.acquire()
+        try:
+            self._write()
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+        finally:
+            self.release()
+        for thread in self._compressors:
+            thread.join()
+        super().close()
+
+
+class RenderOnceFormatter(structlog.stdlib.ProcessorFormatter):
+    """
+    ProcessorFormatter that stores its output on the record.
+    Handlers sharing one formatter instance (console and file in JSON format)
+    render a record once instead of once per handler.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        rendered = record.__dict__.get("_rendered")
+        if rendered is not None and rendered[0] is self:
+            return rendered[1]
+        line = super().format(record)
+        record._rendered = (self, line)
+        return line
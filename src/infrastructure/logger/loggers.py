@@ -12,15 +12,23 @@ class InitLoggers:
             *,
             developer_mode: bool = True,
             select_format: Optional[Literal['console', 'jsonformat']] = None,
-            ensure_ascii: bool = True
+            ensure_ascii: bool = True,
+            queue_mode: bool = False,
+            queue_size: int = 10000,
+            queue_policy: Literal['drop', 'block'] = 'drop',
+            profile: Literal['development', 'production'] = 'development'
     ) -> None:
-        SetupLogger(
+        self.setup = SetupLogger(
             developer_mode=developer_mode,
             name_registration=[
                 self.main,
             ],
             select_format=select_format,
-            ensure_ascii=ensure_ascii
+            ensure_ascii=ensure_ascii,
+            queue_mode=queue_mode,
+            queue_size=queue_size,
+            queue_policy=queue_policy,
+            profile=profile
         )
 
 
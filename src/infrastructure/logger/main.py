@@ -1,249 +1,401 @@
-"""
-Logging Configuration
-This configuration sets up struct logging with the help of the
-structlog and logging libraries.
-Main features:
-    - Separation of logs by loggers for modules/components of the project.
-    - Convenient syntax for writing logs through loggers.
-    - Possibility to write logs to a file.
-    - Automatic logging to JSON format when working in Docker if
-    DEV environment variable is not set.
-Structlog processors add useful information to logs such as
-request ID, time, log level, etc.
-Configuration allows you to efficiently log application events and
-debug its operation.
-setup_logger.py developed by morington
-https://gist.github.com/morington/906cbc6fca128bde4ab81fb8e8eed849
-"""
-
-import dataclasses
-import logging
-import logging.config
-import os
-import sys
-from enum import Enum
-from typing import Optional, Literal
-
-import structlog
-from structlog.typing import EventDict
-
-# Constants for defining the names of handlers and formatters
-CONSOLE_HANDLER = "console"
-CONSOLE_FORMATTER = "console_formatter"
-
-JSONFORMAT_HANDLER = "jsonformat"
-JSONFORMAT_FORMATTER = "jsonformat_formatter"
-
-
-def logger_detailed(logger: logging.Logger, _: str, event_dict: EventDict) -> EventDict:
-    """
-    A function for detailing logs, adding information about the file, function and line number.
-    Parameters
-    ----------
-    logger (logging.Logger): Logger for recording logs.
-    _ (str): Method name.
-    event_dict (EventDict): Event dictionary for logging.
-    Returns
-    -------
-    EventDict: Augmented event dictionary.
-    """
-    filename: str = event_dict.pop("filename")
-    func_name: str = event_dict.pop("func_name")
-    lineno: str = event_dict.pop("lineno")
-
-    event_dict["logger"] = f"{filename}:{func_name}:{lineno}"
-    if logger:
-        event_dict["level"] = f"{logger.name} - {event_dict.get('level')}"
-
-    return event_dict
-
-
-@dataclasses.dataclass(slots=True)
-class LoggerReg:
-    """
-    Class for representing logger settings.
-    Attributes
-    ----------
-    name (str): Logger name.
-    level (Level): Logging level.
-    propagate (bool): Flag to indicate whether messages should be passed to parent loggers. Default is False.
-    write_file (bool): Flag to indicate whether logs should be written to a file. Default is True.
-    """
-
-    class Level(Enum):
-        DEBUG: str = "DEBUG"
-        INFO: str = "INFO"
-        WARNING: str = "WARNING"
-        ERROR: str = "ERROR"
-        CRITICAL: str = "CRITICAL"
-        NONE: str = None
-
-    name: str
-    level: Level = Level.DEBUG
-    propagate: bool = False
-    write_file: bool = False
-
-
-class SetupLogger:
-    """
-    Class for setting up logging using structlog.
-    Attributes
-    ----------
-    name_registration (List[LoggerReg]): List of logger settings.
-    default_development (bool): Flag to indicate the development mode, forces the output format to be CONSOLE. Default is False.
-    log_to_file (bool): Flag to indicate that logs are written to a file. Default is False.
-    logs_dir (str): Directory for writing logs. Default is "logs".
-    Methods
-    -------
-    __str__(): Returns a string representation of the class.
-    __repr__(): Returns the class representation as a string.
-    renderer(): Returns the logging format depending on the conditions.
-    timestamper(): Returns a TimeStamper object for the logger timestamp.
-    preprocessors(addit: bool = False): Setting up structlog preprocessors.
-    init_structlog(): Initializes logging settings using structlog.
-    """
-
-    def __init__(
-            self,
-            name_registration: Optional[list[LoggerReg]],
-            developer_mode: bool = False,
-            select_format: Optional[Literal['console', 'jsonformat']] = None,
-            ensure_ascii: bool = True
-    ) -> None:
-        self.name_registration = ([] if name_registration is None else name_registration)
-        self.name_registration.extend(
-            [LoggerReg(name="_STLOGGER", level=LoggerReg.Level.INFO)]
-        )
-
-        self.developer_mode = developer_mode
-        self.select_format = self.check_format(select_format)
-        self.ensure_ascii = ensure_ascii
-
-        self.module_name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
-        self.init_structlog()
-
-    def __str__(self) -> str:
-        return f"<{__class__.__name__} dev:{sys.stderr.isatty()}; Reg {len(self.name_registration)} loggers>"
-
-    def __repr__(self):
-        return self.__str__()
-    
-    @staticmethod
-    def check_format(select_format: Optional[Literal['console', 'jsonformat']]) -> Optional[str]:
-        if select_format in [CONSOLE_HANDLER, JSONFORMAT_HANDLER]:
-            return select_format
-        return None
-
-    @property
-    def renderer(self) -> str:
-        """
-        Returns the logging format depending on the conditions.
-        Returns
-        -------
-        str: Format.
-        """
-        if self.select_format is not None:
-            return self.select_format
-        elif sys.stderr.isatty() or os.environ.get("MODE_DEV", self.developer_mode):
-            return CONSOLE_HANDLER
-        return JSONFORMAT_HANDLER
-
-    @property
-    def timestamper(self) -> structlog.processors.TimeStamper:
-        """
-        Returns a TimeStamper object for the logger timestamp.
-        Returns
-        -------
-        structlog.processors.TimeStamper: TimeStamper object.
-        """
-        return structlog.processors.TimeStamper(fmt="%Y-%m-%d %H:%M:%S")
-
-    def preprocessors(self, addit: bool = False) -> list[any]:
-        """
-        Setting up structlog preprocessors.
-        Parameters
-        ----------
-        addit (bool): Flag for additional handlers. Default is False.
-        Returns
-        -------
-        List[any]: List of preprocessors.
-        """
-        preprocessors: list[any] = [
-            self.timestamper,
-            structlog.stdlib.add_log_level,
-            structlog.processors.format_exc_info,
-            structlog.processors.UnicodeDecoder(),
-            structlog.processors.StackInfoRenderer(),
-            structlog.processors.CallsiteParameterAdder(
-                {
-                    structlog.processors.CallsiteParameter.FILENAME,
-                    structlog.processors.CallsiteParameter.FUNC_NAME,
-                    structlog.processors.CallsiteParameter.LINENO,
-                },
-            ),
-            logger_detailed,
-        ]
-        if addit:
-            preprocessors: list[any] = (
-                [
-                    structlog.contextvars.merge_contextvars,
-                    structlog.stdlib.filter_by_level,
-                ]
-                + preprocessors
-                + [
-                    structlog.stdlib.PositionalArgumentsFormatter(),
-                    structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
-                ]
-            )
-        return preprocessors
-
-    def init_structlog(self):
-        """Initializes logging settings using structlog."""
-        handlers = {
-            CONSOLE_HANDLER: {
-                "class": "logging.StreamHandler",
-                "formatter": CONSOLE_FORMATTER,
-            },
-            JSONFORMAT_HANDLER: {
-                "class": "logging.StreamHandler",
-                "formatter": JSONFORMAT_FORMATTER,
-            },
-        }
-
-        logging.config.dictConfig(
-            {
-                "version": 1,
-                "disable_existing_loggers": False,
-                "formatters": {
-                    JSONFORMAT_FORMATTER: {
-                        "()": structlog.stdlib.ProcessorFormatter,
-                        "processor": structlog.processors.JSONRenderer(ensure_ascii=self.ensure_ascii),
-                        "foreign_pre_chain": self.preprocessors(),
-                    },
-                    CONSOLE_FORMATTER: {
-                        "()": structlog.stdlib.ProcessorFormatter,
-                        "processor": structlog.dev.ConsoleRenderer(),
-                        "foreign_pre_chain": self.preprocessors(),
-                    },
-                },
-                "handlers": handlers,
-                "loggers": {
-                    f"{logger_setting.name}": {
-                        "handlers": (
-                            [self.renderer] + ["file_handler"]
-                            if logger_setting.write_file
-                            else [self.renderer]
-                        ),
-                        "level": logger_setting.level.value,
-                        "propagate": logger_setting.propagate,
-                    }
-                    for logger_setting in self.name_registration
-                },
-            },
-        )
-
-        structlog.configure(
-            processors=self.preprocessors(True),
-            logger_factory=structlog.stdlib.LoggerFactory(),
-            cache_logger_on_first_use=True,
-        )
\ No newline at end of file
+"""
+Logging Configuration
+This configuration sets up struct logging with the help of the
+structlog and logging libraries.
+Main features:
+    - Separation of logs by loggers for modules/components of the project.
+    - Convenient syntax for writing logs through loggers.
+    - Possibility to write logs to a file: buffered, rotated by size and time,
+    rotated segments gzipped in a background thread.
+    - Automatic logging to JSON format when working in Docker if
+    DEV environment variable is not set.
+    - Optional queue mode: records are written by a background thread
+    so logging never blocks the event loop.
+    - Development and production profiles (see profiles.py).
+Structlog processors add useful information to logs such as
+request ID, time, log level, etc.
+Configuration allows you to efficiently log application events and
+debug its operation.
+setup_logger.py developed by morington
+https://gist.github.com/morington/906cbc6fca128bde4ab81fb8e8eed849
+"""
+
+import atexit
+import dataclasses
+import logging
+import os
+import sys
+from enum import Enum
+from typing import Optional, Literal
+
+import structlog
+from structlog.typing import EventDict
+
+from src.infrastructure.logger import handlers as queue_handlers
+from src.infrastructure.logger import profiles
+
+# Constants for defining the names of handlers and formatters
+CONSOLE_HANDLER = "console"
+CONSOLE_FORMATTER = "console_formatter"
+
+JSONFORMAT_HANDLER = "jsonformat"
+JSONFORMAT_FORMATTER = "jsonformat_formatter"
+
+FILE_HANDLER = "file_handler"
+
+
+def logger_detailed(logger: logging.Logger, _: str, event_dict: EventDict) -> EventDict:
+    """
+    A function for detailing logs, adding information about the file, function and line number.
+    Parameters
+    ----------
+    logger (logging.Logger): Logger for recording logs.
+    _ (str): Method name.
+    event_dict (EventDict): Event dictionary for logging.
+    Returns
+    -------
+    EventDict: Augmented event dictionary.
+    """
+    filename: str = event_dict.pop("filename")
+    func_name: str = event_dict.pop("func_name")
+    lineno: str = event_dict.pop("lineno")
+
+    event_dict["logger"] = f"{filename}:{func_name}:{lineno}"
+    if logger:
+        event_dict["level"] = f"{logger.name} - {event_dict.get('level')}"
+
+    return event_dict
+
+
+@dataclasses.dataclass(slots=True)
+class LoggerReg:
+    """
+    Class for representing logger settings.
+    Attributes
+    ----------
+    name (str): Logger name.
+    level (Level): Logging level.
+    propagate (bool): Flag to indicate whether messages should be passed to parent loggers. Default is False.
+    write_file (bool): Flag to indicate whether logs should be written to a file. Default is True.
+    file_sink (Optional[FileSink]): File settings, used when write_file is set. Default is "<logs_dir>/<name>.log" with default rotation.
+    callsite (bool): Flag to capture the callsite for every record in the production profile. Default is False.
+    """
+
+    class Level(Enum):
+        DEBUG: str = "DEBUG"
+        INFO: str = "INFO"
+        WARNING: str = "WARNING"
+        ERROR: str = "ERROR"
+        CRITICAL: str = "CRITICAL"
+        NONE: str = None
+
+    name: str
+    level: Level = Level.DEBUG
+    propagate: bool = False
+    write_file: bool = False
+    file_sink: Optional[queue_handlers.FileSink] = None
+    callsite: bool = False
+
+
+class SetupLogger:
+    """
+    Class for setting up logging using structlog.
+    Attributes
+    ----------
+    name_registration (List[LoggerReg]): List of logger settings.
+    default_development (bool): Flag to indicate the development mode, forces the output format to be CONSOLE. Default is False.
+    log_to_file (bool): Flag to indicate that logs are written to a file. Default is False.
+    logs_dir (str): Directory for writing logs. Default is "logs".
+    queue_mode (bool): Flag to write logs from a background thread through a bounded queue. Default is False.
+    queue_size (int): Maximum number of queued records in queue mode. Default is 10000.
+    queue_policy (str): "drop" or "block" when the queue is full. Default is "drop".
+    log_queue (Optional[LogQueue]): Queue used in queue mode, holds the dropped records counter.
+    profile (str): "development" or "production" processor chain. Default is "development".
+    Methods
+    -------
+    __str__(): Returns a string representation of the class.
+    __repr__(): Returns the class representation as a string.
+    renderer(): Returns the logging format depending on the conditions.
+    timestamper(): Returns a TimeStamper object for the logger timestamp.
+    file_sink(logger_setting: LoggerReg): Returns the file sink of a logger with the file name resolved.
+    callsite(): Returns the shared callsite processor of the production profile.
+    wrapper_class(): Returns the structlog wrapper class for the profile.
+    preprocessors(addit: bool = False): Setting up structlog preprocessors.
+    build_preprocessors(): Builds the processor chain of the selected profile.
+    formatters(renderers: set[str]): Returns the formatter configs for the used renderers.
+    init_structlog(): Initializes logging settings using structlog.
+    """
+
+    def __init__(
+            self,
+            name_registration: Optional[list[LoggerReg]],
+            developer_mode: bool = False,
+            select_format: Optional[Literal['console', 'jsonformat']] = None,
+            ensure_ascii: bool = True,
+            queue_mode: bool = False,
+            queue_size: int = 10000,
+            queue_policy: Literal['drop', 'block'] = queue_handlers.DROP_POLICY,
+            profile: Literal['development', 'production'] = profiles.DEVELOPMENT_PROFILE,
+            logs_dir: str = "logs"
+    ) -> None:
+        if profile not in profiles.PROFILES:
+            raise ValueError(f"Unknown logging profile: {profile}")
+        self.profile = profile
+        self.name_registration = ([] if name_registration is None else name_registration)
+        self.name_registration.extend(
+            [LoggerReg(name="_STLOGGER", level=LoggerReg.Level.INFO)]
+        )
+
+        self.developer_mode = developer_mode
+        self.select_format = self.check_format(select_format)
+        self.ensure_ascii = ensure_ascii
+        self.logs_dir = logs_dir
+        self.log_queue = (
+            queue_handlers.LogQueue(maxsize=queue_size, policy=queue_policy) if queue_mode else None
+        )
+        self._callsite = None
+        self._preprocessors = None
+
+        self.module_name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+        self.init_structlog()
+
+    def __str__(self) -> str:
+        return f"<{__class__.__name__} dev:{sys.stderr.isatty()}; Reg {len(self.name_registration)} loggers>"
+
+    def __repr__(self):
+        return self.__str__()
+    
+    @staticmethod
+    def check_format(select_format: Optional[Literal['console', 'jsonformat']]) -> Optional[str]:
+        if select_format in [CONSOLE_HANDLER, JSONFORMAT_HANDLER]:
+            return select_format
+        return None
+
+    @property
+    def renderer(self) -> str:
+        """
+        Returns the logging format depending on the conditions.
+        Returns
+        -------
+        str: Format.
+        """
+        if self.select_format is not None:
+            return self.select_format
+        elif sys.stderr.isatty() or os.environ.get("MODE_DEV", self.developer_mode):
+            return CONSOLE_HANDLER
+        return JSONFORMAT_HANDLER
+
+    @property
+    def timestamper(self) -> structlog.processors.TimeStamper:
+        """
+        Returns a TimeStamper object for the logger timestamp.
+        Returns
+        -------
+        structlog.processors.TimeStamper: TimeStamper object.
+        """
+        return structlog.processors.TimeStamper(fmt="%Y-%m-%d %H:%M:%S")
+
+    @property
+    def callsite(self) -> profiles.GatedCallsite:
+        """
+        Returns the shared callsite processor of the production profile.
+        Returns
+        -------
+        profiles.GatedCallsite: Callsite processor.
+        """
+        if self._callsite is None:
+            self._callsite = profiles.GatedCallsite(
+                loggers=[reg.name for reg in self.name_registration if reg.callsite],
+                min_level=logging.WARNING,
+                additional_ignores=[queue_handlers.__name__, profiles.__name__],
+            )
+        return self._callsite
+
+    @property
+    def wrapper_class(self) -> Optional[type]:
+        """
+        Returns the structlog wrapper class for the selected profile and queue mode.
+        Returns
+        -------
+        Optional[type]: Wrapper class, None for the structlog default.
+        """
+        if self.profile == profiles.PRODUCTION_PROFILE:
+            if self.log_queue is not None:
+                return profiles.LevelGatedQueueBoundLogger
+            return profiles.LevelGatedBoundLogger
+        if self.log_queue is not None:
+            return queue_handlers.QueueBoundLogger
+        return None
+
+    def preprocessors(self, addit: bool = False) -> list[any]:
+        """
+        Setting up structlog preprocessors.
+        The shared chain is built once and reused by the formatters and structlog.
+        Parameters
+        ----------
+        addit (bool): Flag for additional handlers. Default is False.
+        Returns
+        -------
+        List[any]: List of preprocessors.
+        """
+        if self._preprocessors is None:
+            self._preprocessors = self.build_preprocessors()
+        preprocessors: list[any] = list(self._preprocessors)
+        if addit:
+            preprocessors: list[any] = (
+                [
+                    # Level check first, so dropped records skip the rest of the chain
+                    structlog.stdlib.filter_by_level,
+                    structlog.contextvars.merge_contextvars,
+                ]
+                + preprocessors
+                + [
+                    structlog.stdlib.PositionalArgumentsFormatter(),
+                    structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+                ]
+            )
+        return preprocessors
+
+    def build_preprocessors(self) -> list[any]:
+        """
+        Builds the processor chain of the selected profile.
+        Returns
+        -------
+        List[any]: List of preprocessors.
+        """
+        # Logger wrappers of this package sit between the caller and structlog
+        ignores = [queue_handlers.__name__, profiles.__name__]
+        if self.profile == profiles.PRODUCTION_PROFILE:
+            preprocessors: list[any] = [
+                self.timestamper,
+                structlog.stdlib.add_log_level,
+                structlog.processors.format_exc_info,
+                structlog.processors.UnicodeDecoder(),
+                structlog.processors.StackInfoRenderer(),
+                self.callsite,
+            ]
+        else:
+            preprocessors: list[any] = [
+                self.timestamper,
+                structlog.stdlib.add_log_level,
+                structlog.processors.format_exc_info,
+                structlog.processors.UnicodeDecoder(),
+                structlog.processors.StackInfoRenderer(),
+                structlog.processors.CallsiteParameterAdder(
+                    {
+                        structlog.processors.CallsiteParameter.FILENAME,
+                        structlog.processors.CallsiteParameter.FUNC_NAME,
+                        structlog.processors.CallsiteParameter.LINENO,
+                    },
+                    additional_ignores=ignores,
+                ),
+                logger_detailed,
+            ]
+        return preprocessors
+
+    def file_sink(self, logger_setting: LoggerReg) -> queue_handlers.FileSink:
+        """
+        Returns the file sink of a logger with the file name resolved.
+        Parameters
+        ----------
+        logger_setting (LoggerReg): Logger settings.
+        Returns
+        -------
+        FileSink: File sink settings.
+        """
+        sink = logger_setting.file_sink or queue_handlers.FileSink()
+        if sink.filename:
+            return sink
+        return dataclasses.replace(sink, filename=os.path.join(self.logs_dir, f"{logger_setting.name.lower()}.log"))
+
+    def formatters(self, renderers: set[str]) -> dict[str, dict]:
+        """
+        Returns the formatter configs for the given renderers only.
+        Parameters
+        ----------
+        renderers (set[str]): Handler names whose formatters are needed.
+        Returns
+        -------
+        dict[str, dict]: Formatters section of the dictConfig.
+        """
+        formatters = {}
+        if JSONFORMAT_HANDLER in renderers:
+            formatters[JSONFORMAT_FORMATTER] = {
+                "()": queue_handlers.RenderOnceFormatter,
+                "processor": structlog.processors.JSONRenderer(ensure_ascii=self.ensure_ascii),
+                "foreign_pre_chain": self.preprocessors(),
+            }
+        if CONSOLE_HANDLER in renderers:
+            # ConsoleRenderer is not created when the console output is not used
+            formatters[CONSOLE_FORMATTER] = {
+                "()": queue_handlers.RenderOnceFormatter,
+                "processor": structlog.dev.ConsoleRenderer(),
+                "foreign_pre_chain": self.preprocessors(),
+            }
+        return formatters
+
+    def init_structlog(self):
+        """Initializes logging settings using structlog."""
+        # Deferred: dictConfig is only needed once, at setup
+        import logging.config
+
+        renderer = self.renderer
+        handlers = {
+            renderer: {
+                "class": "logging.StreamHandler",
+                "formatter": CONSOLE_FORMATTER if renderer == CONSOLE_HANDLER else JSONFORMAT_FORMATTER,
+            },
+        }
+        # File handlers always write JSON lines with the shared JSON formatter,
+        # so in JSON mode a record is rendered once for the console and the file
+        for logger_setting in self.name_registration:
+            if logger_setting.write_file:
+                handlers[f"{FILE_HANDLER}_{logger_setting.name}"] = {
+                    "()": queue_handlers.BufferedRotatingFileHandler,
+                    "formatter": JSONFORMAT_FORMATTER,
+                    "sink": self.file_sink(logger_setting),
+                }
+
+        writes_file = any(logger_setting.write_file for logger_setting in self.name_registration)
+
+        logging.config.dictConfig(
+            {
+                "version": 1,
+                "disable_existing_loggers": False,
+                "formatters": self.formatters({renderer, JSONFORMAT_HANDLER} if writes_file else {renderer}),
+                "handlers": handlers,
+                "loggers": {
+                    f"{logger_setting.name}": {
+                        "handlers": (
+                            [renderer] + [f"{FILE_HANDLER}_{logger_setting.name}"]
+                            if logger_setting.write_file
+                            else [renderer]
+                        ),
+                        "level": logger_setting.level.value,
+                        "propagate": logger_setting.propagate,
+                    }
+                    for logger_setting in self.name_registration
+                },
+            },
+        )
+
+        if self.log_queue is not None:
+            self.init_queue()
+
+        structlog.configure(
+            processors=self.preprocessors(True),
+            logger_factory=structlog.stdlib.LoggerFactory(),
+            cache_logger_on_first_use=True,
+            **({"wrapper_class": self.wrapper_class} if self.wrapper_class is not None else {}),
+        )
+
+    def init_queue(self):
+        """Moves the handlers of registered loggers behind a single background writer."""
+        for logger_setting in self.name_registration:
+            std_logger = logging.getLogger(logger_setting.name)
+            targets = list(std_logger.handlers)
+            for handler in targets:
+                std_logger.removeHandler(handler)
+            std_logger.addHandler(self.log_queue.handler(targets))
+        self.log_queue.start()
+        atexit.register(self.log_queue.stop)
\ No newline at end of file
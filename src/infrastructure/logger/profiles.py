@@ -0,0 +1,140 @@
+"""
+Logging profiles.
+    - development: every record gets the callsite (file:function:line), the full processor chain runs.
+    - production: records below the logger level are dropped before any processor work,
+    the callsite is captured only for loggers that ask for it or for WARNING and above.
+"""
+
+import logging
+import os
+from typing import Any, Iterable
+
+import structlog
+from structlog.processors import CallsiteParameter, CallsiteParameterAdder
+from structlog.typing import EventDict
+
+from src.infrastructure.logger.handlers import QueueBoundLogger
+
+DEVELOPMENT_PROFILE = "development"
+PRODUCTION_PROFILE = "production"
+PROFILES = (DEVELOPMENT_PROFILE, PRODUCTION_PROFILE)
+
+_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "warn": logging.WARNING,
+    "error": logging.ERROR,
+    "exception": logging.ERROR,
+    "critical": logging.CRITICAL,
+    "fatal": logging.CRITICAL,
+}
+
+
+class GatedCallsite:
+    """
+    Level-gated CallsiteParameterAdder + logger_detailed.
+    Records below `min_level` skip the frame walk unless their logger is listed in `loggers`.
+    Attributes
+    ----------
+    loggers (set[str]): Names of loggers that always capture the callsite.
+    min_level (int): Level from which the callsite is captured for every logger.
+    additional_ignores (list[str]): Module prefixes that are not considered as the callsite.
+    """
+
+    __slots__ = ("loggers", "min_level", "additional_ignores", "_adder")
+
+    def __init__(self, loggers: Iterable[str], min_level: int = logging.WARNING, additional_ignores: list[str] = None):
+        self.loggers = set(loggers)
+        self.min_level = min_level
+        self.additional_ignores = list(additional_ignores or [])
+        self._adder = CallsiteParameterAdder(
+            {CallsiteParameter.FILENAME, CallsiteParameter.FUNC_NAME, CallsiteParameter.LINENO},
+            # The adder is called from here, so this module is never the callsite
+            additional_ignores=[__name__, *self.additional_ignores],
+        )
+
+    def __call__(self, logger: logging.Logger, method_name: str, event_dict: EventDict) -> EventDict:
+        name = logger.name if logger else None
+        if name is not None:
+            event_dict["level"] = f"{name} - {event_dict.get('level')}"
+        if _LEVELS.get(method_name, logging.CRITICAL) < self.min_level and name not in self.loggers:
+            return event_dict
+
+        # Frame lookup (or the stdlib record for foreign logs) is done by structlog
+        self._adder(logger, method_name, event_dict)
+        filename = os.path.basename(event_dict.pop("filename"))
+        event_dict["logger"] = f"{filename}:{event_dict.pop('func_name')}:{event_dict.pop('lineno')}"
+        return event_dict
+
+
+class LevelGatedBoundLogger(structlog.stdlib.BoundLogger):
+    """BoundLogger that checks the stdlib logger level before running processors or the executor hop."""
+
+    def debug(self, event: Any = None, *args: Any, **kw: Any) -> Any:
+        if self.isEnabledFor(logging.DEBUG):
+            return super().debug(event, *args, **kw)
+
+    def info(self, event: Any = None, *args: Any, **kw: Any) -> Any:
+        if self.isEnabledFor(logging.INFO):
+            return super().info(event, *args, **kw)
+
+    def warning(self, event: Any = None, *args: Any, **kw: Any) -> Any:
+        if self.isEnabledFor(logging.WARNING):
+            return super().warning(event, *args, **kw)
+
+    warn = warning
+
+    def error(self, event: Any = None, *args: Any, **kw: Any) -> Any:
+        if self.isEnabledFor(logging.ERROR):
+            return super().error(event, *args, **kw)
+
+    def exception(self, event: Any = None, *args: Any, **kw: Any) -> Any:
+        if self.isEnabledFor(logging.ERROR):
+            return super().exception(event, *args, **kw)
+
+    def critical(self, event: Any = None, *args: Any, **kw: Any) -> Any:
+        if self.isEnabledFor(logging.CRITICAL):
+            return super().critical(event, *args, **kw)
+
+    fatal = critical
+
+    def log(self, level: int, event: Any = None, *args: Any, **kw: Any) -> Any:
+        if self.isEnabledFor(level):
+            return super().log(level, event, *args, **kw)
+
+    async def adebug(self, event: str, *args: Any, **kw: Any) -> None:
+        if self.isEnabledFor(logging.DEBUG):
+            await super().adebug(event, *args, **kw)
+
+    async def ainfo(self, event: str, *args: Any, **kw: Any) -> None:
+        if self.isEnabledFor(logging.INFO):
+            await super().ainfo(event, *args, **kw)
+
+    async def awarning(self, event: str, *args: Any, **kw: Any) -> None:
+        if self.isEnabledFor(logging.WARNING):
+            await super().awarning(event, *args, **kw)
+
+    async def aerror(self, event: str, *args: Any, **kw: Any) -> None:
+        if self.isEnabledFor(logging.ERROR):
+            await super().aerror(event, *args, **kw)
+
+    async def aexception(self, event: str, *args: Any, **kw: Any) -> None:
+        if self.isEnabledFor(logging.ERROR):
+            await super().aexception(event, *args, **kw)
+
+    async def acritical(self, event: str, *args: Any, **kw: Any) -> None:
+        if self.isEnabledFor(logging.CRITICAL):
+            await super().acritical(event, *args, **kw)
+
+    async def afatal(self, event: str, *args: Any, **kw: Any) -> None:
+        if self.isEnabledFor(logging.CRITICAL):
+            await super().afatal(event, *args, **kw)
+
+    async def alog(self, level: Any, event: str, *args: Any, **kw: Any) -> None:
+        if self.isEnabledFor(level):
+            await super().alog(level, event, *args, **kw)
+
+
+class LevelGatedQueueBoundLogger(LevelGatedBoundLogger, QueueBoundLogger):
+    """Level gate in front of the in-place logging of queue mode."""
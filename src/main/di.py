@@ -2,6 +2,8 @@ from typing import NewType
 
 from dishka import provide, Provider, Scope
 
+from src.main.new_app.state import StateStore
+
 # t_config = NewType("t_config", dict)
 
 class ConfigProvider(Provider):
@@ -10,3 +12,12 @@ class ConfigProvider(Provider):
     @provide
     def get_config(self) -> dict:
         return dict()
+
+
+class StateProvider(Provider):
+    scope = Scope.APP
+
+    @provide
+    def get_state(self) -> StateStore:
+        # Одно хранилище на приложение: пишут KV-подписчики, читают остальные
+        return StateStore()
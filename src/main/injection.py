@@ -0,0 +1,128 @@
+"""
+Fast path for Dishka-injected FastStream handlers.
+Handlers whose dependencies are all APP-scoped get them resolved once and bound
+as keyword arguments: no request container and no resolution per message.
+Handlers that need REQUEST-scoped providers enter the request scope themselves,
+only for their own messages, instead of a broker middleware doing it for every message.
+Use setup_injection(container, app) in place of setup_dishka(container, app, auto_inject=True).
+"""
+
+import asyncio
+import functools
+from inspect import signature
+from typing import Any, Callable, get_type_hints
+
+import structlog
+from dishka import AsyncContainer
+from dishka.entities.key import DependencyKey
+from dishka.integrations.base import default_parse_dependency, wrap_injection
+from faststream import FastStream, context
+from faststream.broker.message import StreamMessage
+from faststream.utils.context import ContextRepo
+
+from src.infrastructure.logger.loggers import InitLoggers
+
+logger = structlog.getLogger(InitLoggers.main.name)
+
+
+def dependencies(func: Callable) -> dict[str, DependencyKey]:
+    """Parameters of `func` annotated with FromDishka[...], by name."""
+    hints = get_type_hints(func, include_extras=True)
+    result = {}
+    for name, param in signature(func).parameters.items():
+        key = default_parse_dependency(param, hints.get(name, Any))
+        if key is not None:
+            result[name] = key
+    return result
+
+
+def _request_context(args: tuple, kwargs: dict) -> dict:
+    # То же, что кладёт в запрос DishkaMiddleware
+    msg = context.get_local("message")
+    return {StreamMessage: msg, ContextRepo: context, type(msg): msg}
+
+
+class PrecompiledInjector:
+    """
+    Injection decorator bound to the APP container.
+    APP-scoped values are resolved on startup (or on the first message) and cached
+    in `values`; handlers are wrapped once, when FastStream builds their call.
+    """
+
+    def __init__(self, container: AsyncContainer):
+        self.container = container
+        self.values: dict[DependencyKey, Any] = {}
+        self.pending: set[DependencyKey] = set()
+        self.lock = asyncio.Lock()  # Одновременные первые сообщения ждут одного разрешения
+
+    def app_scoped(self, key: DependencyKey) -> bool:
+        # В реестре APP-контейнера есть фабрики только APP-скоупа
+        return self.container.registry.get_factory(key) is not None
+
+    async def resolve(self):
+        async with self.lock:
+            while self.pending:
+                # Ключ остаётся в pending, пока значение не записано: иначе параллельный
+                # вызов решит, что всё разрешено, и не найдёт значения
+                key = next(iter(self.pending))
+                self.values[key] = await self.container.get(key.type_hint, key.component)
+                self.pending.discard(key)
+
+    def inject(self, func: Callable) -> Callable:
+        # Обработчик с явным @inject оборачиваем заново, от исходной функции
+        func = getattr(func, "__dishka_orig_func__", func)
+        deps = dependencies(func)
+        if not deps:
+            return func
+        if not all(self.app_scoped(key) for key in deps.values()):
+            # Нужен REQUEST-скоуп: входим в него сами, только для этого обработчика
+            return wrap_injection(
+                func=func,
+                container_getter=lambda args, kwargs: self.container,
+                is_async=True,
+                manage_scope=True,
+                provide_context=_request_context,
+            )
+        self.pending.update(key for key in deps.values() if key not in self.values)
+        bound = tuple(deps.items())
+        values = self.values
+
+        @functools.wraps(func)
+        async def injected(*args: Any, **kwargs: Any) -> Any:
+            if self.pending:
+                await self.resolve()
+            for name, key in bound:
+                kwargs[name] = values[key]
+            return await func(*args, **kwargs)
+
+        # FastStream строит модель аргументов по сигнатуре: зависимости из неё убираем,
+        # аннотации остальных параметров передаём уже вычисленными
+        hints = get_type_hints(func, include_extras=True)
+        func_signature = signature(func)
+        injected.__signature__ = func_signature.replace(parameters=[
+            param.replace(annotation=hints.get(name, param.annotation))
+            for name, param in func_signature.parameters.items() if name not in deps
+        ])
+        injected.__annotations__ = {name: hint for name, hint in hints.items() if name not in deps}
+        injected.__dishka_injected__ = True
+        injected.__dishka_orig_func__ = func
+        logger.debug("Dependencies bound", handler=func.__qualname__, deps=sorted(deps))
+        return injected
+
+
+def setup_injection(container: AsyncContainer, app: FastStream) -> PrecompiledInjector:
+    """
+    Installs the injector on the app broker; the container is closed after shutdown.
+    Relies on BrokerUsecase._call_decorators of FastStream 0.5, the same hook
+    setup_dishka(auto_inject=True) uses; check it when upgrading FastStream.
+    """
+    if not hasattr(app.broker, "_call_decorators"):
+        raise RuntimeError(
+            f"{type(app.broker).__name__} has no _call_decorators: setup_injection supports FastStream 0.5"
+        )
+    injector = PrecompiledInjector(container)
+    app.after_startup(injector.resolve)
+    app.after_shutdown(container.close)
+    # Тот же механизм, что у setup_dishka(auto_inject=True), но без DishkaMiddleware
+    app.broker._call_decorators = (injector.inject, *app.broker._call_decorators)
+    return injector
@@ -1,21 +1,30 @@
 import asyncio
 
 import structlog
-from faststream.nats import NatsBroker
 
 from src.infrastructure.logger.loggers import InitLoggers
-from src.main import subs
+from src.main import startup
 
 logger = structlog.getLogger(InitLoggers.main.name)
 
 
-async def main() -> None:
-    await logger.ainfo("Start app")
+def create_broker():
+    # faststream и подписчики импортируются при запуске, а не при импорте модуля
+    from faststream.nats import NatsBroker
+
+    from src.main import subs
 
     broker = NatsBroker(
         servers=["nats://127.0.0.1:30114"]
     )
     broker.include_router(subs.router)
+    return broker
+
+
+async def main() -> None:
+    await logger.ainfo("Start app")
+
+    broker = create_broker()
     await broker.connect()
 
     await broker.publish(
@@ -35,6 +44,18 @@ async def main() -> None:
     # await r()
 
 
+def profile_startup() -> None:
+    profile = startup.StartupProfile(__spec__.name if __spec__ else "src.main.main")
+    with profile.phase("logger setup"):
+        InitLoggers()
+    with profile.phase("import faststream, subscribers; create broker"):
+        create_broker()
+    print(profile.report())
+
+
 if __name__ == "__main__":
-    InitLoggers()
-    asyncio.run(main())
+    if startup.requested():
+        profile_startup()
+    else:
+        InitLoggers()
+        asyncio.run(main())
@@ -0,0 +1,238 @@
+import asyncio
+import dataclasses
+import heapq
+import time
+from typing import Optional
+
+import structlog
+from nats.aio.msg import Msg
+from nats.errors import MsgAlreadyAckdError
+
+from src.main.new_app.metrics import Metrics
+
+logger: structlog.BoundLogger = structlog.getLogger("NATSClient")
+
+
+@dataclasses.dataclass(slots=True)
+class AckSettings:
+    # AckPolicy.ALL: одно подтверждение закрывает все сообщения консюмера до него.
+    # Только когда durable читает один процесс: чужие неподтверждённые сообщения тоже будут закрыты
+    cumulative: bool = True
+    max_count: int = 64  # Отправить, когда накопилось столько подтверждений
+    interval: float = 0.05  # Отправить не позже чем через столько секунд после первого
+    # Сообщение после nak или истечения ack_wait, которое сервер не доставил повторно
+    # за это время, больше не задерживает подтверждение следующих (max_deliver исчерпан)
+    stale_after: float = 60.0
+    # Подтверждённые, но задержанные незавершённым сообщением получают in_progress с этим
+    # интервалом, иначе после ack_wait сервер доставит их повторно. PullConsumer ставит ack_wait / 2
+    progress_interval: Optional[float] = None
+
+    def __post_init__(self):
+        if self.max_count < 1:
+            raise ValueError("max_count must be >= 1")
+        if self.interval <= 0:
+            raise ValueError("interval must be > 0")
+        if self.progress_interval is not None and self.progress_interval <= 0:
+            raise ValueError("progress_interval must be > 0")
+
+
+class AckCoalescer:
+    """
+    Buffers acks of delivered messages and sends them by count or time.
+    In cumulative mode only the last message of the contiguous run of acked
+    stream sequences is acked (AckPolicy.ALL); a message that is still being
+    processed or was nak'ed holds back the acks after it; held-back messages get
+    in_progress every `progress_interval` so ack_wait does not expire on them.
+    Otherwise the buffered acks are sent one by one in a single burst. nak, term
+    and in_progress are never delayed.
+    """
+
+    def __init__(self, settings: Optional[AckSettings] = None, metrics: Optional[Metrics] = None, name: str = ""):
+        self.settings = settings or AckSettings()
+        self.name = name
+        self.sequences: list[int] = []  # Куча stream sequence доставленных, но не отправленных подтверждений
+        self.acked: dict[int, Msg] = {}  # Подтверждённые коллбеком, ждут отправки
+        self.touched: dict[int, float] = {}  # Когда сервер последний раз слышал о подтверждённом (ack_wait)
+        self.held: dict[int, float] = {}  # nak и незавершённые: sequence -> когда перестать ждать
+        self.buffered: list[Msg] = []  # Некумулятивный режим
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.flushing: Optional[asyncio.Task] = None
+        self.metrics = metrics
+        if metrics is not None:
+            self.acks = metrics.counter("nats_acks_total", "Messages acked by callbacks", consumer=name)
+            self.sent = metrics.counter("nats_ack_requests_total", "Acks sent to the server", consumer=name)
+
+    def __repr__(self):
+        pending = len(self.acked) if self.settings.cumulative else len(self.buffered)
+        return f"<{self.__class__.__name__} {self.name} pending:{pending} held:{len(self.held)}>"
+
+    def wrap(self, msg: Msg) -> "CoalescedMsg":
+        if self.settings.cumulative:
+            seq = msg.metadata.sequence.stream
+            if seq not in self.held:
+                heapq.heappush(self.sequences, seq)
+            # Доставлено (или доставлено повторно): ждём результата коллбека
+            self.held[seq] = float("inf")
+        return CoalescedMsg(msg, self)
+
+    def ack(self, msg: Msg):
+        if self.metrics is not None:
+            self.acks.inc()
+        if self.settings.cumulative:
+            seq = msg.metadata.sequence.stream
+            self.held.pop(seq, None)
+            self.acked[seq] = msg
+            self.touched[seq] = time.monotonic()
+            count = len(self.acked)
+        else:
+            self.buffered.append(msg)
+            count = len(self.buffered)
+        if count >= self.settings.max_count:
+            self._schedule(0)
+        elif self.timer is None:
+            self._schedule(self.settings.interval)
+
+    def nak(self, msg: Msg, delay: Optional[float] = None):
+        if self.settings.cumulative:
+            # Ждём повторной доставки; если её не будет - не дольше stale_after
+            self.held[msg.metadata.sequence.stream] = time.monotonic() + (delay or 0) + self.settings.stale_after
+
+    def term(self, msg: Msg):
+        if self.settings.cumulative:
+            # Сервер забыл сообщение: оно не мешает подтверждать следующие
+            seq = msg.metadata.sequence.stream
+            self.held.pop(seq, None)
+            self.acked.pop(seq, None)
+            self.touched.pop(seq, None)
+
+    def abandon(self, msg: Msg):
+        # Коллбек завершился без ack/nak/term: сообщение придёт повторно после ack_wait
+        if self.settings.cumulative:
+            seq = msg.metadata.sequence.stream
+            if seq in self.held:
+                self.held[seq] = time.monotonic() + self.settings.stale_after
+
+    def _schedule(self, delay: float):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = asyncio.get_running_loop().call_later(delay, self._start_flush)
+
+    def _start_flush(self):
+        self.timer = None
+        if self.flushing is None or self.flushing.done():
+            self.flushing = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        """Sends the acks that can be sent now."""
+        if self.settings.cumulative:
+            messages = self._contiguous()
+            if self.acked and self.settings.progress_interval is not None:
+                await self._extend()
+        else:
+            messages, self.buffered = self.buffered, []
+        for msg in messages:
+            try:
+                await msg.ack()
+            except MsgAlreadyAckdError:
+                continue
+            except Exception:
+                await logger.aexception("Ack failed", consumer=self.name)
+                continue
+            if self.metrics is not None:
+                self.sent.inc()
+        if self.acked and self.timer is None:
+            # Подтверждения за задерживающим сообщением: проверим снова
+            self._schedule(self.settings.interval)
+
+    async def _extend(self):
+        # Задержанные подтверждения: продлеваем ack_wait, пока не уйдёт общее
+        now = time.monotonic()
+        for seq, msg in list(self.acked.items()):
+            if now - self.touched.get(seq, now) < self.settings.progress_interval:
+                continue
+            self.touched[seq] = now
+            try:
+                await msg.in_progress()
+            except Exception:
+                await logger.aexception("in_progress failed", consumer=self.name)
+
+    def _contiguous(self) -> list[Msg]:
+        # Поднимаемся по sequence, пока сообщения подтверждены; одно ack на последнее из них
+        now = time.monotonic()
+        last = None
+        while self.sequences:
+            seq = self.sequences[0]
+            held = self.held.get(seq)
+            if held is not None and held > now:
+                break
+            heapq.heappop(self.sequences)
+            self.held.pop(seq, None)
+            self.touched.pop(seq, None)
+            msg = self.acked.pop(seq, None)
+            if msg is not None:
+                last = msg
+        return [last] if last is not None else []
+
+    async def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.flushing is not None:
+            await asyncio.gather(self.flushing, return_exceptions=True)
+        await self.flush()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+
+class CoalescedMsg:
+    """Msg proxy whose ack() goes through an AckCoalescer; everything else goes to the wrapped Msg."""
+
+    __slots__ = ("msg", "coalescer", "_ackd")
+
+    def __init__(self, msg: Msg, coalescer: AckCoalescer):
+        self.msg = msg
+        self.coalescer = coalescer
+        self._ackd = False
+
+    async def ack(self):
+        self._check()
+        self._ackd = True
+        self.coalescer.ack(self.msg)
+
+    async def ack_sync(self, timeout: float = 1):
+        # Не откладывается: накопленные подтверждения уходят сразу
+        if not self.coalescer.settings.cumulative:
+            self._check()
+            self._ackd = True
+            return await self.msg.ack_sync(timeout)
+        await self.ack()
+        await self.coalescer.flush()
+
+    async def nak(self, delay: Optional[float] = None):
+        self._check()
+        await self.msg.nak(delay)
+        self._ackd = True
+        self.coalescer.nak(self.msg, delay)
+
+    async def term(self):
+        self._check()
+        await self.msg.term()
+        self._ackd = True
+        self.coalescer.term(self.msg)
+
+    @property
+    def settled(self) -> bool:
+        return self._ackd
+
+    def _check(self):
+        if self._ackd:
+            raise MsgAlreadyAckdError(self)
+
+    def done(self):
+        # Вызывается после коллбека
+        if not self._ackd:
+            self.coalescer.abandon(self.msg)
+
+    def __getattr__(self, item):
+        return getattr(self.msg, item)
@@ -0,0 +1,407 @@
+import abc
+import asyncio
+import collections
+import dataclasses
+import zlib
+from typing import Any, Awaitable, Callable, Optional, Union
+
+import ormsgpack
+import structlog
+
+from src.main.new_app.metrics import EXPORT_BOUNDS_COUNT, Metrics
+from src.main.new_app.publisher import PublishPipeline, PublishResult
+
+logger: structlog.BoundLogger = structlog.getLogger("NATSClient")
+
+# Заголовки конверта: маркер с версией формата, число сообщений внутри и сжатие тела.
+# Конвертом считается только сообщение с маркером: Batch-Count мог поставить кто угодно
+ENVELOPE_HEADER = "Batch-Envelope"
+ENVELOPE_VERSION = "1"
+COUNT_HEADER = "Batch-Count"
+ENCODING_HEADER = "Batch-Encoding"
+
+
+class Compression(abc.ABC):
+    name: str = ""
+
+    @abc.abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    @abc.abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        ...
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.name}>"
+
+
+class ZstdCompression(Compression):
+    name = "zstd"
+
+    def __init__(self, level: int = 3):
+        # zstandard нужен только тем, кто включил сжатие zstd
+        import zstandard
+
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        # Размер исходных данных записан во фрейме compress()
+        return self.decompressor.decompress(data)
+
+
+class Lz4Compression(Compression):
+    name = "lz4"
+
+    def __init__(self):
+        import lz4.frame
+
+        self.lz4 = lz4.frame
+
+    def compress(self, data: bytes) -> bytes:
+        return self.lz4.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self.lz4.decompress(data)
+
+
+class ZlibCompression(Compression):
+    # Из стандартной библиотеки: медленнее zstd/lz4, но всегда доступен
+    name = "zlib"
+
+    def __init__(self, level: int = 1):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+COMPRESSIONS: dict[str, type[Compression]] = {
+    ZstdCompression.name: ZstdCompression,
+    Lz4Compression.name: Lz4Compression,
+    ZlibCompression.name: ZlibCompression,
+}
+_instances: dict[str, Compression] = {}
+
+
+def get_compression(compression: Union[str, Compression, None]) -> Optional[Compression]:
+    if compression is None or isinstance(compression, Compression):
+        return compression
+    if compression not in _instances:
+        try:
+            _instances[compression] = COMPRESSIONS[compression]()
+        except KeyError:
+            raise ValueError(
+                f"Unknown compression {compression!r}, expected one of {sorted(COMPRESSIONS)}"
+            ) from None
+    return _instances[compression]
+
+
+def pack(payloads: list[bytes], compression: Optional[Compression] = None, min_size: int = 0) -> tuple[bytes, dict]:
+    """Builds an envelope: msgpack array of payloads, compressed when larger than `min_size`."""
+    body = ormsgpack.packb(payloads)
+    headers = {ENVELOPE_HEADER: ENVELOPE_VERSION, COUNT_HEADER: str(len(payloads))}
+    if compression is not None and len(body) >= min_size:
+        compressed = compression.compress(body)
+        # Несжимаемые данные отправляем как есть
+        if len(compressed) < len(body):
+            body = compressed
+            headers[ENCODING_HEADER] = compression.name
+    return body, headers
+
+
+def unpack(data: bytes, headers: Optional[dict]) -> list[bytes]:
+    """Payloads of an envelope; ValueError if it is not a well-formed envelope of a known version."""
+    headers = headers or {}
+    version = headers.get(ENVELOPE_HEADER)
+    if version != ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported envelope version {version!r}")
+    encoding = headers.get(ENCODING_HEADER)
+    # Неизвестное сжатие - ValueError; ImportError (нет zstandard / lz4) не прячем: другой процесс разберёт
+    compression = get_compression(encoding) if encoding else None
+    try:
+        if compression is not None:
+            data = compression.decompress(data)
+        payloads = ormsgpack.unpackb(data)
+    except Exception as e:
+        raise ValueError(f"Malformed envelope: {e!r}") from e
+    if not isinstance(payloads, list) or not all(isinstance(p, bytes) for p in payloads):
+        raise ValueError("Malformed envelope: expected an array of byte strings")
+    if headers.get(COUNT_HEADER) != str(len(payloads)):
+        raise ValueError(f"Malformed envelope: {len(payloads)} messages, header says {headers.get(COUNT_HEADER)}")
+    return payloads
+
+
+def is_envelope(msg) -> bool:
+    return bool(msg.headers) and ENVELOPE_HEADER in msg.headers
+
+
+@dataclasses.dataclass(slots=True)
+class BatchSettings:
+    max_count: int = 500  # Сообщений в одном конверте
+    max_bytes: int = 256 * 1024  # Размер тела до сжатия; должен быть меньше max_payload сервера
+    linger: float = 0.005  # Сколько неполный конверт ждёт новых сообщений, секунды
+    # zlib из стандартной библиотеки; zstd и lz4 быстрее, но требуют zstandard / lz4
+    compression: Optional[str] = "zlib"  # zstd, lz4, zlib или None
+    min_compress_bytes: int = 512  # Маленькие конверты не сжимаем
+
+    def __post_init__(self):
+        if self.max_count < 1:
+            raise ValueError("max_count must be >= 1")
+        if self.max_bytes < 1:
+            raise ValueError("max_bytes must be >= 1")
+        if self.linger < 0:
+            raise ValueError("linger must be >= 0")
+
+
+class _Batch:
+    __slots__ = ("payloads", "size", "futures", "timer")
+
+    def __init__(self):
+        self.payloads: list[bytes] = []
+        self.size = 0
+        self.futures: list[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class BatchPublisher:
+    """
+    Coalesces messages per subject into compressed envelopes.
+    An envelope is sent when it reaches `max_count` messages or `max_bytes`,
+    or `linger` seconds after its first message. Envelopes go through the
+    PublishPipeline, so the publish window and retries apply to them.
+    """
+
+    def __init__(self, pipeline: PublishPipeline, settings: Optional[BatchSettings] = None,
+                 metrics: Optional[Metrics] = None, name: str = ""):
+        self.pipeline = pipeline
+        self.settings = settings or BatchSettings()
+        self.compression = get_compression(self.settings.compression)  # Ошибка импорта - сразу при создании
+        self.batches: dict[str, _Batch] = {}
+        self.sending: set[asyncio.Task] = set()
+        self.metrics = metrics
+        if metrics is not None:
+            self.envelope_sizes = metrics.histogram(
+                "nats_envelope_messages", "Messages per published envelope", scale=1, bounds=EXPORT_BOUNDS_COUNT,
+                client=name
+            )
+            self.raw_bytes = metrics.counter(
+                "nats_envelope_raw_bytes_total", "Envelope bytes before compression", client=name
+            )
+            self.sent_bytes = metrics.counter("nats_envelope_sent_bytes_total", "Envelope bytes sent", client=name)
+
+    @property
+    def buffered(self) -> int:
+        return sum(len(batch.payloads) for batch in self.batches.values())
+
+    async def add(self, subject: str, payload: bytes) -> asyncio.Future:
+        """Buffers one message; the future resolves to the PublishResult of its envelope."""
+        batch = self.batches.get(subject)
+        if batch is not None and batch.size + len(payload) > self.settings.max_bytes:
+            await self._send(subject)
+            batch = None
+        if batch is None:
+            batch = self.batches[subject] = _Batch()
+            batch.timer = asyncio.get_running_loop().call_later(self.settings.linger, self._expire, subject, batch)
+        future = asyncio.get_running_loop().create_future()
+        batch.payloads.append(payload)
+        batch.size += len(payload)
+        batch.futures.append(future)
+        if len(batch.payloads) >= self.settings.max_count or batch.size >= self.settings.max_bytes:
+            await self._send(subject)
+        return future
+
+    def _expire(self, subject: str, batch: _Batch):
+        if self.batches.get(subject) is batch:
+            task = asyncio.create_task(self._send(subject))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    async def _send(self, subject: str):
+        batch = self.batches.pop(subject, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        try:
+            body, headers = pack(batch.payloads, self.compression, self.settings.min_compress_bytes)
+            # submit ждёт места в окне публикаций: медленный сервер тормозит производителя
+            task = await self.pipeline.submit(subject, body, headers=headers)
+        except BaseException as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        if self.metrics is not None:
+            self.envelope_sizes.record(len(batch.payloads))
+            self.raw_bytes.inc(batch.size)
+            self.sent_bytes.inc(len(body))
+        task.add_done_callback(_resolver(batch.futures))
+
+    async def flush(self) -> list[PublishResult]:
+        # Отправляем все неполные конверты и ждём их PubAck
+        for subject in list(self.batches):
+            await self._send(subject)
+        if self.sending:
+            await asyncio.gather(*self.sending, return_exceptions=True)
+        return await self.pipeline.flush()
+
+
+def _resolver(futures: list[asyncio.Future]) -> Callable[[asyncio.Task], None]:
+    def resolve(task: asyncio.Task):
+        for future in futures:
+            if future.done():
+                continue
+            if task.cancelled():
+                future.cancel()
+            else:
+                future.set_result(task.result())
+
+    return resolve
+
+
+@dataclasses.dataclass(slots=True)
+class ItemFailure:
+    index: int
+    error: Optional[BaseException]  # None - сообщение отклонено через nak()
+
+
+class _ItemMsg:
+    """One message of an envelope; ack/nak are recorded and applied to the envelope as a whole."""
+
+    __slots__ = ("envelope", "index", "data", "state", "_ackd")
+
+    def __init__(self, envelope, index: int, data: bytes):
+        self.envelope = envelope
+        self.index = index
+        self.data = data
+        self.state: Optional[str] = None  # ack / nak / term
+        self._ackd = False
+
+    @property
+    def headers(self) -> Optional[dict]:
+        return None
+
+    async def ack(self):
+        self.state = "ack"
+        self._ackd = True
+
+    async def ack_sync(self, timeout: float = 1):
+        await self.ack()
+
+    async def nak(self, delay: Optional[float] = None):
+        self.state = "nak"
+        self._ackd = True
+
+    async def term(self):
+        self.state = "term"
+        self._ackd = True
+
+    async def in_progress(self):
+        await self.envelope.in_progress()
+
+    def __getattr__(self, item):
+        # subject, reply, metadata - от конверта
+        return getattr(self.envelope, item)
+
+
+class Unpacker:
+    """
+    Message callback wrapper that hands the callback each message of an envelope.
+    Messages are processed in order. The envelope is acked when every message
+    is acked (or terminated) and nak'ed when any message fails; messages that
+    already succeeded are skipped when the envelope is redelivered to this process.
+    An envelope that can not be decoded is terminated, not nak'ed: redelivery
+    would not fix it. Messages without the envelope marker pass through unchanged.
+    """
+
+    def __init__(self, callback: Callable[[Any], Awaitable[None]], metrics: Optional[Metrics] = None,
+                 name: str = "", remember: int = 1024,
+                 on_failure: Optional[Callable[[Any, list[ItemFailure]], Awaitable[None]]] = None):
+        self.callback = callback
+        self.on_failure = on_failure
+        self.remember = remember
+        # (stream, stream_seq) -> индексы обработанных сообщений частично упавших конвертов
+        self.completed: collections.OrderedDict[tuple, set[int]] = collections.OrderedDict()
+        self.metrics = metrics
+        if metrics is not None:
+            self.item_failures = metrics.counter(
+                "nats_envelope_item_errors_total", "Failed messages inside envelopes", consumer=name
+            )
+            self.malformed = metrics.counter(
+                "nats_envelope_malformed_total", "Envelopes terminated because they could not be decoded",
+                consumer=name,
+            )
+
+    async def __call__(self, msg):
+        if not is_envelope(msg):
+            return await self.callback(msg)
+        try:
+            payloads = unpack(msg.data, msg.headers)
+        except ValueError as e:
+            # Повторная доставка не исправит конверт: term вместо бесконечных nak
+            if self.metrics is not None:
+                self.malformed.inc()
+            await logger.aerror("Envelope can not be decoded, terminating", subject=msg.subject, error=str(e))
+            await msg.term()
+            return
+        key = self._key(msg)
+        done = self.completed.pop(key, set()) if key is not None else set()
+        failures: list[ItemFailure] = []
+        pending = False
+        for index, data in enumerate(payloads):
+            if index in done:
+                continue
+            item = _ItemMsg(msg, index, data)
+            try:
+                await self.callback(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures.append(ItemFailure(index, e))
+                continue
+            if item.state in ("ack", "term"):
+                done.add(index)
+            elif item.state == "nak":
+                failures.append(ItemFailure(index, None))
+            else:
+                # Как и обычное сообщение без ack: конверт придёт повторно после ack_wait
+                pending = True
+
+        if not failures and not pending:
+            await msg.ack()
+            return
+        if key is not None:
+            self.completed[key] = done
+            while len(self.completed) > self.remember:
+                self.completed.popitem(last=False)
+        if failures:
+            await self._report(msg, failures)
+            await msg.nak()
+
+    async def _report(self, msg, failures: list[ItemFailure]):
+        if self.metrics is not None:
+            self.item_failures.inc(len(failures))
+        for failure in failures:
+            await logger.aerror(
+                "Envelope message failed", subject=msg.subject, index=failure.index,
+                count=msg.headers[COUNT_HEADER], error=repr(failure.error) if failure.error else "nak",
+                exc_info=failure.error,
+            )
+        if self.on_failure is not None:
+            await self.on_failure(msg, failures)
+
+    @staticmethod
+    def _key(msg) -> Optional[tuple]:
+        try:
+            metadata = msg.metadata
+        except Exception:
+            # Не JetStream-сообщение: повторную доставку не отследить
+            return None
+        return metadata.stream, metadata.sequence.stream
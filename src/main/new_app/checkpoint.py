@@ -0,0 +1,180 @@
+import asyncio
+import dataclasses
+import os
+import time
+from typing import Optional
+
+import ormsgpack
+import structlog
+from nats.js.errors import NotFoundError
+
+from src.infrastructure.logger.loggers import InitLoggers
+from src.main.new_app.kv_watch import KVEvent, WatchManager
+from src.main.new_app.serialization import Codec, LazyPayload, get_codec
+
+logger = structlog.getLogger(InitLoggers.main.name)
+
+FORMAT = 1
+
+
+@dataclasses.dataclass(slots=True)
+class BucketSnapshot:
+    bucket: str
+    revision: int  # Последняя применённая ревизия
+    created: Optional[str]  # Время создания стрима бакета: пересозданный бакет снимок не примет
+    entries: list[tuple[str, int, bytes]]  # (ключ, ревизия, сырое значение)
+
+
+def encode_snapshot(snapshot: BucketSnapshot) -> bytes:
+    return ormsgpack.packb([FORMAT, snapshot.bucket, snapshot.revision, snapshot.created, snapshot.entries])
+
+
+def decode_snapshot(data: bytes) -> BucketSnapshot:
+    fmt, bucket, revision, created, entries = ormsgpack.unpackb(data)
+    if fmt != FORMAT:
+        raise ValueError(f"Unsupported snapshot format {fmt}")
+    return BucketSnapshot(bucket, revision, created, [tuple(entry) for entry in entries])
+
+
+def write_atomic(path: str, data: bytes):
+    # Читатель видит либо старый файл, либо новый целиком
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+
+class KVCheckpoint:
+    """
+    Periodic local snapshots of watched KV buckets for warm restarts.
+    Each bucket is saved as one msgpack file with the last applied revision and
+    the raw values of live keys. `watch` loads the file, hands the stored values
+    to the callback, then resumes the server watch after the stored revision,
+    so a restart replays only what changed while the process was down.
+    A snapshot of a recreated bucket or from the future is ignored, and so is one
+    the stream can no longer continue: messages after its revision were removed,
+    or the bucket has a TTL and stored keys may have expired without a marker.
+    """
+
+    def __init__(self, watcher: WatchManager, directory: str, interval: float = 5.0, codec: Optional[Codec] = None):
+        if interval <= 0:
+            raise ValueError("interval must be > 0")
+        self.watcher = watcher
+        self.directory = directory
+        self.interval = interval
+        self.codec = codec or get_codec()
+        self.saved: dict[str, int] = {}  # Ревизия последнего сохранённого снимка по бакету
+        self.tasks: dict[str, asyncio.Task] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.directory} buckets:{sorted(self.tasks)}>"
+
+    def path(self, bucket: str) -> str:
+        return os.path.join(self.directory, f"{bucket}.kvsnap")
+
+    def load(self, bucket: str) -> Optional[BucketSnapshot]:
+        try:
+            with open(self.path(bucket), "rb") as file:
+                return decode_snapshot(file.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # Повреждённый снимок - не повод не стартовать: будет полная выгрузка
+            logger.warning("Snapshot is unreadable", bucket=bucket, error=repr(e))
+            return None
+
+    async def restore(self, bucket: str) -> Optional[BucketSnapshot]:
+        """The stored snapshot if it still matches the bucket on the server."""
+        snapshot = await asyncio.to_thread(self.load, bucket)
+        if snapshot is None:
+            return None
+        try:
+            info = await self.watcher.js.stream_info(f"KV_{bucket}")
+        except NotFoundError:
+            return None
+        if snapshot.created != _created(info) or snapshot.revision > info.state.last_seq:
+            await logger.awarning(
+                "Snapshot does not match the bucket, replaying", bucket=bucket,
+                revision=snapshot.revision, last_seq=info.state.last_seq,
+            )
+            return None
+        if info.state.first_seq > snapshot.revision + 1:
+            # Изменения сразу после снимка уже удалены (purge, лимиты стрима): удаления и
+            # перезаписи из этого промежутка не дойдут, снимок остался бы с устаревшими ключами
+            await logger.awarning(
+                "Bucket history after the snapshot is gone, replaying", bucket=bucket,
+                revision=snapshot.revision, first_seq=info.state.first_seq,
+            )
+            return None
+        if info.config.max_age:
+            # Ключи с истёкшим TTL исчезают без маркера удаления: снимок их бы воскресил
+            await logger.awarning("Bucket has a TTL, replaying", bucket=bucket, max_age=info.config.max_age)
+            return None
+        self.saved[bucket] = snapshot.revision
+        return snapshot
+
+    async def watch(self, bucket: str, callback, keys: str = ">", **kwargs):
+        """WatchManager.watch that starts from the local snapshot and keeps it up to date."""
+        started = time.perf_counter()
+        snapshot = await self.restore(bucket)
+        if snapshot is not None and bucket not in self.watcher.buckets:
+            events = {
+                key: KVEvent(bucket, key, revision, None, LazyPayload(data, self.codec))
+                for key, revision, data in snapshot.entries
+            }
+            kwargs.update(from_revision=snapshot.revision, snapshot=events)
+        watch = await self.watcher.watch(bucket, callback, keys=keys, **kwargs)
+        if snapshot is not None:
+            await logger.ainfo(
+                "Restored bucket snapshot", bucket=bucket, revision=snapshot.revision,
+                keys=len(snapshot.entries), ms=round((time.perf_counter() - started) * 1000, 1),
+            )
+        if bucket not in self.tasks:
+            self.tasks[bucket] = asyncio.create_task(self._run(bucket))
+        return watch
+
+    async def _run(self, bucket: str):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save(bucket)
+            except Exception:
+                await logger.aexception("Snapshot failed", bucket=bucket)
+
+    async def save(self, bucket: str) -> bool:
+        """Writes the bucket state if it changed since the last snapshot."""
+        revision = self.watcher.revision(bucket)
+        if not revision or revision == self.saved.get(bucket):
+            return False
+        info = await self.watcher.js.stream_info(f"KV_{bucket}")
+        if info.config.max_age:
+            # restore такой снимок не примет
+            return False
+        # Копия состояния берётся на цикле событий, кодирование и запись - в потоке
+        snapshot = BucketSnapshot(
+            bucket, revision, _created(info),
+            [(event.key, event.revision, bytes(event.data)) for event in self.watcher.latest(bucket).values()],
+        )
+        await asyncio.to_thread(write_atomic, self.path(bucket), encode_snapshot(snapshot))
+        self.saved[bucket] = revision
+        await logger.adebug("Saved bucket snapshot", bucket=bucket, revision=revision, keys=len(snapshot.entries))
+        return True
+
+    async def close(self):
+        # Последний снимок при остановке: следующий старт догонит меньше
+        tasks, self.tasks = self.tasks, {}
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for bucket in tasks:
+            try:
+                await self.save(bucket)
+            except Exception:
+                await logger.aexception("Snapshot failed", bucket=bucket)
+
+
+def _created(info) -> Optional[str]:
+    return str(info.created) if info.created is not None else None
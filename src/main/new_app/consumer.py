@@ -0,0 +1,344 @@
+import asyncio
+import dataclasses
+import time
+from functools import partial
+from typing import Awaitable, Callable, Optional, Union
+
+import structlog
+from nats.aio.msg import Msg
+from nats.errors import MsgAlreadyAckdError
+from nats.errors import TimeoutError as NATSTimeoutError
+from nats.js.errors import FetchTimeoutError
+
+from src.main.new_app.acks import AckCoalescer, AckSettings, CoalescedMsg
+from src.main.new_app.flow import AdaptiveLimit, FlowSettings, RateLimiter, SlotLease, current_lease
+from src.main.new_app.metrics import EXPORT_BOUNDS_COUNT, Metrics, instance_name
+
+logger: structlog.BoundLogger = structlog.getLogger("NATSClient")
+
+MessageCallback = Callable[[Msg], Awaitable[None]]
+# on_pause(reason) / on_resume(): уведомления о паузе выборки
+PauseHook = Callable[..., Union[Awaitable[None], None]]
+
+
+@dataclasses.dataclass(slots=True)
+class PullSettings:
+    batch_size: int = 10  # Сколько сообщений запрашиваем за один fetch
+    max_in_flight: int = 10  # Сколько коллбеков может выполняться одновременно (потолок адаптивного лимита)
+    min_timeout: float = 0.05  # Таймаут fetch под нагрузкой
+    max_timeout: float = 5.0  # Таймаут fetch для простаивающего консюмера
+    heartbeat: Optional[float] = None  # idle_heartbeat для fetch-запроса
+    ack_wait: Optional[float] = None  # Должен совпадать с ack_wait консюмера
+    progress_interval: Optional[float] = None  # По умолчанию половина ack_wait
+    # Серверный лимит неподтверждённых сообщений; None - не задаётся, действует значение сервера.
+    # Durable читают несколько процессов - не меньше их числа * max_in_flight (см. for_workers)
+    max_ack_pending: Optional[int] = None
+    # Адаптивный лимит параллельности (AIMD); None - всегда max_in_flight
+    flow: Optional[FlowSettings] = dataclasses.field(default_factory=FlowSettings)
+    # Накопление подтверждений; cumulative - консюмер с AckPolicy.ALL
+    acks: Optional[AckSettings] = None
+
+    def __post_init__(self):
+        if self.batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+        if self.max_in_flight < 1:
+            raise ValueError("max_in_flight must be >= 1")
+        if not 0 < self.min_timeout <= self.max_timeout:
+            raise ValueError("expected 0 < min_timeout <= max_timeout")
+        if self.max_ack_pending is not None and self.max_ack_pending < self.max_in_flight:
+            raise ValueError("max_ack_pending must be >= max_in_flight")
+
+    @property
+    def ack_pending_limit(self) -> Optional[int]:
+        # Накопленные, но ещё не отправленные подтверждения сервер тоже считает неподтверждёнными
+        if self.max_ack_pending is None:
+            return None
+        buffered = self.acks.max_count if self.acks is not None else 0
+        return self.max_ack_pending + buffered
+
+    def for_workers(self, workers: int) -> "PullSettings":
+        """Settings with max_ack_pending sized for `workers` processes reading one durable."""
+        if workers < 1:
+            raise ValueError("workers must be >= 1")
+        return dataclasses.replace(self, max_ack_pending=workers * self.max_in_flight)
+
+    @property
+    def in_progress_every(self) -> Optional[float]:
+        if self.progress_interval is not None:
+            return self.progress_interval
+        if self.ack_wait is not None:
+            return self.ack_wait / 2
+        return None
+
+
+class PullConsumer:
+    """
+    Fetch loop of a pull subscription with a bounded pool of callbacks.
+    The number of callbacks in flight follows AdaptiveLimit; fetching can be
+    paused by hand (`pause`/`resume`) or automatically when callbacks keep
+    failing at the lowest limit.
+    """
+
+    def __init__(
+            self,
+            pull_sub,
+            callback: MessageCallback,
+            settings: Optional[PullSettings] = None,
+            metrics: Optional[Metrics] = None,
+            name: str = "",
+            on_pause: Optional[PauseHook] = None,
+            on_resume: Optional[PauseHook] = None
+    ):
+        self.pull_sub = pull_sub
+        self.callback = callback
+        self.name = instance_name(name, "pull")
+        self.settings = settings or PullSettings()
+        self.slots = AdaptiveLimit(self.settings.max_in_flight, self.settings.flow)
+        flow = self.settings.flow
+        self.rate = RateLimiter(flow.max_rate) if flow is not None and flow.max_rate else None
+        self.in_flight: set[asyncio.Task] = set()
+        self.timeout = self.settings.min_timeout
+        self.acks = None
+        if self.settings.acks is not None:
+            acks = self.settings.acks
+            if acks.progress_interval is None and self.settings.in_progress_every:
+                # Подтверждения, задержанные долгим коллбеком, продлеваются как сами коллбеки
+                acks = dataclasses.replace(acks, progress_interval=self.settings.in_progress_every)
+            self.acks = AckCoalescer(acks, metrics, self.name)
+        self.on_pause = on_pause
+        self.on_resume = on_resume
+        self.running = asyncio.Event()  # Сброшен, пока выборка на паузе
+        self.running.set()
+        self.pause_reason: Optional[str] = None
+        self.pauses = 0  # Автоматических пауз подряд
+        self.resume_timer: Optional[asyncio.TimerHandle] = None
+        self.metrics = metrics
+        if metrics is not None:
+            self.batch_sizes = metrics.histogram(
+                "nats_fetch_batch_size", "Messages returned by one fetch",
+                scale=1, bounds=EXPORT_BOUNDS_COUNT, consumer=self.name,
+            )
+            self.queue_wait = metrics.histogram(
+                "nats_queue_wait_seconds", "Time from fetch to callback start", consumer=self.name
+            )
+            self.callback_time = metrics.histogram(
+                "nats_callback_seconds", "Callback duration", consumer=self.name
+            )
+            self.redeliveries = metrics.counter(
+                "nats_redeliveries_total", "Messages delivered more than once", consumer=self.name
+            )
+            self.failures = metrics.counter("nats_callback_errors_total", "Failed callbacks", consumer=self.name)
+            self.paused_total = metrics.counter("nats_consumer_pauses_total", "Fetch pauses", consumer=self.name)
+            metrics.collector(self._flow_metrics)
+
+    def _flow_metrics(self):
+        labels = {"consumer": self.name}
+        return [
+            ("nats_consumer_in_flight_limit", labels, self.slots.limit),
+            ("nats_consumer_in_flight", labels, self.slots.in_use),
+            ("nats_consumer_paused", labels, int(not self.running.is_set())),
+        ]
+
+    @property
+    def free_slots(self) -> int:
+        return self.slots.free
+
+    @property
+    def paused(self) -> bool:
+        return not self.running.is_set()
+
+    async def pause(self, reason: str = "manual", duration: Optional[float] = None):
+        """Stops fetching; callbacks already running finish. Resumes after `duration` if given."""
+        if self.resume_timer is not None:
+            self.resume_timer.cancel()
+            self.resume_timer = None
+        if duration is not None:
+            loop = asyncio.get_running_loop()
+            self.resume_timer = loop.call_later(duration, lambda: loop.create_task(self.resume()))
+        if self.paused:
+            return
+        self.running.clear()
+        self.pause_reason = reason
+        if self.metrics is not None:
+            self.paused_total.inc()
+        await logger.awarning("Consumer paused", consumer=self.name, reason=reason, duration=duration)
+        await self._hook(self.on_pause, reason)
+
+    async def resume(self):
+        if self.resume_timer is not None:
+            self.resume_timer.cancel()
+            self.resume_timer = None
+        if not self.paused:
+            return
+        self.running.set()
+        self.pause_reason = None
+        await logger.ainfo("Consumer resumed", consumer=self.name)
+        await self._hook(self.on_resume)
+
+    async def _hook(self, hook: Optional[PauseHook], *args):
+        if hook is None:
+            return
+        try:
+            result = hook(*args)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception:
+            await logger.aexception("Pause hook failed", consumer=self.name)
+
+    async def run(self):
+        try:
+            while True:
+                await self.running.wait()
+                # Не запрашиваем больше, чем можем сразу взять в работу,
+                # иначе сообщения будут ждать в буфере и тратить ack_wait
+                await self.slots.wait_free()
+                batch = max(1, min(self.settings.batch_size, self.free_slots))
+
+                try:
+                    msgs = await self.pull_sub.fetch(
+                        batch, timeout=self.timeout, heartbeat=self.settings.heartbeat
+                    )
+                except FetchTimeoutError:
+                    # Сервер жив (приходили heartbeat'ы), просто нет сообщений
+                    self._backoff()
+                    continue
+                except NATSTimeoutError:
+                    if self.settings.heartbeat is not None:
+                        await logger.awarning("Missed fetch heartbeats", timeout=self.timeout)
+                    self._backoff()
+                    continue
+
+                fetched_at = time.perf_counter()
+                if self.metrics is not None:
+                    self.batch_sizes.record(len(msgs))
+                # Полный батч - вероятно, сообщения ещё есть, опрашиваем быстро
+                if len(msgs) >= batch:
+                    self.timeout = self.settings.min_timeout
+                for msg in msgs:
+                    await self.slots.acquire()
+                    lease = SlotLease(self.slots)
+                    if self.rate is not None:
+                        await self.rate.take()
+                    if self.acks is not None:
+                        msg = self.acks.wrap(msg)
+                    elif self.settings.in_progress_every:
+                        msg = TrackedMsg(msg)  # _keep_alive видит, что сообщение уже подтверждено
+                    task = asyncio.create_task(self._handle(msg, fetched_at, lease))
+                    self.in_flight.add(task)
+                    task.add_done_callback(partial(self._done, lease))
+        except asyncio.CancelledError:
+            # Задача была отменена, выходим из цикла
+            pass
+        finally:
+            if self.resume_timer is not None:
+                self.resume_timer.cancel()
+            for task in self.in_flight:
+                task.cancel()
+            await asyncio.gather(*self.in_flight, return_exceptions=True)
+            if self.acks is not None:
+                # Отправляем то, что уже подтверждено, иначе это придёт повторно
+                await self.acks.close()
+            if self.metrics is not None:
+                self.metrics.remove_collector(self._flow_metrics)
+            await self.pull_sub.unsubscribe()
+
+    def _backoff(self):
+        # Long-poll вместо sleep: пустой fetch удлиняет следующий запрос
+        self.timeout = min(self.timeout * 2, self.settings.max_timeout)
+
+    def _done(self, lease: SlotLease, task: asyncio.Task):
+        self.in_flight.discard(task)
+        lease.release()
+
+    async def _handle(self, msg: Msg, fetched_at: float, lease: SlotLease):
+        # Задача - своя копия контекста: обёртка коллбека видит слот именно этого сообщения
+        current_lease.set(lease)
+        started = time.perf_counter()
+        if self.metrics is not None:
+            self.queue_wait.record(started - fetched_at)
+            if msg.metadata.num_delivered > 1:
+                self.redeliveries.inc()
+        progress = None
+        interval = self.settings.in_progress_every
+        if interval:
+            progress = asyncio.create_task(self._keep_alive(msg, interval))
+        ok = False
+        try:
+            await self.callback(msg)  # Передаем msg в коллбек
+            ok = True
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            if self.metrics is not None:
+                self.failures.inc()
+            await logger.aexception("Callback failed", subject=msg.subject)
+            try:
+                await msg.nak()
+            except MsgAlreadyAckdError:
+                pass
+        finally:
+            if progress is not None:
+                progress.cancel()
+            if self.acks is not None:
+                msg.done()
+            elapsed = time.perf_counter() - started
+            if self.metrics is not None:
+                self.callback_time.record(elapsed)
+        # Ожидание в очереди обёртки (полосы Partitioner) - не задержка коллбека
+        await self._observe(max(0.0, elapsed - lease.waited), ok)
+
+    async def _observe(self, elapsed: float, ok: bool):
+        error_rate = self.slots.record(elapsed, ok)
+        if error_rate is None:
+            return
+        flow = self.settings.flow
+        if error_rate >= flow.pause_errors and self.slots.limit == self.slots.min_in_flight:
+            # Зависимость коллбеков не справляется даже на минимуме: даём ей передышку
+            self.pauses += 1
+            duration = min(flow.pause_time * 2 ** (self.pauses - 1), flow.max_pause)
+            await self.pause(f"error rate {error_rate:.0%}", duration)
+        elif error_rate < flow.error_threshold:
+            self.pauses = 0
+
+    @staticmethod
+    async def _keep_alive(msg: Union["TrackedMsg", CoalescedMsg], interval: float):
+        # Продлеваем ack_wait, пока коллбек работает, чтобы не было редоставок
+        while True:
+            await asyncio.sleep(interval)
+            if msg.settled:
+                return
+            try:
+                await msg.in_progress()
+            except Exception:
+                # Разрыв соединения не должен ронять коллбек: попробуем на следующем интервале
+                await logger.aexception("in_progress failed", subject=msg.subject)
+
+
+class TrackedMsg:
+    """Msg proxy that records whether the callback has acked, nak'ed or terminated the message."""
+
+    __slots__ = ("msg", "settled")
+
+    def __init__(self, msg: Msg):
+        self.msg = msg
+        self.settled = False
+
+    async def ack(self):
+        await self.msg.ack()
+        self.settled = True
+
+    async def ack_sync(self, timeout: float = 1):
+        result = await self.msg.ack_sync(timeout)
+        self.settled = True
+        return result
+
+    async def nak(self, delay: Optional[float] = None):
+        await self.msg.nak(delay)
+        self.settled = True
+
+    async def term(self):
+        await self.msg.term()
+        self.settled = True
+
+    def __getattr__(self, item):
+        return getattr(self.msg, item)
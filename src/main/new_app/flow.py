@@ -0,0 +1,164 @@
+import asyncio
+import contextvars
+import dataclasses
+import time
+from typing import Optional
+
+
+@dataclasses.dataclass(slots=True)
+class FlowSettings:
+    min_in_flight: int = 1  # Нижняя граница адаптивного лимита
+    initial_in_flight: Optional[int] = None  # По умолчанию половина max_in_flight
+    window: int = 20  # Завершённых коллбеков между пересчётами лимита
+    latency_tolerance: float = 2.0  # Средняя задержка окна выше базовой во столько раз - уменьшаем лимит
+    error_threshold: float = 0.1  # Доля ошибок в окне, после которой лимит уменьшается
+    decrease: float = 0.7  # Множитель лимита при перегрузке
+    max_rate: Optional[float] = None  # Не больше стольких сообщений в секунду на консюмер
+    pause_errors: float = 0.5  # Доля ошибок при минимальном лимите, после которой выборка встаёт на паузу
+    pause_time: float = 1.0  # Первая автоматическая пауза, секунды; каждая следующая подряд - вдвое дольше
+    max_pause: float = 30.0
+
+    def __post_init__(self):
+        if self.min_in_flight < 1:
+            raise ValueError("min_in_flight must be >= 1")
+        if self.window < 1:
+            raise ValueError("window must be >= 1")
+        if not 0 < self.decrease < 1:
+            raise ValueError("expected 0 < decrease < 1")
+        if self.latency_tolerance <= 1:
+            raise ValueError("latency_tolerance must be > 1")
+
+
+class RateLimiter:
+    """Token bucket: at most `rate` starts per second, bursts up to one second of tokens."""
+
+    def __init__(self, rate: float):
+        if rate <= 0:
+            raise ValueError("rate must be > 0")
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    async def take(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveLimit:
+    """
+    In-flight slots with an AIMD limit between min_in_flight and max_in_flight.
+    Every `window` completed callbacks the limit grows by one if the slots were
+    saturated and the callbacks stayed healthy; it is multiplied by `decrease`
+    when the error rate or the mean latency (against the best observed window)
+    goes up. With `settings=None` the limit stays at max_in_flight.
+    """
+
+    def __init__(self, max_in_flight: int, settings: Optional[FlowSettings] = None):
+        self.settings = settings
+        self.max_in_flight = max_in_flight
+        if settings is None:
+            self.min_in_flight = self.limit = max_in_flight
+        else:
+            self.min_in_flight = min(settings.min_in_flight, max_in_flight)
+            initial = settings.initial_in_flight or max(1, max_in_flight // 2)
+            self.limit = max(self.min_in_flight, min(initial, max_in_flight))
+        self.in_use = 0
+        self.waiters: list[asyncio.Future] = []
+        # Статистика текущего окна
+        self.completed = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.saturated = False
+        self.baseline: Optional[float] = None  # Лучшая средняя задержка окна
+        self.last_error_rate = 0.0
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.in_use}/{self.limit} [{self.min_in_flight}..{self.max_in_flight}]>"
+
+    @property
+    def free(self) -> int:
+        return max(0, self.limit - self.in_use)
+
+    async def wait_free(self):
+        # Ждём свободный слот, не занимая его
+        while self.in_use >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+
+    async def acquire(self):
+        await self.wait_free()
+        self.in_use += 1
+        if self.in_use >= self.limit:
+            self.saturated = True
+
+    def release(self):
+        self.in_use -= 1
+        self._wake()
+
+    def _wake(self):
+        for waiter in self.waiters[:self.free]:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def record(self, latency: float, ok: bool) -> Optional[float]:
+        """Accounts one finished callback; returns the error rate of a finished window."""
+        if self.settings is None:
+            return None
+        self.completed += 1
+        self.latency_sum += latency
+        if not ok:
+            self.errors += 1
+        if self.completed < self.settings.window:
+            return None
+        return self._adjust()
+
+    def _adjust(self) -> float:
+        settings = self.settings
+        mean = self.latency_sum / self.completed
+        error_rate = self.errors / self.completed
+        # Базовая задержка медленно подтягивается вверх, чтобы пережить постоянное замедление
+        self.baseline = mean if self.baseline is None else min(self.baseline * 1.05, mean)
+        if error_rate > settings.error_threshold or mean > self.baseline * settings.latency_tolerance:
+            self.limit = max(self.min_in_flight, int(self.limit * settings.decrease))
+        elif self.saturated and self.limit < self.max_in_flight:
+            self.limit += 1
+            self._wake()
+        self.completed = self.errors = 0
+        self.latency_sum = 0.0
+        self.saturated = self.in_use >= self.limit
+        self.last_error_rate = error_rate
+        return error_rate
+
+
+@dataclasses.dataclass(slots=True, eq=False)
+class SlotLease:
+    """
+    The AdaptiveLimit slot taken for one fetched message.
+    A callback wrapper that parks the message in its own bounded queue (Partitioner)
+    hands the slot back and reports the wait, so parked messages neither block
+    fetching for other keys nor count as callback latency.
+    """
+
+    limit: AdaptiveLimit
+    held: bool = True
+    waited: float = 0.0  # Время в очереди обёртки, не входит в задержку коллбека
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.limit.release()
+
+
+# Слот сообщения, которое обрабатывает текущая задача PullConsumer
+current_lease: contextvars.ContextVar[Optional[SlotLease]] = contextvars.ContextVar("current_lease", default=None)
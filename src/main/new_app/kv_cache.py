@@ -0,0 +1,109 @@
+import dataclasses
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+# Маркер отсутствующего значения (None - допустимое значение ключа)
+MISSING = object()
+
+# Декодированные значения этих типов можно отдавать всем читателям один и тот же объект
+_IMMUTABLE = (str, bytes, int, float, bool, type(None))
+
+
+def _shareable(value: Any) -> bool:
+    if isinstance(value, _IMMUTABLE):
+        return True
+    return isinstance(value, (tuple, frozenset)) and all(_shareable(item) for item in value)
+
+
+@dataclasses.dataclass(slots=True)
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    stale_drops: int = 0  # Записи, отброшенные из-за устаревшей ревизии
+
+
+@dataclasses.dataclass(slots=True)
+class _Item:
+    revision: int
+    data: Optional[bytes]  # None - ключ удалён (tombstone)
+    expires_at: Optional[float]
+    value: Any = MISSING  # Декодированное неизменяемое значение; dict/list декодируются при каждом чтении
+
+
+class KVCache:
+    """
+    LRU of KV entries bounded by size and TTL; writes with an older revision are ignored.
+    Every read of a mutable value (dict, list, ...) gets its own decoded object,
+    so a caller that changes it does not change what other readers see.
+    """
+
+    def __init__(self, decode: Callable[[bytes], Any], max_size: int = 1024, ttl: Optional[float] = None):
+        if max_size < 1:
+            raise ValueError("max_size must be >= 1")
+        self.decode = decode
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._items: OrderedDict[str, _Item] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, count=False) is not MISSING
+
+    def get(self, key: str, count: bool = True) -> Any:
+        # Синхронное чтение: MISSING, если ключа нет, он удалён или истёк TTL
+        item = self._items.get(key)
+        if item is not None and item.expires_at is not None and item.expires_at <= time.monotonic():
+            del self._items[key]
+            self.stats.expirations += 1
+            item = None
+        if item is None or item.data is None:
+            if count:
+                self.stats.misses += 1
+            return MISSING
+        self._items.move_to_end(key)
+        if count:
+            self.stats.hits += 1
+        if item.value is not MISSING:
+            return item.value
+        value = self.decode(item.data)
+        if _shareable(value):
+            item.value = value
+        return value
+
+    def revision(self, key: str) -> Optional[int]:
+        item = self._items.get(key)
+        return item.revision if item is not None else None
+
+    def put(self, key: str, data: bytes, revision: int, value: Any = MISSING) -> bool:
+        # value уже отдан вызывающему: изменяемый объект в кэше не храним
+        if value is not MISSING and not _shareable(value):
+            value = MISSING
+        return self._store(key, _Item(revision, data, self._expires_at(), value))
+
+    def delete(self, key: str, revision: int) -> bool:
+        # Tombstone с ревизией не даёт запоздавшему get() вернуть удалённое значение
+        return self._store(key, _Item(revision, None, self._expires_at()))
+
+    def clear(self):
+        self._items.clear()
+
+    def _expires_at(self) -> Optional[float]:
+        return time.monotonic() + self.ttl if self.ttl is not None else None
+
+    def _store(self, key: str, item: _Item) -> bool:
+        current = self._items.get(key)
+        if current is not None and current.revision > item.revision:
+            self.stats.stale_drops += 1
+            return False
+        self._items[key] = item
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.stats.evictions += 1
+        return True
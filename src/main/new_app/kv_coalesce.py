@@ -0,0 +1,151 @@
+import asyncio
+import dataclasses
+from typing import Awaitable, Callable, Optional
+
+import structlog
+
+from src.infrastructure.logger.loggers import InitLoggers
+from src.main.new_app.metrics import Metrics
+
+logger = structlog.getLogger(InitLoggers.main.name)
+
+# write(key, data, revision) -> новая ревизия; revision не None - запись только поверх этой ревизии
+KVWrite = Callable[[str, bytes, Optional[int]], Awaitable[int]]
+
+
+@dataclasses.dataclass(slots=True)
+class _Pending:
+    data: bytes
+    revision: Optional[int]  # Ожидаемая ревизия ключа, None - безусловная запись
+    waiters: list[asyncio.Future] = dataclasses.field(default_factory=list)
+
+
+class WriteCoalescer:
+    """
+    Last-write-wins buffer of KV writes.
+    Consecutive unconditional writes of a key are merged into the latest value;
+    it is written on the next flush, every `interval` seconds, when `max_keys`
+    keys are pending, or on `flush()`. A write with an expected revision is never
+    merged: it is sent as kv.update in its place among the key's writes, so it
+    succeeds or conflicts exactly as it would without coalescing. Callers that
+    wait get the revision of the write that carried their value. Flushes run one
+    at a time and the writes of a key are sent in order.
+    """
+
+    def __init__(
+            self,
+            write: KVWrite,
+            interval: float = 0.05,
+            max_keys: int = 1024,
+            concurrency: int = 32,
+            metrics: Optional[Metrics] = None,
+            name: str = ""
+    ):
+        if interval <= 0:
+            raise ValueError("interval must be > 0")
+        self.write = write
+        self.interval = interval
+        self.max_keys = max_keys
+        self.concurrency = concurrency
+        self.pending: dict[str, list[_Pending]] = {}  # Записи ключа по порядку
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.flushing: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+        self.metrics = metrics
+        if metrics is not None:
+            self.superseded = metrics.counter(
+                "nats_kv_coalesced_writes_total", "KV writes replaced by a later value before the flush", client=name
+            )
+            self.written = metrics.counter(
+                "nats_kv_flushed_writes_total", "KV writes sent by the coalescer", client=name
+            )
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} pending:{len(self.pending)} interval:{self.interval}>"
+
+    def get(self, key: str) -> Optional[bytes]:
+        # Ещё не записанное значение: чтение своих записей до flush
+        writes = self.pending.get(key)
+        return writes[-1].data if writes else None
+
+    def unwritten(self) -> dict[str, bytes]:
+        """Values not written yet, by key."""
+        return {key: writes[-1].data for key, writes in self.pending.items()}
+
+    def put(self, key: str, data: bytes, revision: Optional[int] = None, wait: bool = False) -> Optional[asyncio.Future]:
+        """Buffers a write; with `wait` returns a future of the revision it was written with."""
+        writes = self.pending.setdefault(key, [])
+        if writes and revision is None and writes[-1].revision is None:
+            # Безусловная поверх безусловной: промежуточное значение на сервер не попадёт
+            pending = writes[-1]
+            pending.data = data
+            if self.metrics is not None:
+                self.superseded.inc()
+        else:
+            # Условная запись проверяет ревизию после предыдущих записей ключа, а не вместо них
+            pending = _Pending(data, revision)
+            writes.append(pending)
+        future = None
+        if wait:
+            future = asyncio.get_running_loop().create_future()
+            pending.waiters.append(future)
+        if len(self.pending) >= self.max_keys:
+            self._schedule(0)
+        elif self.timer is None:
+            self._schedule(self.interval)
+        return future
+
+    def _schedule(self, delay: float):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = asyncio.get_running_loop().call_later(delay, self._start_flush)
+
+    def _start_flush(self):
+        self.timer = None
+        if self.flushing is None or self.flushing.done():
+            self.flushing = asyncio.create_task(self.flush())
+        else:
+            # Предыдущая запись ещё идёт: попробуем после неё
+            self._schedule(self.interval)
+
+    async def flush(self) -> dict[str, int]:
+        """Writes every pending key now; returns the new revisions by key."""
+        async with self.lock:
+            batch, self.pending = self.pending, {}
+            if not batch:
+                return {}
+            limit = asyncio.Semaphore(self.concurrency)
+            revisions: dict[str, int] = {}
+
+            async def store(key: str, writes: list[_Pending]):
+                # Ключи пишутся параллельно, записи одного ключа - по порядку
+                async with limit:
+                    for pending in writes:
+                        try:
+                            revision = await self.write(key, pending.data, pending.revision)
+                        except Exception as e:
+                            if not pending.waiters:
+                                await logger.aerror("Coalesced KV write failed", key=key, error=repr(e))
+                            for waiter in pending.waiters:
+                                if not waiter.done():
+                                    waiter.set_exception(e)
+                            continue
+                        revisions[key] = revision
+                        for waiter in pending.waiters:
+                            if not waiter.done():
+                                waiter.set_result(revision)
+
+            await asyncio.gather(*(store(key, writes) for key, writes in batch.items()))
+            count = sum(map(len, batch.values()))
+            if self.metrics is not None:
+                self.written.inc(count)
+            await logger.adebug("Flushed coalesced KV writes", count=count, written=len(revisions))
+            return revisions
+
+    async def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.flushing is not None:
+            await asyncio.gather(self.flushing, return_exceptions=True)
+        await self.flush()
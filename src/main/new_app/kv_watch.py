@@ -0,0 +1,253 @@
+import asyncio
+import dataclasses
+from typing import Any, Awaitable, Callable, Mapping, Optional
+
+import structlog
+from nats.aio.msg import Msg
+from nats.js.api import AckPolicy, ConsumerConfig, DeliverPolicy
+from nats.js.kv import KV_DEL, KV_OP, KV_PURGE
+
+from src.infrastructure.logger.loggers import InitLoggers
+from src.main.new_app.acks import AckCoalescer, AckSettings
+from src.main.new_app.serialization import Codec, LazyPayload, get_codec
+
+logger = structlog.getLogger(InitLoggers.main.name)
+
+
+def subject_matches(pattern: str, subject: str) -> bool:
+    # Сопоставление по правилам NATS: "*" - один токен, ">" - остаток
+    if pattern == ">":
+        return True
+    tokens = subject.split(".")
+    parts = pattern.split(".")
+    for i, part in enumerate(parts):
+        if part == ">":
+            return len(tokens) > i
+        if i >= len(tokens) or (part != "*" and part != tokens[i]):
+            return False
+    return len(tokens) == len(parts)
+
+
+@dataclasses.dataclass(slots=True)
+class KVEvent:
+    bucket: str
+    key: str
+    revision: int
+    operation: Optional[str]  # None - PUT, иначе DEL или PURGE
+    payload: LazyPayload
+
+    @property
+    def deleted(self) -> bool:
+        return self.operation in (KV_DEL, KV_PURGE)
+
+    @property
+    def data(self) -> memoryview:
+        return self.payload.raw
+
+    @property
+    def value(self) -> Any:
+        return None if self.deleted else self.payload.value
+
+
+WatchCallback = Callable[[KVEvent], Awaitable[None]]
+
+
+@dataclasses.dataclass(slots=True, eq=False)
+class Watch:
+    bucket: str
+    keys: str
+    callback: WatchCallback
+    manager: "WatchManager"
+
+    async def stop(self):
+        await self.manager.unwatch(self)
+
+
+class _BucketWatch:
+    """
+    One server-side consumer per bucket; events are fanned out to local watches.
+    Without a durable name the consumer is an ordered one: no acks, flow control,
+    and nats-py recreates it from the last revision on a gap. A durable consumer
+    uses AckPolicy.ALL with coalesced acks.
+    """
+
+    def __init__(
+            self,
+            js,
+            bucket: str,
+            codec: Codec,
+            deliver_policy: DeliverPolicy,
+            from_revision: Optional[int],
+            durable: Optional[str]
+    ):
+        self.js = js
+        self.bucket = bucket
+        self.codec = codec
+        self.deliver_policy = deliver_policy
+        self.from_revision = from_revision
+        self.durable = durable
+        self.prefix = f"$KV.{bucket}."
+        self.watches: list[Watch] = []
+        self.lock = asyncio.Lock()  # Выдача событий: сервер и повтор для нового подписчика не перемешиваются
+        self.latest: dict[str, KVEvent] = {}  # Последнее событие по каждому ключу
+        self.revision = 0  # Последняя применённая ревизия (sequence стрима)
+        self.sub = None
+        self.acks: Optional[AckCoalescer] = None  # Только у durable-консюмера
+
+    def check(self, deliver_policy: Optional[DeliverPolicy], from_revision: Optional[int], durable: Optional[str]):
+        # Консюмер бакета уже создан со своими параметрами: другие молча проигнорировать нельзя
+        for name, requested, current in (
+                ("deliver_policy", deliver_policy, self.deliver_policy),
+                ("from_revision", from_revision, self.from_revision),
+                ("durable", durable, self.durable),
+        ):
+            if requested is not None and requested != current:
+                raise ValueError(
+                    f"Bucket {self.bucket} is already watched with {name}={current!r}, got {requested!r}"
+                )
+
+    async def start(self):
+        deliver_policy, from_revision, durable = self.deliver_policy, self.from_revision, self.durable
+        # Ordered-консюмер сам выставляет AckPolicy.NONE
+        ack_policy = AckPolicy.ALL if durable else None
+        if from_revision:
+            # Продолжаем с места остановки: сервер отдаст только изменения после ревизии
+            config = ConsumerConfig(
+                ack_policy=ack_policy,
+                deliver_policy=DeliverPolicy.BY_START_SEQUENCE,
+                opt_start_seq=from_revision + 1,
+            )
+            self.revision = from_revision
+        else:
+            config = ConsumerConfig(ack_policy=ack_policy, deliver_policy=deliver_policy)
+        self.sub = await self.js.subscribe(
+            f"{self.prefix}>",
+            stream=f"KV_{self.bucket}",
+            durable=durable,
+            config=config,
+            cb=self.dispatch,
+            manual_ack=True,
+            ordered_consumer=not durable,
+        )
+        if durable:
+            # Существующий durable мог быть создан с AckPolicy.EXPLICIT: тогда подтверждаем каждое
+            info = await self.sub.consumer_info()
+            cumulative = info.config.ack_policy == AckPolicy.ALL
+            self.acks = AckCoalescer(AckSettings(cumulative=cumulative), name=durable)
+
+    async def stop(self):
+        if self.acks is not None:
+            await self.acks.close()
+        if self.sub is not None:
+            await self.sub.unsubscribe()
+            self.sub = None
+
+    def event(self, msg: Msg) -> KVEvent:
+        operation = msg.headers.get(KV_OP) if msg.headers else None
+        return KVEvent(
+            bucket=self.bucket,
+            key=msg.subject[len(self.prefix):],
+            revision=msg.metadata.sequence.stream,
+            operation=operation,
+            payload=LazyPayload(msg.data, self.codec),
+        )
+
+    async def dispatch(self, msg: Msg):
+        async with self.lock:
+            await self._dispatch(msg)
+
+    async def _dispatch(self, msg: Msg):
+        event = self.event(msg)
+        if event.revision > self.revision:
+            self.revision = event.revision
+            if event.deleted:
+                self.latest.pop(event.key, None)
+            else:
+                self.latest[event.key] = event
+            for watch in list(self.watches):
+                if subject_matches(watch.keys, event.key):
+                    await self.notify(watch, event)
+        if self.acks is not None:
+            # События приходят по порядку: подтверждения накапливаются одним ack
+            await self.acks.wrap(msg).ack()
+
+    @staticmethod
+    async def notify(watch: Watch, event: KVEvent):
+        try:
+            await watch.callback(event)
+        except Exception:
+            await logger.aexception("Watch callback failed", bucket=event.bucket, key=event.key)
+
+
+class WatchManager:
+    """Holds watches on many buckets and key filters, multiplexed over one consumer per bucket."""
+
+    def __init__(self, js, codec: Optional[Codec] = None):
+        self.js = js
+        self.codec = codec or get_codec()
+        self.buckets: dict[str, _BucketWatch] = {}
+        self.lock = asyncio.Lock()
+
+    def revision(self, bucket: str) -> int:
+        state = self.buckets.get(bucket)
+        return state.revision if state is not None else 0
+
+    def latest(self, bucket: str) -> dict[str, KVEvent]:
+        state = self.buckets.get(bucket)
+        return dict(state.latest) if state is not None else {}
+
+    async def watch(
+            self,
+            bucket: str,
+            callback: WatchCallback,
+            keys: str = ">",
+            deliver_policy: Optional[DeliverPolicy] = None,
+            from_revision: Optional[int] = None,
+            durable: Optional[str] = None,
+            snapshot: Optional[Mapping[str, KVEvent]] = None
+    ) -> Watch:
+        # deliver_policy по умолчанию - LAST_PER_SUBJECT; для уже наблюдаемого бакета
+        # параметры консюмера должны совпадать с исходными или не передаваться.
+        # snapshot - состояние бакета на from_revision (см. KVCheckpoint): отдаётся коллбеку до событий сервера
+        watch = Watch(bucket=bucket, keys=keys, callback=callback, manager=self)
+        async with self.lock:
+            state = self.buckets.get(bucket)
+            if state is None:
+                state = _BucketWatch(
+                    self.js, bucket, self.codec,
+                    deliver_policy or DeliverPolicy.LAST_PER_SUBJECT, from_revision, durable,
+                )
+                state.watches.append(watch)
+                if snapshot:
+                    state.latest = dict(snapshot)
+                    for event in sorted(snapshot.values(), key=lambda e: e.revision):
+                        if subject_matches(keys, event.key):
+                            await state.notify(watch, event)
+                await state.start()
+                self.buckets[bucket] = state
+                await logger.adebug("Create new watch", bucket=bucket, callback=getattr(callback, "__name__", repr(callback)))
+                return watch
+            state.check(deliver_policy, from_revision, durable)
+            # Консюмер на бакет уже есть: новому подписчику отдаём текущие значения из памяти.
+            # Под блокировкой выдачи: события сервера дойдут до него только после повтора
+            async with state.lock:
+                state.watches.append(watch)
+                replay = [e for e in state.latest.values() if subject_matches(keys, e.key)]
+                for event in sorted(replay, key=lambda e: e.revision):
+                    await state.notify(watch, event)
+        return watch
+
+    async def unwatch(self, watch: Watch):
+        async with self.lock:
+            state = self.buckets.get(watch.bucket)
+            if state is None or watch not in state.watches:
+                return
+            state.watches.remove(watch)
+            if not state.watches:
+                del self.buckets[watch.bucket]
+                await state.stop()
+
+    async def close(self):
+        async with self.lock:
+            states, self.buckets = list(self.buckets.values()), {}
+        await asyncio.gather(*(state.stop() for state in states), return_exceptions=True)
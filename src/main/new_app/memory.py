@@ -0,0 +1,924 @@
+"""
+In-process stand-in for a NATS server with JetStream.
+MemoryClient can replace nats.aio.client.Client in NATSClient and NATSKeyValueClient
+(transport="memory"): streams, durable pull/push consumers with ack/nak/in-progress,
+ack_wait redelivery, max_deliver and max_ack_pending, and KV buckets with revisions.
+Core NATS pub/sub, clustering and persistence are not emulated.
+"""
+
+import asyncio
+import collections
+import dataclasses
+import datetime
+import json
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Optional, Union
+
+import structlog
+from nats.aio.client import Client as NATS
+from nats.aio.msg import Msg
+from nats.errors import TimeoutError as NATSTimeoutError
+from nats.js.api import (
+    AckPolicy,
+    ConsumerConfig,
+    ConsumerInfo,
+    DeliverPolicy,
+    Header,
+    KeyValueConfig,
+    PubAck,
+    ReplayPolicy,
+    RetentionPolicy,
+    SequenceInfo,
+    StorageType,
+    StreamConfig,
+    StreamInfo,
+    StreamState,
+)
+from nats.js.errors import (
+    BadRequestError,
+    BucketNotFoundError,
+    FetchTimeoutError,
+    KeyNotFoundError,
+    KeyWrongLastSequenceError,
+    NoKeysError,
+    NoStreamResponseError,
+    NotFoundError,
+)
+from nats.js.kv import KV_DEL, KV_OP, KV_PURGE, KeyValue
+
+from src.main.new_app.kv_watch import subject_matches
+from src.main.new_app.topology import IMMUTABLE_CONSUMER_FIELDS
+
+logger: structlog.BoundLogger = structlog.getLogger("NATSClient")
+
+ACK_PREFIX = "$JS.ACK."
+_STOP = object()
+DEFAULT_ACK_WAIT = 30.0
+DEFAULT_MAX_ACK_PENDING = 1000
+# Коды ошибок сервера, на которые опираются клиенты nats-py
+WRONG_LAST_SEQUENCE = 10071
+STREAM_NOT_FOUND = 10059
+CONSUMER_NOT_FOUND = 10014
+CONSUMER_CREATE = 10012
+# Умолчания сервера для полей консюмера, которые нельзя изменить
+CONSUMER_DEFAULTS = {
+    "deliver_policy": DeliverPolicy.ALL,
+    "ack_policy": AckPolicy.EXPLICIT,
+    "replay_policy": ReplayPolicy.INSTANT,
+}
+# Значения, которые сервер подставляет вместо незаданных (и нулей nats-py) в конфиге стрима
+STREAM_DEFAULTS = {
+    "retention": RetentionPolicy.LIMITS,
+    "storage": StorageType.FILE,
+    "num_replicas": 1,
+    "max_msgs": -1,
+    "max_bytes": -1,
+    "max_age": 0.0,
+    "duplicate_window": 120.0,
+}
+
+
+def _header(key) -> str:
+    # Ключи заголовков nats-py бывают Enum(str), храним строками
+    return key.value if isinstance(key, Header) else key
+
+
+@dataclasses.dataclass(slots=True)
+class _StoredMsg:
+    seq: int
+    subject: str
+    data: bytes
+    headers: Optional[dict[str, str]]
+    time_ns: int
+
+
+class _Stream:
+    def __init__(self, config: StreamConfig):
+        self.config = config
+        self.messages: dict[int, _StoredMsg] = {}
+        self.by_subject: dict[str, collections.deque[int]] = {}
+        self.msg_ids: dict[str, int] = {}
+        self.consumers: dict[str, "_Consumer"] = {}
+        self.last_seq = 0
+        self.bytes = 0
+        self.created = datetime.datetime.now(datetime.timezone.utc)
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    def matches(self, subject: str) -> bool:
+        return any(subject_matches(pattern, subject) for pattern in self.config.subjects or ())
+
+    @property
+    def first_seq(self) -> int:
+        return next(iter(self.messages), self.last_seq + 1)
+
+    def last(self, subject: str) -> Optional[_StoredMsg]:
+        seqs = self.by_subject.get(subject)
+        return self.messages[seqs[-1]] if seqs else None
+
+    def store(self, subject: str, data: bytes, headers: Optional[dict]) -> PubAck:
+        if headers:
+            headers = {_header(key): value for key, value in headers.items()}
+            msg_id = headers.get(Header.MSG_ID.value)
+            if msg_id is not None and msg_id in self.msg_ids:
+                return PubAck(stream=self.name, seq=self.msg_ids[msg_id], duplicate=True)
+            expected = headers.get(Header.EXPECTED_LAST_SUBJECT_SEQUENCE.value)
+            if expected is not None:
+                last = self.last(subject)
+                if (last.seq if last else 0) != int(expected):
+                    raise BadRequestError(
+                        code=400,
+                        err_code=WRONG_LAST_SEQUENCE,
+                        description=f"wrong last sequence: {last.seq if last else 0}",
+                    )
+        self.last_seq += 1
+        seq = self.last_seq
+        self.messages[seq] = _StoredMsg(seq, subject, data, headers or None, time.time_ns())
+        self.bytes += len(data)
+        seqs = self.by_subject.setdefault(subject, collections.deque())
+        seqs.append(seq)
+        if headers:
+            if msg_id is not None:
+                self.msg_ids[msg_id] = seq
+            if headers.get(Header.ROLLUP.value) == "sub":
+                while len(seqs) > 1:
+                    self.remove(seqs[0])
+        limit = self.config.max_msgs_per_subject
+        if limit and limit > 0:
+            while len(seqs) > limit:
+                self.remove(seqs[0])
+        limit = self.config.max_msgs
+        if limit and limit > 0:
+            while len(self.messages) > limit:
+                self.remove(next(iter(self.messages)))
+        for consumer in self.consumers.values():
+            consumer.wake()
+        return PubAck(stream=self.name, seq=seq)
+
+    def remove(self, seq: int):
+        stored = self.messages.pop(seq, None)
+        if stored is None:
+            return
+        self.bytes -= len(stored.data)
+        seqs = self.by_subject[stored.subject]
+        seqs.remove(seq)
+        if not seqs:
+            del self.by_subject[stored.subject]
+
+    def info(self) -> StreamInfo:
+        state = StreamState(
+            messages=len(self.messages),
+            bytes=self.bytes,
+            first_seq=self.first_seq,
+            last_seq=self.last_seq,
+            consumer_count=len(self.consumers),
+        )
+        return StreamInfo(config=self.config, state=state, created=self.created)
+
+
+class _Consumer:
+    """Delivery state of one consumer: cursor, unacknowledged messages and redeliveries."""
+
+    def __init__(self, stream: _Stream, name: str, config: ConsumerConfig, ephemeral: bool = False):
+        self.stream = stream
+        self.name = name
+        self.config = config
+        self.ephemeral = ephemeral
+        self.configure(config)
+        self.delivered = 0  # Последний consumer sequence
+        self.pending: dict[int, float] = {}  # stream seq -> monotonic-дедлайн подтверждения
+        self.deliveries: dict[int, int] = {}  # stream seq -> число доставок
+        self.redeliver: collections.deque[int] = collections.deque()
+        self.expire_at = float("inf")  # Самый ранний дедлайн среди pending
+        self.initial: collections.deque[int] = collections.deque()
+        self.num_redelivered = 0
+        self.waiters: set[asyncio.Future] = set()
+        self.created = datetime.datetime.now(datetime.timezone.utc)
+        self.cursor = self._start()
+
+    def configure(self, config: ConsumerConfig):
+        # Изменяемые поля; позиция доставки и неподтверждённые сообщения сохраняются
+        self.config = config
+        self.filters = config.filter_subjects or ([config.filter_subject] if config.filter_subject else None)
+        self.ack_policy = config.ack_policy or AckPolicy.EXPLICIT
+        self.ack_wait = config.ack_wait or DEFAULT_ACK_WAIT
+        self.max_deliver = config.max_deliver or -1
+        self.max_ack_pending = config.max_ack_pending or DEFAULT_MAX_ACK_PENDING
+
+    def _start(self) -> int:
+        policy = self.config.deliver_policy or DeliverPolicy.ALL
+        stream = self.stream
+        if policy == DeliverPolicy.ALL:
+            return stream.first_seq
+        if policy == DeliverPolicy.NEW:
+            return stream.last_seq + 1
+        if policy == DeliverPolicy.BY_START_SEQUENCE:
+            return self.config.opt_start_seq or 1
+        if policy == DeliverPolicy.LAST:
+            last = [seqs[-1] for subject, seqs in stream.by_subject.items() if self.matches(subject)]
+            return max(last, default=stream.last_seq + 1)
+        if policy == DeliverPolicy.LAST_PER_SUBJECT:
+            last = [seqs[-1] for subject, seqs in stream.by_subject.items() if self.matches(subject)]
+            self.initial.extend(sorted(last))
+            return stream.last_seq + 1
+        raise BadRequestError(code=400, description=f"deliver policy {policy} is not supported in memory")
+
+    def matches(self, subject: str) -> bool:
+        return self.filters is None or any(subject_matches(pattern, subject) for pattern in self.filters)
+
+    @property
+    def num_pending(self) -> int:
+        # Оценка сверху: фильтр по subject не учитывается
+        return len(self.initial) + max(0, self.stream.last_seq - self.cursor + 1)
+
+    @property
+    def acks(self) -> bool:
+        return self.ack_policy != AckPolicy.NONE
+
+    def take(self, client: "MemoryClient") -> Optional[Msg]:
+        """Returns the next message to deliver or None if there is nothing to deliver now."""
+        if self.pending:
+            self._expire()
+        while self.redeliver:
+            seq = self.redeliver.popleft()
+            if seq in self.pending:
+                stored = self.stream.messages.get(seq)
+                if stored is not None and not self._exhausted(seq):
+                    self.num_redelivered += 1
+                    return self._deliver(client, stored)
+                self._forget(seq)
+        if self.acks and 0 < self.max_ack_pending <= len(self.pending):
+            return None
+        messages = self.stream.messages
+        while self.initial:
+            stored = messages.get(self.initial.popleft())
+            if stored is not None:
+                return self._deliver(client, stored)
+        while self.cursor <= self.stream.last_seq:
+            stored = messages.get(self.cursor)
+            self.cursor += 1
+            if stored is not None and self.matches(stored.subject):
+                return self._deliver(client, stored)
+        return None
+
+    def _exhausted(self, seq: int) -> bool:
+        return 0 < self.max_deliver <= self.deliveries.get(seq, 0)
+
+    def _deliver(self, client: "MemoryClient", stored: _StoredMsg) -> Msg:
+        self.delivered += 1
+        count = self.deliveries.get(stored.seq, 0) + 1
+        if self.acks:
+            deadline = self.pending[stored.seq] = time.monotonic() + self.ack_wait
+            self.expire_at = min(self.expire_at, deadline)
+            self.deliveries[stored.seq] = count
+        reply = (
+            f"{ACK_PREFIX}{self.stream.name}.{self.name}.{count}.{stored.seq}."
+            f"{self.delivered}.{stored.time_ns}.{self.num_pending}"
+        )
+        return Msg(_client=client, subject=stored.subject, reply=reply, data=stored.data, headers=stored.headers)
+
+    def _expire(self):
+        # Полный проход только когда истёк самый ранний из известных дедлайнов
+        now = time.monotonic()
+        if now < self.expire_at:
+            return
+        self.expire_at = float("inf")
+        for seq, deadline in self.pending.items():
+            if deadline <= now:
+                if seq not in self.redeliver:
+                    self.redeliver.append(seq)
+            elif deadline < self.expire_at:
+                self.expire_at = deadline
+
+    def _forget(self, seq: int):
+        self.pending.pop(seq, None)
+        self.deliveries.pop(seq, None)
+
+    def next_deadline(self) -> Optional[float]:
+        return min(self.pending.values(), default=None)
+
+    def ack(self, seq: int, payload: bytes):
+        if not self.acks:
+            return
+        if not payload or payload == Msg.Ack.Ack:
+            if self.ack_policy == AckPolicy.ALL:
+                for pending in [s for s in self.pending if s <= seq]:
+                    self._forget(pending)
+            else:
+                self._forget(seq)
+        elif payload.startswith(Msg.Ack.Nak):
+            if seq in self.pending:
+                delay = _nak_delay(payload)
+                if delay:
+                    deadline = self.pending[seq] = time.monotonic() + delay
+                    self.expire_at = min(self.expire_at, deadline)
+                else:
+                    self.redeliver.append(seq)
+        elif payload == Msg.Ack.Progress:
+            if seq in self.pending:
+                self.pending[seq] = time.monotonic() + self.ack_wait
+        elif payload == Msg.Ack.Term:
+            self._forget(seq)
+        self.wake()
+
+    def wake(self):
+        for waiter in self.waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.waiters.clear()
+
+    async def wait(self, timeout: Optional[float]):
+        # Ждём публикацию, nak или истечение ack_wait одного из сообщений.
+        # Своя фьюча вместо wait_for: wait_for в 3.11 может проглотить отмену задачи
+        deadline = self.next_deadline()
+        if deadline is not None:
+            expires = max(0.0, deadline - time.monotonic())
+            timeout = expires if timeout is None else min(timeout, expires)
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self.waiters.add(waiter)
+        timer = loop.call_later(timeout, _resolve, waiter) if timeout is not None else None
+        try:
+            await waiter
+        finally:
+            self.waiters.discard(waiter)
+            if timer is not None:
+                timer.cancel()
+
+    def info(self) -> ConsumerInfo:
+        return ConsumerInfo(
+            name=self.name,
+            stream_name=self.stream.name,
+            config=self.config,
+            created=self.created,
+            delivered=SequenceInfo(consumer_seq=self.delivered, stream_seq=self.cursor - 1),
+            num_ack_pending=len(self.pending),
+            num_redelivered=self.num_redelivered,
+            num_pending=self.num_pending,
+        )
+
+
+def _resolve(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def _nak_delay(payload: bytes) -> float:
+    # "-NAK {\"delay\": <ns>}"
+    _, _, body = payload.partition(b" ")
+    if not body:
+        return 0.0
+    return json.loads(body).get("delay", 0) / 1_000_000_000
+
+
+class MemoryServer:
+    """Streams and consumers shared by all MemoryClient instances bound to this server."""
+
+    def __init__(self):
+        self.streams: dict[str, _Stream] = {}
+        self.routes: dict[str, Optional[_Stream]] = {}  # Кэш subject -> стрим
+
+    def reset(self):
+        self.streams.clear()
+        self.routes.clear()
+
+    def stream(self, name: str) -> _Stream:
+        try:
+            return self.streams[name]
+        except KeyError:
+            raise NotFoundError(code=404, err_code=STREAM_NOT_FOUND, description="stream not found") from None
+
+    def route(self, subject: str) -> Optional[_Stream]:
+        try:
+            return self.routes[subject]
+        except KeyError:
+            stream = next((s for s in self.streams.values() if s.matches(subject)), None)
+            self.routes[subject] = stream
+            return stream
+
+    @staticmethod
+    def _with_defaults(config: StreamConfig) -> StreamConfig:
+        # Как сервер: info.config содержит заполненные умолчания, а не то, что прислал клиент
+        return dataclasses.replace(config, **{
+            field: value for field, value in STREAM_DEFAULTS.items() if not getattr(config, field)
+        })
+
+    def add_stream(self, config: StreamConfig) -> _Stream:
+        config = self._with_defaults(config)
+        if config.name in self.streams:
+            stream = self.streams[config.name]
+            if stream.config != config:
+                raise BadRequestError(code=400, err_code=10058, description="stream name already in use")
+            return stream
+        stream = self.streams[config.name] = _Stream(config)
+        self.routes.clear()
+        return stream
+
+    def update_stream(self, config: StreamConfig) -> _Stream:
+        stream = self.stream(config.name)
+        stream.config = self._with_defaults(config)
+        self.routes.clear()
+        return stream
+
+    def delete_stream(self, name: str):
+        stream = self.streams.pop(name, None)
+        if stream is None:
+            raise NotFoundError(code=404, err_code=STREAM_NOT_FOUND, description="stream not found")
+        self.routes.clear()
+        for consumer in stream.consumers.values():
+            consumer.wake()
+
+    def consumer(self, stream: str, name: str) -> _Consumer:
+        try:
+            return self.stream(stream).consumers[name]
+        except KeyError:
+            raise NotFoundError(code=404, err_code=CONSUMER_NOT_FOUND, description="consumer not found") from None
+
+    def add_consumer(self, stream_name: str, config: ConsumerConfig, update: bool = False) -> _Consumer:
+        stream = self.stream(stream_name)
+        name = config.durable_name or config.name
+        if name and name in stream.consumers:
+            # Подписка привязывается к существующему консюмеру, явный CONSUMER.CREATE обновляет его
+            consumer = stream.consumers[name]
+            if update and consumer.config != config:
+                for field in IMMUTABLE_CONSUMER_FIELDS:
+                    default = CONSUMER_DEFAULTS.get(field)
+                    if (getattr(config, field) or default) != (getattr(consumer.config, field) or default):
+                        raise BadRequestError(
+                            code=400, err_code=CONSUMER_CREATE,
+                            description=f"consumer {field.replace('_', ' ')} can not be updated",
+                        )
+                consumer.configure(config)
+                consumer.wake()
+            return consumer
+        consumer = _Consumer(stream, name or uuid.uuid4().hex[:22], config, ephemeral=not config.durable_name)
+        stream.consumers[consumer.name] = consumer
+        return consumer
+
+    def delete_consumer(self, stream: str, name: str):
+        consumer = self.consumer(stream, name)
+        del consumer.stream.consumers[name]
+        consumer.wake()
+
+    def ack(self, reply: str, payload: bytes):
+        tokens = reply.split(".")
+        stream = self.streams.get(tokens[2])
+        consumer = stream.consumers.get(tokens[3]) if stream is not None else None
+        if consumer is not None:
+            consumer.ack(int(tokens[5]), payload)
+
+
+# Сервер по умолчанию: клиенты процесса с transport="memory" видят общие стримы и бакеты
+default_server = MemoryServer()
+
+
+class _PullSubscription:
+    def __init__(self, client: "MemoryClient", consumer: _Consumer):
+        self.client = client
+        self.consumer = consumer
+
+    async def fetch(self, batch: int = 1, timeout: Optional[float] = 5, heartbeat: Optional[float] = None) -> list[Msg]:
+        await asyncio.sleep(0)  # Как и сетевой fetch, отдаём управление циклу
+        deadline = time.monotonic() + (timeout or 0)
+        msgs = []
+        while True:
+            while len(msgs) < batch:
+                msg = self.consumer.take(self.client)
+                if msg is None:
+                    break
+                msgs.append(msg)
+            if msgs:
+                return msgs
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise FetchTimeoutError if heartbeat else NATSTimeoutError
+            await self.consumer.wait(remaining)
+
+    async def consumer_info(self) -> ConsumerInfo:
+        return self.consumer.info()
+
+    async def unsubscribe(self):
+        if self.consumer.ephemeral:
+            self.consumer.stream.consumers.pop(self.consumer.name, None)
+
+
+class _PushSubscription:
+    def __init__(
+            self,
+            client: "MemoryClient",
+            consumer: _Consumer,
+            cb: Optional[Callable[[Msg], Awaitable[None]]],
+            manual_ack: bool
+    ):
+        self.client = client
+        self.consumer = consumer
+        self.cb = cb
+        self.manual_ack = manual_ack
+        self.delivered = 0
+        self.task = asyncio.create_task(self._run()) if cb is not None else None
+        client.subscriptions.add(self)
+
+    async def _run(self):
+        # Как в nats-py: коллбек подписки вызывается последовательно
+        while True:
+            msg = self.consumer.take(self.client)
+            if msg is None:
+                await self.consumer.wait(None)
+                continue
+            self.delivered += 1
+            try:
+                await self.cb(msg)
+                if not self.manual_ack and self.consumer.acks and not msg._ackd:
+                    await msg.ack()
+            except Exception:
+                await logger.aexception("Subscription callback failed", subject=msg.subject)
+
+    async def next_msg(self, timeout: Optional[float] = 1.0) -> Msg:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            msg = self.consumer.take(self.client)
+            if msg is not None:
+                self.delivered += 1
+                return msg
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise NATSTimeoutError
+            await self.consumer.wait(remaining)
+
+    async def consumer_info(self) -> ConsumerInfo:
+        return self.consumer.info()
+
+    async def unsubscribe(self):
+        self.client.subscriptions.discard(self)
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.consumer.ephemeral:
+            self.consumer.stream.consumers.pop(self.consumer.name, None)
+
+
+class _KeyWatcher:
+    """Same interface as nats.js.kv.KeyValue.KeyWatcher: None marks the end of initial values."""
+
+    def __init__(self, kv: "MemoryKeyValue", consumer: _Consumer, ignore_deletes: bool):
+        self.kv = kv
+        self.ignore_deletes = ignore_deletes
+        self.initial = consumer.num_pending if consumer.initial else 0
+        self.updates_queue: asyncio.Queue = asyncio.Queue()
+        if not self.initial:
+            self.updates_queue.put_nowait(None)
+        self.sub = _PushSubscription(kv.js.client, consumer, self._on_msg, manual_ack=True)
+
+    async def _on_msg(self, msg: Msg):
+        op = msg.headers.get(KV_OP) if msg.headers else None
+        if not (self.ignore_deletes and op in (KV_DEL, KV_PURGE)):
+            meta = msg.metadata
+            await self.updates_queue.put(KeyValue.Entry(
+                bucket=self.kv.bucket,
+                key=msg.subject[len(self.kv.prefix):],
+                value=msg.data,
+                revision=meta.sequence.stream,
+                delta=meta.num_pending,
+                created=meta.timestamp,
+                operation=op,
+            ))
+        if self.initial:
+            self.initial -= 1
+            if not self.initial:
+                await self.updates_queue.put(None)
+
+    async def updates(self, timeout: Optional[float] = 5.0):
+        try:
+            return await asyncio.wait_for(self.updates_queue.get(), timeout)
+        except asyncio.TimeoutError:
+            raise NATSTimeoutError
+
+    async def stop(self):
+        await self.sub.unsubscribe()
+        self.updates_queue.put_nowait(_STOP)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        entry = await self.updates_queue.get()
+        if entry is _STOP:
+            raise StopAsyncIteration
+        return entry
+
+
+class MemoryKeyValue:
+    """KV bucket over a stream "KV_<bucket>", mirrors the nats.js.kv.KeyValue methods."""
+
+    def __init__(self, js: "MemoryJetStream", bucket: str):
+        self.js = js
+        self.bucket = bucket
+        self.stream_name = f"KV_{bucket}"
+        self.prefix = f"$KV.{bucket}."
+
+    @property
+    def stream(self) -> _Stream:
+        return self.js.server.stream(self.stream_name)
+
+    def _entry(self, key: str, stored: Optional[_StoredMsg]) -> KeyValue.Entry:
+        op = stored.headers.get(KV_OP) if stored is not None and stored.headers else None
+        if stored is None or op in (KV_DEL, KV_PURGE):
+            raise KeyNotFoundError
+        return KeyValue.Entry(
+            bucket=self.bucket, key=key, value=stored.data, revision=stored.seq,
+            delta=None, created=None, operation=None,
+        )
+
+    async def get(self, key: str, revision: Optional[int] = None, validate_keys: bool = True) -> KeyValue.Entry:
+        stream = self.stream
+        if revision:
+            stored = stream.messages.get(revision)
+            if stored is not None and stored.subject != f"{self.prefix}{key}":
+                stored = None
+        else:
+            stored = stream.last(f"{self.prefix}{key}")
+        return self._entry(key, stored)
+
+    async def put(self, key: str, value: bytes, validate_keys: bool = True) -> int:
+        ack = await self.js.publish(f"{self.prefix}{key}", value)
+        return ack.seq
+
+    async def update(self, key: str, value: bytes, last: Optional[int] = None, validate_keys: bool = True) -> int:
+        headers = {Header.EXPECTED_LAST_SUBJECT_SEQUENCE.value: str(last or 0)}
+        try:
+            ack = await self.js.publish(f"{self.prefix}{key}", value, headers=headers)
+        except BadRequestError as e:
+            if e.err_code == WRONG_LAST_SEQUENCE:
+                raise KeyWrongLastSequenceError(description=e.description)
+            raise
+        return ack.seq
+
+    async def create(self, key: str, value: bytes, validate_keys: bool = True) -> int:
+        # Как в nats-py: ключ, удалённый ранее, можно создать заново
+        stored = self.stream.last(f"{self.prefix}{key}")
+        if stored is not None and stored.headers and stored.headers.get(KV_OP) in (KV_DEL, KV_PURGE):
+            return await self.update(key, value, last=stored.seq)
+        return await self.update(key, value, last=0)
+
+    async def delete(self, key: str, last: Optional[int] = None, validate_keys: bool = True) -> bool:
+        headers = {KV_OP: KV_DEL}
+        if last and last > 0:
+            headers[Header.EXPECTED_LAST_SUBJECT_SEQUENCE.value] = str(last)
+        await self.js.publish(f"{self.prefix}{key}", headers=headers)
+        return True
+
+    async def purge(self, key: str) -> bool:
+        await self.js.publish(f"{self.prefix}{key}", headers={KV_OP: KV_PURGE, Header.ROLLUP.value: "sub"})
+        return True
+
+    async def keys(self, filters: Optional[list[str]] = None, **kwargs) -> list[str]:
+        keys = [
+            subject[len(self.prefix):]
+            for subject, seqs in self.stream.by_subject.items()
+            if not (self.stream.messages[seqs[-1]].headers or {}).get(KV_OP)
+        ]
+        if filters:
+            keys = [key for key in keys if any(subject_matches(f, key) for f in filters)]
+        if not keys:
+            raise NoKeysError
+        return keys
+
+    async def history(self, key: str) -> list[KeyValue.Entry]:
+        stream = self.stream
+        seqs = stream.by_subject.get(f"{self.prefix}{key}")
+        if not seqs:
+            raise NoKeysError
+        return [
+            KeyValue.Entry(
+                bucket=self.bucket, key=key, value=stream.messages[seq].data, revision=seq,
+                delta=None, created=None,
+                operation=(stream.messages[seq].headers or {}).get(KV_OP),
+            )
+            for seq in seqs
+        ]
+
+    async def watch(
+            self,
+            keys: str,
+            headers_only: bool = False,
+            include_history: bool = False,
+            ignore_deletes: bool = False,
+            meta_only: bool = False,
+            inactive_threshold: Optional[float] = None
+    ) -> _KeyWatcher:
+        config = ConsumerConfig(
+            ack_policy=AckPolicy.NONE,
+            deliver_policy=DeliverPolicy.ALL if include_history else DeliverPolicy.LAST_PER_SUBJECT,
+            filter_subject=f"{self.prefix}{keys}",
+        )
+        consumer = self.js.server.add_consumer(self.stream_name, config)
+        return _KeyWatcher(self, consumer, ignore_deletes)
+
+    async def watchall(self, **kwargs) -> _KeyWatcher:
+        return await self.watch(">", **kwargs)
+
+
+class MemoryJetStream:
+    """JetStream context of a MemoryClient: the subset of nats.js.JetStreamContext used by the clients."""
+
+    def __init__(self, client: "MemoryClient"):
+        self.client = client
+        self.server = client.server
+
+    async def publish(
+            self,
+            subject: str,
+            payload: bytes = b"",
+            timeout: Optional[float] = None,
+            stream: Optional[str] = None,
+            headers: Optional[dict] = None,
+            **kwargs: Any
+    ) -> PubAck:
+        await asyncio.sleep(0)  # Публикация в сеть тоже уступает циклу событий
+        target = self.server.route(subject)
+        if target is None or (stream is not None and target.name != stream):
+            raise NoStreamResponseError
+        return target.store(subject, payload, headers)
+
+    async def add_stream(self, config: Optional[StreamConfig] = None, **params: Any) -> StreamInfo:
+        config = dataclasses.replace(config, **params) if config else StreamConfig(**params)
+        return self.server.add_stream(config).info()
+
+    async def update_stream(self, config: Optional[StreamConfig] = None, **params: Any) -> StreamInfo:
+        config = dataclasses.replace(config, **params) if config else StreamConfig(**params)
+        return self.server.update_stream(config).info()
+
+    async def stream_info(self, name: str, **kwargs: Any) -> StreamInfo:
+        return self.server.stream(name).info()
+
+    async def streams_info(self, **kwargs: Any) -> list[StreamInfo]:
+        return [stream.info() for stream in self.server.streams.values()]
+
+    async def delete_stream(self, name: str) -> bool:
+        self.server.delete_stream(name)
+        return True
+
+    async def add_consumer(self, stream: str, config: Optional[ConsumerConfig] = None, **params: Any) -> ConsumerInfo:
+        config = dataclasses.replace(config, **params) if config else ConsumerConfig(**params)
+        return self.server.add_consumer(stream, config, update=True).info()
+
+    async def consumer_info(self, stream: str, consumer: str, **kwargs: Any) -> ConsumerInfo:
+        return self.server.consumer(stream, consumer).info()
+
+    async def consumers_info(self, stream: str, offset: Optional[int] = None) -> list[ConsumerInfo]:
+        return [consumer.info() for consumer in self.server.stream(stream).consumers.values()]
+
+    async def delete_consumer(self, stream: str, consumer: str) -> bool:
+        self.server.delete_consumer(stream, consumer)
+        return True
+
+    def _stream_for(self, subject: str, stream: Optional[str]) -> str:
+        if stream is not None:
+            return stream
+        target = self.server.route(subject)
+        if target is None:
+            raise NotFoundError(code=404, err_code=STREAM_NOT_FOUND, description="no stream matches subject")
+        return target.name
+
+    def _consumer(
+            self,
+            subject: str,
+            durable: Optional[str],
+            stream: Optional[str],
+            config: Optional[ConsumerConfig],
+            **params: Any
+    ) -> _Consumer:
+        config = dataclasses.replace(config) if config else ConsumerConfig()
+        if durable:
+            config.durable_name = durable
+        if not config.filter_subject and not config.filter_subjects:
+            config.filter_subject = subject
+        for key, value in params.items():
+            if value is not None:
+                setattr(config, key, value)
+        return self.server.add_consumer(self._stream_for(subject, stream), config)
+
+    async def pull_subscribe(
+            self,
+            subject: str,
+            durable: Optional[str] = None,
+            stream: Optional[str] = None,
+            config: Optional[ConsumerConfig] = None,
+            **kwargs: Any
+    ) -> _PullSubscription:
+        return _PullSubscription(self.client, self._consumer(subject, durable, stream, config))
+
+    async def pull_subscribe_bind(
+            self,
+            consumer: Optional[str] = None,
+            stream: Optional[str] = None,
+            durable: Optional[str] = None,
+            **kwargs: Any
+    ) -> _PullSubscription:
+        if not stream:
+            raise ValueError("nats: stream name is required")
+        return _PullSubscription(self.client, self.server.consumer(stream, durable or consumer))
+
+    async def subscribe(
+            self,
+            subject: str,
+            queue: Optional[str] = None,
+            cb: Optional[Callable[[Msg], Awaitable[None]]] = None,
+            durable: Optional[str] = None,
+            stream: Optional[str] = None,
+            config: Optional[ConsumerConfig] = None,
+            manual_ack: bool = False,
+            ordered_consumer: bool = False,
+            deliver_policy: Optional[DeliverPolicy] = None,
+            headers_only: Optional[bool] = None,
+            **kwargs: Any
+    ) -> _PushSubscription:
+        # Упорядоченный консюмер - эфемерный и без подтверждений, как на сервере
+        ack_policy = AckPolicy.NONE if ordered_consumer else None
+        consumer = self._consumer(
+            subject, durable, stream, config, deliver_policy=deliver_policy, ack_policy=ack_policy
+        )
+        return _PushSubscription(self.client, consumer, cb, manual_ack)
+
+    async def key_value(self, bucket: str) -> MemoryKeyValue:
+        if f"KV_{bucket}" not in self.server.streams:
+            raise BucketNotFoundError
+        return MemoryKeyValue(self, bucket)
+
+    async def create_key_value(self, config: Optional[KeyValueConfig] = None, **params: Any) -> MemoryKeyValue:
+        config = dataclasses.replace(config, **params) if config else KeyValueConfig(**params)
+        self.server.add_stream(StreamConfig(
+            name=f"KV_{config.bucket}",
+            description=config.description,
+            subjects=[f"$KV.{config.bucket}.>"],
+            max_msgs_per_subject=config.history or 1,
+            max_bytes=config.max_bytes,
+            max_age=config.ttl,
+            max_msg_size=config.max_value_size,
+            allow_rollup_hdrs=True,
+            deny_delete=True,
+            storage=config.storage,
+            num_replicas=config.replicas,
+        ))
+        return MemoryKeyValue(self, config.bucket)
+
+    async def delete_key_value(self, bucket: str) -> bool:
+        self.server.delete_stream(f"KV_{bucket}")
+        return True
+
+
+class MemoryClient:
+    """Drop-in for nats.aio.client.Client limited to JetStream and KV."""
+
+    def __init__(self, server: Optional[MemoryServer] = None):
+        self.server = server or default_server
+        self.subscriptions: set[_PushSubscription] = set()
+        self.is_connected = False
+        self.servers = []
+
+    async def connect(self, servers=None, **options: Any):
+        self.servers = servers or []
+        self.is_connected = True
+
+    async def close(self):
+        await asyncio.gather(*(sub.unsubscribe() for sub in list(self.subscriptions)))
+        self.is_connected = False
+
+    async def drain(self):
+        await self.close()
+
+    async def flush(self, timeout: float = 2):
+        pass
+
+    def jetstream(self, **options: Any) -> MemoryJetStream:
+        return MemoryJetStream(self)
+
+    async def publish(self, subject: str, payload: bytes = b"", reply: str = "", headers: Optional[dict] = None):
+        # Обычные публикации доходят только до ack-subject'ов JetStream
+        if subject.startswith(ACK_PREFIX):
+            self.server.ack(subject, payload)
+
+    async def request(self, subject: str, payload: bytes = b"", timeout: float = 0.5, headers: Optional[dict] = None) -> Msg:
+        await self.publish(subject, payload)
+        return Msg(_client=self, subject=subject)
+
+
+def create_client(transport: Union[str, MemoryServer, Any, None] = None):
+    """
+    Returns the connection object for a client.
+    None or "nats" - a real nats.aio.client.Client, "memory" - a MemoryClient on the default
+    in-process server, a MemoryServer - a MemoryClient on that server; anything else is used as is.
+    """
+    if transport is None or transport == "nats":
+        return NATS()
+    if transport == "memory":
+        return MemoryClient()
+    if isinstance(transport, MemoryServer):
+        return MemoryClient(transport)
+    if isinstance(transport, str):
+        raise ValueError(f"Unknown transport: {transport}")
+    return transport
@@ -0,0 +1,213 @@
+import asyncio
+import itertools
+import math
+from typing import Callable, Iterable, Optional
+
+# Гистограмма в стиле HDR: 32 под-интервала на каждую степень двойки (~3% погрешности),
+# запись значения - O(1) без выделения памяти после прогрева
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+# Границы бакетов для экспорта в Prometheus (секунды)
+EXPORT_BOUNDS_SECONDS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+EXPORT_BOUNDS_COUNT = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _index(value: int) -> int:
+    shift = max(0, value.bit_length() - SUB_BUCKET_BITS - 1)
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def _lower_bound(index: int) -> int:
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return (index - shift * SUB_BUCKETS) << shift
+
+
+class Histogram:
+    """Log-linear histogram of non-negative values recorded as integers of `1 / scale` units."""
+
+    def __init__(self, scale: float = 1_000_000, bounds: Iterable[float] = EXPORT_BOUNDS_SECONDS):
+        self.scale = scale  # 1e6: значения в секундах хранятся в микросекундах
+        self.bounds = tuple(bounds)
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value: float):
+        index = _index(int(value * self.scale)) if value > 0 else 0
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * q / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                # Верхняя граница бакета, но не больше реального максимума
+                upper = _lower_bound(index + 1) / self.scale
+                return min(upper, self.max)
+        return self.max
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        # Счётчики для фиксированных границ "le" в формате Prometheus
+        result = []
+        items = sorted(self.counts.items())
+        seen, i = 0, 0
+        for bound in self.bounds:
+            while i < len(items) and _lower_bound(items[i][0] + 1) / self.scale <= bound:
+                seen += items[i][1]
+                i += 1
+            result.append((bound, seen))
+        return result
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+def _escape(value) -> str:
+    # Экранирование значения метки по текстовому формату Prometheus: \\, \" и перевод строки
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class Metrics:
+    """Registry of counters and histograms; exported as Prometheus text or a dict snapshot."""
+
+    def __init__(self):
+        self.histograms: dict[tuple, Histogram] = {}
+        self.counters: dict[tuple, Counter] = {}
+        self.help: dict[str, str] = {}
+        # Коллекторы возвращают (имя, метки, значение) на момент экспорта, например статистику кэша.
+        # Имена с суффиксом _total экспортируются как counter, остальные - как gauge
+        self.collectors: list[Callable[[], Iterable[tuple[str, dict, float]]]] = []
+
+    def histogram(self, name: str, help: str = "", scale: float = 1_000_000,
+                  bounds: Iterable[float] = EXPORT_BOUNDS_SECONDS, **labels) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(scale, bounds)
+            self.help.setdefault(name, help)
+        return histogram
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        key = (name, tuple(sorted(labels.items())))
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self.counters[key] = Counter()
+            self.help.setdefault(name, help)
+        return counter
+
+    def collector(self, collect: Callable[[], Iterable[tuple[str, dict, float]]]):
+        self.collectors.append(collect)
+
+    def remove_collector(self, collect: Callable[[], Iterable[tuple[str, dict, float]]]):
+        # Остановленный клиент не должен держаться реестром и попадать в экспорт
+        if collect in self.collectors:
+            self.collectors.remove(collect)
+
+    def snapshot(self) -> dict:
+        result = {}
+        for (name, labels), histogram in self.histograms.items():
+            result[f"{name}{_labels(dict(labels))}"] = histogram.snapshot()
+        for (name, labels), counter in self.counters.items():
+            result[f"{name}{_labels(dict(labels))}"] = counter.value
+        for collect in self.collectors:
+            for name, labels, value in collect():
+                result[f"{name}{_labels(labels)}"] = value
+        return result
+
+    def render_prometheus(self) -> str:
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if self.help.get(name):
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            describe(name, "histogram")
+            labels = dict(labels)
+            for bound, count in histogram.cumulative():
+                lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {count}")
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for (name, labels), counter in sorted(self.counters.items(), key=lambda item: item[0]):
+            describe(name, "counter")
+            lines.append(f"{name}{_labels(dict(labels))} {counter.value}")
+        for collect in self.collectors:
+            for name, labels, value in collect():
+                describe(name, "counter" if name.endswith("_total") else "gauge")
+                lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Общий реестр по умолчанию для всех клиентов процесса
+registry = Metrics()
+
+_instances = itertools.count(1)
+
+
+def instance_name(name: Optional[str], kind: str) -> str:
+    # Значение метки для экземпляра без имени: серии разных экземпляров не сливаются в одну с пустой меткой
+    return name or f"{kind}-{next(_instances)}"
+
+
+async def serve_metrics(metrics: Optional[Metrics] = None, host: str = "127.0.0.1", port: int = 9464):
+    # Минимальный HTTP-эндпоинт /metrics для Prometheus, без внешних зависимостей.
+    # По умолчанию только локальный интерфейс: наружу - явным host="0.0.0.0"
+    metrics = metrics or registry
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if request.split(b" ")[1:2] == [b"/metrics"]:
+                status, body = "200 OK", metrics.render_prometheus().encode()
+            else:
+                status, body = "404 Not Found", b""
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -1,81 +1,345 @@
 import asyncio
-from typing import Optional
+import time
+from typing import Iterable, Mapping, Optional, Union
 
 import structlog
-from nats.aio.client import Client
-from nats.aio.msg import Msg
-from nats.js.api import ConsumerConfig, AckPolicy, DeliverPolicy
-from nats.errors import TimeoutError as NATSTimeoutError
-import ormsgpack
+from nats.js.api import DeliverPolicy
+from nats.js.errors import KeyDeletedError, KeyNotFoundError
 
 from src.infrastructure.logger.loggers import InitLoggers
+from src.main.new_app.checkpoint import KVCheckpoint
+from src.main.new_app.kv_cache import MISSING, CacheStats, KVCache
+from src.main.new_app.kv_coalesce import WriteCoalescer
+from src.main.new_app.kv_watch import KVEvent, Watch, WatchManager
+from src.main.new_app.memory import MemoryServer
+from src.main.new_app.metrics import Metrics, instance_name, registry
+from src.main.new_app.pool import HASH, ConnectionPool
+from src.main.new_app.serialization import Codec, build, get_codec
+from src.main.new_app.topology import Change, Topology
 
 logger = structlog.getLogger(InitLoggers.main.name)
 
 
 class NATSKeyValueClient:
-    def __init__(self, servers: Optional[list[str]] = None):
-        self.nc = Client()
+    def __init__(
+            self,
+            servers: Optional[list[str]] = None,
+            codec: Union[str, Codec, None] = None,
+            cache_size: int = 0,
+            cache_ttl: Optional[float] = None,
+            metrics: Optional[Metrics] = None,
+            transport: Union[str, MemoryServer, None] = None,
+            pool_size: int = 1,
+            pool_policy: str = HASH,
+            topology: Optional[Topology] = None,
+            coalesce: Optional[float] = None,
+            checkpoint_dir: Optional[str] = None,
+            checkpoint_interval: float = 5.0,
+            name: Optional[str] = None
+    ):
+        # "memory" - JetStream в памяти процесса, без сервера (тесты, профилирование)
+        # pool_size > 1 - операции с ключами распределяются по нескольким соединениям
+        self.pool = ConnectionPool(pool_size, pool_policy, transport)
+        self.nc = self.pool.primary.nc
         self.servers = servers or ["nats://127.0.0.1:30114"]
+        self.codec = get_codec(codec)  # msgpack по умолчанию
         self.js = None  # Контекст JetStream
         self.kv = None  # Экземпляр KV-бакета
-        self.watch_task = None  # Фоновая задача для отслеживания изменений
+        self.bucket: Optional[str] = None  # Имя бакета self.kv
+        self.kvs = []  # Тот же бакет через каждое соединение пула
+        self.watcher = None  # Менеджер наблюдений за бакетами
+        # Локальные снимки наблюдаемых бакетов: после перезапуска наблюдение продолжается с сохранённой ревизии
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint: Optional[KVCheckpoint] = None
+        self.topology = topology or Topology()  # Объявленные бакеты, сведения кэшируются
+        # Локальный кэш чтений, включается при cache_size > 0
+        self.cache = KVCache(self.codec.decode, cache_size, cache_ttl) if cache_size else None
+        self.cache_watch = None  # Watch, поддерживающий кэш в актуальном состоянии
+        self.metrics = metrics or registry  # Общий реестр метрик процесса по умолчанию
+        self.name = instance_name(name, "kv")  # Метка client: серии клиентов процесса не смешиваются
+        self.get_latency = self.metrics.histogram(
+            "nats_kv_op_seconds", "KV operation latency", op="get", client=self.name
+        )
+        self.put_latency = self.metrics.histogram(
+            "nats_kv_op_seconds", "KV operation latency", op="put", client=self.name
+        )
+        if self.cache is not None:
+            self.metrics.collector(self._cache_metrics)
+        # coalesce - интервал, с которым put_value/update_value пишут последние значения ключей;
+        # промежуточные значения на сервер не попадают
+        self.writes = (
+            WriteCoalescer(self._write, coalesce, metrics=self.metrics, name=self.name) if coalesce else None
+        )
 
     async def connect(self):
-        await self.nc.connect(servers=self.servers)
-        self.js = self.nc.jetstream()
+        await self.pool.connect(self.servers)
+        self.js = self.pool.primary.js
+        self.watcher = WatchManager(self.js, self.codec)
+        if self.checkpoint_dir:
+            self.checkpoint = KVCheckpoint(self.watcher, self.checkpoint_dir, self.checkpoint_interval, self.codec)
         await logger.ainfo("Connected to NATS JetStream.")
 
     async def disconnect(self):
-        if self.watch_task:
-            self.watch_task.cancel()
-            await asyncio.gather(self.watch_task, return_exceptions=True)
-        await self.nc.close()
+        if self.writes is not None:
+            await self.writes.close()
+        if self.checkpoint is not None:
+            await self.checkpoint.close()
+        if self.watcher is not None:
+            await self.watcher.close()
+        if self.cache is not None:
+            self.metrics.remove_collector(self._cache_metrics)
+        await self.pool.close()
         await logger.ainfo("Disconnected from NATS.")
 
+    async def create_bucket(self, bucket_name: str, **config):
+        # Получаем существующий KV-бакет или создаём новый; config - поля KeyValueConfig (history, ttl, ...)
+        if config or bucket_name not in self.topology.buckets:
+            self.topology.bucket(bucket_name, **config)
+        await self.topology.ensure_bucket(self.js, bucket_name)
+        self.kv = await self.js.key_value(bucket_name)
+        self.bucket = bucket_name
+        self.kvs = [self.kv] + [await member.js.key_value(bucket_name) for member in self.pool.members[1:]]
+        if self.cache is not None:
+            self.cache.clear()
+            if self.cache_watch:
+                await self.cache_watch.stop()
+            # Кэш делит консюмер бакета с остальными наблюдателями
+            self.cache_watch = await self.watch_bucket(bucket_name, self._update_cache)
+
+    async def reconcile(self) -> list[Change]:
+        return await self.topology.reconcile(self.js)
+
+    async def _update_cache(self, event: KVEvent):
+        # Обновления приходят с ревизиями, поэтому порядок относительно get() не важен
+        if event.deleted:
+            self.cache.delete(event.key, event.revision)
+        else:
+            self.cache.put(event.key, bytes(event.data), event.revision)
+
+    def _cache_metrics(self):
+        stats = self.cache.stats
+        labels = {"client": self.name, "bucket": self.bucket or ""}
+        return [
+            ("nats_kv_cache_hits_total", labels, stats.hits),
+            ("nats_kv_cache_misses_total", labels, stats.misses),
+            ("nats_kv_cache_evictions_total", labels, stats.evictions),
+            ("nats_kv_cache_expirations_total", labels, stats.expirations),
+            ("nats_kv_cache_stale_drops_total", labels, stats.stale_drops),
+            ("nats_kv_cache_size", labels, len(self.cache)),
+        ]
+
+    @property
+    def cache_stats(self) -> Optional[CacheStats]:
+        return self.cache.stats if self.cache is not None else None
+
+    def cached_value(self, key: str, default=None, schema: Optional[type] = None):
+        # Синхронное чтение из кэша, без обращения к серверу
+        if self.cache is None:
+            return default
+        value = self.cache.get(key)
+        if value is MISSING:
+            return default
+        return build(schema, value)
+
+    async def _put(self, key: str, data: bytes) -> int:
+        # Соединение выбирается по ключу (или по загрузке), см. ConnectionPool.pick
+        member = self.pool.pick(key)
+        member.in_flight += 1
+        try:
+            return await self.kvs[member.index].put(key, data)
+        finally:
+            member.in_flight -= 1
+
+    async def _update(self, key: str, data: bytes, revision: int) -> int:
+        member = self.pool.pick(key)
+        member.in_flight += 1
+        try:
+            return await self.kvs[member.index].update(key, data, last=revision)
+        finally:
+            member.in_flight -= 1
+
+    async def _write(self, key: str, data: bytes, revision: Optional[int] = None) -> int:
+        started = time.perf_counter()
+        if revision is None:
+            revision = await self._put(key, data)
+        else:
+            revision = await self._update(key, data, revision)
+        self.put_latency.record(time.perf_counter() - started)
+        if self.cache is not None:
+            self.cache.put(key, data, revision)
+        return revision
+
+    async def _get(self, key: str):
+        member = self.pool.pick(key)
+        member.in_flight += 1
+        try:
+            return await self.kvs[member.index].get(key)
+        finally:
+            member.in_flight -= 1
+
     async def put_value(self, key: str, value):
-        data = ormsgpack.packb(value)
-        await self.kv.put(key, data)
+        data = self.codec.encode(value)
+        if self.writes is not None:
+            # Запишется при следующем flush, если раньше не придёт новое значение
+            self.writes.put(key, data)
+            return
+        await self._write(key, data)
         await logger.adebug("Put key-value", key=key, value=value)
 
-    async def get_value(self, key: str):
-        entry = await self.kv.get(key)
-        value = ormsgpack.unpackb(entry.value)
+    async def update_value(self, key: str, value, revision: int) -> int:
+        # Оптимистичная запись: только если ревизия ключа не изменилась (см. get_entry),
+        # иначе KeyWrongLastSequenceError. Возвращает новую ревизию
+        data = self.codec.encode(value)
+        if self.writes is not None:
+            return await self.writes.put(key, data, revision, wait=True)
+        revision = await self._write(key, data, revision)
+        await logger.adebug("Updated key-value", key=key, revision=revision)
+        return revision
+
+    async def get_entry(self, key: str, schema: Optional[type] = None) -> tuple:
+        # Значение вместе с ревизией - для update_value
+        if self.writes is not None and self.writes.get(key) is not None:
+            # Ревизия должна учитывать ещё не записанное значение
+            await self.writes.flush()
+        cached = self.cache.get(key) if self.cache is not None else MISSING
+        if cached is not MISSING:
+            return build(schema, cached), self.cache.revision(key)
+        entry = await self._get(key)
+        value = self.codec.decode(memoryview(entry.value))
+        if self.cache is not None:
+            self.cache.put(key, entry.value, entry.revision, value)
+        return build(schema, value), entry.revision
+
+    async def flush(self) -> dict[str, int]:
+        # Записывает накопленные значения сейчас, не дожидаясь интервала
+        if self.writes is None:
+            return {}
+        return await self.writes.flush()
+
+    async def get_value(self, key: str, schema: Optional[type] = None):
+        if self.writes is not None:
+            data = self.writes.get(key)
+            if data is not None:
+                return build(schema, self.codec.decode(memoryview(data)))
+        if self.cache is not None:
+            value = self.cache.get(key)
+            if value is not MISSING:
+                return build(schema, value)
+        started = time.perf_counter()
+        entry = await self._get(key)
+        self.get_latency.record(time.perf_counter() - started)
+        value = self.codec.decode(memoryview(entry.value))
+        if self.cache is not None:
+            self.cache.put(key, entry.value, entry.revision, value)
         await logger.adebug("Got key-value", key=key, value=value)
-        return value
-
-    # async def watch_bucket(self, callback):
-    #     # Функция для наблюдения за всеми изменениями в бакете
-    #
-    #     async def watch():
-    #         await logger.adebug("Create new watch", callback=callback.__name__)
-    #         async for entry in await self.kv.watchall():
-    #             await logger.adebug(entry)
-    #             await callback(entry)
-    #     self.watch_task = asyncio.create_task(watch())
-
-    async def watch_bucket(self, bucket_name, callback):
-        await logger.adebug("Create new watch", callback=callback.__name__)
-        # Используем имя бакета, сохранённое при создании/получении KV
-        subject = f"$KV.{bucket_name}.>"
-        consumer_config = ConsumerConfig(
-            durable_name=f"{bucket_name}_watcher",
-            ack_policy=AckPolicy.EXPLICIT,
-            deliver_policy=DeliverPolicy.ALL  # Получаем только новые сообщения
-        )
-        # Создаем подписку на изменения в бакете (он реализован как стрим)
-        sub = await self.js.subscribe(
-            subject,
-            durable=f"{bucket_name}_watcher",
-            config=consumer_config
-        )
+        return build(schema, value)
+
+    async def get_many(self, keys: Iterable[str], schema: Optional[type] = None, concurrency: int = 32) -> dict:
+        # Параллельное чтение; отсутствующие и удалённые ключи в результат не попадают
+        limit = asyncio.Semaphore(concurrency)
+        result = {}
 
-        async def watch():
-            async for msg in sub.messages:
-                # await logger.adebug("Received update", msg=msg)
-                await callback(msg)
+        async def fetch(key):
+            if self.writes is not None:
+                data = self.writes.get(key)
+                if data is not None:
+                    # Своя ещё не записанная запись новее сервера и кэша
+                    result[key] = build(schema, self.codec.decode(memoryview(data)))
+                    return
+            if self.cache is not None:
+                value = self.cache.get(key)
+                if value is not MISSING:
+                    result[key] = build(schema, value)
+                    return
+            async with limit:
+                try:
+                    entry = await self._get(key)
+                except (KeyNotFoundError, KeyDeletedError):
+                    return
+            value = self.codec.decode(memoryview(entry.value))
+            if self.cache is not None:
+                self.cache.put(key, entry.value, entry.revision, value)
+            result[key] = build(schema, value)
 
-        self.watch_task = asyncio.create_task(watch())
+        keys = list(keys)
+        await asyncio.gather(*map(fetch, keys))
+        await logger.adebug("Got key-values", requested=len(keys), found=len(result))
+        return result
+
+    async def put_many(self, items: Union[Mapping, Iterable[tuple]], concurrency: int = 32) -> dict[str, int]:
+        # Параллельная запись, возвращает ревизии по ключам
+        pairs = items.items() if isinstance(items, Mapping) else items
+        if self.writes is not None:
+            # Через тот же буфер, что put_value: иначе накопленное старое значение
+            # записалось бы при следующем flush поверх нового
+            futures = [(key, self.writes.put(key, self.codec.encode(value), wait=True)) for key, value in pairs]
+            results = await asyncio.gather(*(future for _, future in futures))
+            await logger.adebug("Put key-values", count=len(futures))
+            return {key: revision for (key, _), revision in zip(futures, results)}
+        limit = asyncio.Semaphore(concurrency)
+        revisions = {}
+
+        async def store(key, value):
+            data = self.codec.encode(value)
+            async with limit:
+                revisions[key] = await self._put(key, data)
+            if self.cache is not None:
+                self.cache.put(key, data, revisions[key])
+
+        await asyncio.gather(*(store(key, value) for key, value in pairs))
+        await logger.adebug("Put key-values", count=len(revisions))
+        return revisions
+
+    async def snapshot(self, prefix: str = "", schema: Optional[type] = None) -> dict:
+        # Последние значения всех ключей (или ключей с префиксом) за один проход по стриму бакета.
+        # Префикс, оканчивающийся на ".", фильтруется на сервере, остальные - на клиенте
+        server_filter = f"{prefix}>" if prefix.endswith(".") else ">"
+        watcher = await self.kv.watch(server_filter, ignore_deletes=True)
+        result = {}
+        try:
+            while True:
+                entry = await watcher.updates(timeout=None)
+                if entry is None:
+                    # Начальная выгрузка (LAST_PER_SUBJECT) закончилась
+                    break
+                if not entry.key.startswith(prefix):
+                    continue
+                value = self.codec.decode(memoryview(entry.value))
+                if self.cache is not None:
+                    self.cache.put(entry.key, entry.value, entry.revision, value)
+                result[entry.key] = build(schema, value)
+        finally:
+            await watcher.stop()
+        if self.writes is not None:
+            # Ещё не записанные значения новее прочитанных из стрима
+            for key, data in self.writes.unwritten().items():
+                if key.startswith(prefix):
+                    result[key] = build(schema, self.codec.decode(memoryview(data)))
+        await logger.adebug("Loaded snapshot", prefix=prefix, count=len(result))
+        return result
+
+    async def watch_bucket(
+            self,
+            bucket_name,
+            callback,
+            keys: str = ">",
+            deliver_policy: Optional[DeliverPolicy] = None,
+            from_revision: Optional[int] = None
+    ) -> Watch:
+        # Все наблюдения за бакетом используют один консюмер; повторный вызов
+        # добавляет коллбек, а не создаёт новую подписку на сервере.
+        # from_revision - продолжить после последней обработанной ревизии,
+        # без него при checkpoint_dir - с локального снимка, если он есть
+        if self.checkpoint is not None and from_revision is None:
+            return await self.checkpoint.watch(bucket_name, callback, keys=keys, deliver_policy=deliver_policy)
+        return await self.watcher.watch(
+            bucket_name,
+            callback,
+            keys=keys,
+            deliver_policy=deliver_policy,
+            from_revision=from_revision,
+        )
 
 
 async def main():
@@ -84,12 +348,11 @@ async def main():
 
     # Создаём или получаем KV-бакет с именем "TestBucket"
     bucket_name = "TestBucket"
-    # await nats_client.create_bucket(bucket_name)
+    await nats_client.create_bucket(bucket_name)
 
     # Пример функции-колбэка, вызываемой при изменениях в бакете
-    async def example_callback(msg: Msg):
-        print(f"{msg.data}")
-        await msg.ack()
+    async def example_callback(event: KVEvent):
+        print(f"{event.key} rev={event.revision}: {event.value}")
 
     # Запускаем наблюдение за изменениями в бакете
     await nats_client.watch_bucket(bucket_name, example_callback)
@@ -1,88 +1,265 @@
 import asyncio
+import dataclasses
+import time
 from datetime import datetime, timedelta
 from functools import partial
-from typing import Optional
+from typing import Optional, Union
 
 import structlog
-from nats.aio.client import Client as NATS
 from nats.js.api import ConsumerConfig, AckPolicy, DeliverPolicy
-from nats.errors import TimeoutError as NATSTimeoutError
-import ormsgpack
+
+from src.main.new_app.batching import BatchPublisher, BatchSettings, Unpacker
+from src.main.new_app.consumer import PullConsumer, PullSettings
+from src.main.new_app.memory import MemoryServer
+from src.main.new_app.metrics import Metrics, instance_name, registry
+from src.main.new_app.offload import Offload
+from src.main.new_app.partition import PartitionSettings, Partitioner, by_field
+from src.main.new_app.pool import HASH, ConnectionPool
+from src.main.new_app.publisher import PublishPipeline, PublishResult
+from src.main.new_app.serialization import Codec, PayloadMsg, get_codec
+from src.main.new_app.topology import Change, Topology
 
 logger: structlog.BoundLogger = structlog.getLogger("NATSClient")
 
 
 class NATSClient:
-    def __init__(self, servers: Optional[list[str]] = None):
-        self.nc = NATS()
+    def __init__(
+            self,
+            servers: Optional[list[str]] = None,
+            publish_window: int = 256,
+            publish_retries: int = 2,
+            publish_dedup: bool = False,
+            codec: Union[str, Codec, None] = None,
+            metrics: Optional[Metrics] = None,
+            transport: Union[str, MemoryServer, None] = None,
+            pool_size: int = 1,
+            pool_policy: str = HASH,
+            batching: Optional[BatchSettings] = None,
+            topology: Optional[Topology] = None,
+            name: Optional[str] = None
+    ):
+        # "memory" - JetStream в памяти процесса, без сервера (тесты, профилирование)
+        # pool_size > 1 - публикации и подписки распределяются по нескольким соединениям
+        self.pool = ConnectionPool(pool_size, pool_policy, transport)
+        self.nc = self.pool.primary.nc
         self.servers = servers or ["nats://127.0.0.1:4222"]
+        self.codec = get_codec(codec)  # msgpack по умолчанию
         self.js = None  # JetStream context
         self.tasks = []  # Список для хранения фоновых задач
+        self.offloads: list[Offload] = []  # Пулы, созданные клиентом для подписок
+        self.consumers: dict[str, PullConsumer] = {}  # Циклы выборки по durable_name
+        self.partitioners: list[Partitioner] = []
+        # Объявленные стримы и консюмеры; сведения о них кэшируются после первой сверки
+        self.topology = topology or Topology()
+        self.metrics = metrics or registry  # Общий реестр метрик процесса по умолчанию
+        self.name = instance_name(name, "nats")  # Метка client: серии клиентов процесса не смешиваются
+        # Конвейер публикаций: не больше publish_window сообщений ждут PubAck.
+        # publish_dedup - Nats-Msg-Id на каждую публикацию, повтор не дублирует сообщение;
+        # сервер хранит ID в течение duplicate_window стрима
+        self.pipeline = PublishPipeline(
+            self._send,
+            window=publish_window,
+            retries=publish_retries,
+            metrics=self.metrics,
+            name=self.name,
+            dedup=publish_dedup,
+        )
+        # batching: publish_async/publish_many складывают сообщения в сжатые конверты по subject
+        self.batcher = (
+            BatchPublisher(self.pipeline, batching, self.metrics, name=self.name) if batching is not None else None
+        )
 
     async def connect(self):
-        await self.nc.connect(servers=self.servers)
-        self.js = self.nc.jetstream()
+        await self.pool.connect(self.servers)
+        self.js = self.pool.primary.js
         await logger.ainfo("Connected to NATS JetStream.")
 
     async def disconnect(self):
+        # Дожидаемся подтверждений уже отправленных публикаций
+        await self.flush()
         # Отменяем все фоновые задачи
         for task in self.tasks:
             task.cancel()
         # Ждем, пока все задачи завершатся
         await asyncio.gather(*self.tasks, return_exceptions=True)
 
-        # Закрываем соединение
-        await self.nc.close()
+        for partitioner in self.partitioners:
+            await partitioner.close()
+        self.partitioners.clear()
+
+        for offload in self.offloads:
+            offload.shutdown(wait=False)
+        self.offloads.clear()
+
+        # Закрываем соединения
+        await self.pool.close()
         await logger.ainfo("Disconnected from NATS.")
 
-    async def create_stream(self, name, subjects):
-        # Проверяем, существует ли поток, чтобы избежать ошибок
-        try:
-            await self.js.stream_info(name)
-            await logger.ainfo(f"Stream '{name}' already exists.")
-        except Exception:
-            await self.js.add_stream(name=name, subjects=subjects)
-            await logger.ainfo(f"Stream '{name}' created with subjects {subjects}.")
-
-    async def add_subscription(self, subject, durable_name, callback, delay=50):
-        # Создаем ConsumerConfig
-        consumer_config = ConsumerConfig(
-            durable_name=durable_name,
-            ack_policy=AckPolicy.EXPLICIT,
-            ack_wait=2 * delay,  # Используем timedelta
-            deliver_policy=DeliverPolicy.ALL,  # Начинаем с первого сообщения
-        )
-        # Создаем Pull-подписку
-        pull_sub = await self.js.pull_subscribe(
-            subject, durable=durable_name, config=consumer_config
-        )
+    async def create_stream(self, name, subjects, **config):
+        # Создаёт стрим или обновляет разошедшуюся конфигурацию; повторный вызов запросов не делает
+        self.topology.stream(name, subjects, **config)
+        await self.topology.ensure_stream(self.js, name)
+
+    async def reconcile(self) -> list[Change]:
+        # Сверка всей объявленной топологии параллельно, обычно перед add_subscription
+        return await self.topology.reconcile(self.js)
+
+    async def add_subscription(
+            self,
+            subject,
+            durable_name,
+            callback,
+            delay=50,
+            settings: Optional[PullSettings] = None,
+            schema: Optional[type] = None,
+            offload: Union[str, Offload, None] = None,
+            partition: Optional[PartitionSettings] = None
+    ):
+        # offload="thread"/"process" или Offload: callback - синхронная функция callback(payload),
+        # выполняется в пуле, ack/nak остаются на цикле событий
+        if offload is not None:
+            if isinstance(offload, str):
+                offload = Offload(offload)
+                self.offloads.append(offload)
+            callback = self.offloading(callback, offload, schema)
+        settings = settings or PullSettings()
+        if partition is not None:
+            # Порядок внутри ключа, параллельность между ключами - вместо нескольких подписок на один durable,
+            # которые порядок теряют. Сообщения в очередях полос не занимают слоты выборки
+            callback = Partitioner(callback, partition, self.metrics, name=durable_name)
+            self.partitioners.append(callback)
+        if offload is None or partition is not None:
+            # Ключ полосы и коллбек получают один PayloadMsg: payload декодируется кодеком клиента один раз
+            callback = self.decoding(callback, schema)
+        if settings.ack_wait is None:
+            settings = dataclasses.replace(settings, ack_wait=2 * delay)
+        # Накопленные подтверждения одним ack закрывают все сообщения до него
+        ack_policy = AckPolicy.ALL if settings.acks is not None and settings.acks.cumulative else AckPolicy.EXPLICIT
+        # fetch и ack консюмера идут через одно соединение пула
+        js = self.pool.pick(durable_name).js
+        stream = self.topology.stream_for(subject)
+        if stream is None:
+            # Стрим не объявлен через create_stream/topology: консюмер ищет и создаёт nats-py
+            consumer_config = ConsumerConfig(
+                durable_name=durable_name,
+                ack_policy=ack_policy,
+                ack_wait=settings.ack_wait,  # В секундах
+                deliver_policy=DeliverPolicy.ALL,  # Начинаем с первого сообщения
+                # Только если задан: иначе лимит сервера, общий для всех процессов этого durable
+                max_ack_pending=settings.ack_pending_limit,
+            )
+            pull_sub = await js.pull_subscribe(subject, durable=durable_name, config=consumer_config)
+            if ack_policy == AckPolicy.ALL:
+                info = await pull_sub.consumer_info()
+                settings = await self._ack_fallback(settings, info.config.ack_policy, durable_name)
+        else:
+            if (stream, durable_name) not in self.topology.consumers:
+                # Явно объявленный в топологии консюмер имеет приоритет над аргументами
+                self.topology.consumer(
+                    stream,
+                    durable_name,
+                    filter_subject=subject,
+                    ack_policy=ack_policy,
+                    ack_wait=settings.ack_wait,
+                    deliver_policy=DeliverPolicy.ALL,
+                    max_ack_pending=settings.ack_pending_limit,
+                )
+            # ack_policy существующего durable сервер не меняет: Topology оставляет серверное значение,
+            # а _ack_fallback по consumer_info переходит на подтверждения по одному
+            info = await self.topology.ensure_consumer(self.js, stream, durable_name)
+            if ack_policy == AckPolicy.ALL:
+                settings = await self._ack_fallback(settings, info.config.ack_policy, durable_name)
+            pull_sub = await js.pull_subscribe_bind(durable=durable_name, stream=stream)
+        # Консюмер регистрируется сразу: pause/resume доступны, как только add_subscription вернулся
+        consumer = self.pull_consumer(pull_sub, callback, settings, name=durable_name)
         # Запускаем задачу для обработки сообщений
-        task = asyncio.create_task(
-            self.process_messages(pull_sub, callback)
-        )
+        task = asyncio.create_task(consumer.run())
         self.tasks.append(task)
+        return consumer
+
+    @staticmethod
+    async def _ack_fallback(settings: PullSettings, actual: Optional[AckPolicy], durable_name) -> PullSettings:
+        # ack_policy существующего консюмера не меняется; кумулятивный ack на EXPLICIT-консюмере
+        # подтвердил бы одно сообщение из пачки
+        if actual == AckPolicy.ALL:
+            return settings
+        await logger.awarning("Consumer is not AckPolicy.ALL, acks are sent one by one",
+                              consumer=durable_name, ack_policy=actual)
+        return dataclasses.replace(settings, acks=dataclasses.replace(settings.acks, cumulative=False))
+
+    async def pause(self, durable_name, reason: str = "manual", duration: Optional[float] = None):
+        # Выборка останавливается, начатые коллбеки завершаются; сообщения ждут на сервере
+        await self.consumers[durable_name].pause(reason, duration)
+
+    async def resume(self, durable_name):
+        await self.consumers[durable_name].resume()
+
+    def decoding(self, callback, schema: Optional[type] = None):
+        # Коллбек получает PayloadMsg: msg.payload декодируется только при обращении
+        codec = self.codec
+
+        async def wrapper(msg):
+            await callback(PayloadMsg(msg, codec, schema))
+
+        return wrapper
 
-    async def process_messages(self, pull_sub, callback):
-        try:
-            while True:
-                try:
-                    # Запрашиваем одно сообщение
-                    msgs = await pull_sub.fetch(1, timeout=5)
-                    for msg in msgs:
-                        await callback(msg)  # Передаем msg в коллбек
-                except NATSTimeoutError:
-                    # Нет новых сообщений, продолжаем цикл
-                    await asyncio.sleep(1)
-        except asyncio.CancelledError:
-            # Задача была отменена, выходим из цикла
-            pass
-        finally:
-            await pull_sub.unsubscribe()
+    def offloading(self, callback, offload: Offload, schema: Optional[type] = None):
+        # Ошибка в пуле поднимается здесь, и PullConsumer отправляет nak
+        # Кодек передаётся в пул сам, а не по имени: пользовательский Codec тоже работает
+        codec = self.codec
+        offload.check(callback, codec)
+
+        async def wrapper(msg):
+            await offload.call(callback, codec, schema, msg.data)
+            await msg.ack()
+
+        return wrapper
+
+    def pull_consumer(self, pull_sub, callback, settings: Optional[PullSettings] = None, name: str = "") -> PullConsumer:
+        # Батчевый fetch, пул коллбеков и адаптивный long-poll вместо sleep(1).
+        # Конверты BatchPublisher разбираются, коллбек получает сообщения по одному
+        label = instance_name(name, "pull")
+        callback = Unpacker(callback, metrics=self.metrics, name=label)
+        consumer = PullConsumer(pull_sub, callback, settings, metrics=self.metrics, name=label)
+        if name:
+            self.consumers[name] = consumer
+        return consumer
+
+    async def process_messages(self, pull_sub, callback, settings: Optional[PullSettings] = None, name: str = ""):
+        await self.pull_consumer(pull_sub, callback, settings, name).run()
+
+    async def _send(self, subject, data, **kwargs):
+        return await self.pool.publish(subject, data, **kwargs)
 
     async def publish(self, subject, message):
         await logger.adebug("Send message", message=message, subject=subject)
-        data = ormsgpack.packb(message)
-        await self.js.publish(subject, data)
+        data = self.codec.encode(message)
+        started = time.perf_counter()
+        ack = await self.pool.publish(subject, data)
+        self.pipeline.ack_latency.record(time.perf_counter() - started)
+        return ack
+
+    async def publish_async(self, subject, message) -> asyncio.Future:
+        # Возвращает задачу с PublishResult, не дожидаясь PubAck;
+        # с batching - PublishResult конверта, в который попало сообщение
+        if self.batcher is not None:
+            return await self.batcher.add(subject, self.codec.encode(message))
+        return await self.pipeline.submit(subject, self.codec.encode(message))
+
+    async def publish_many(self, subject, messages) -> list[PublishResult]:
+        if self.batcher is not None:
+            futures = [await self.batcher.add(subject, self.codec.encode(message)) for message in messages]
+            results = list(await asyncio.gather(*futures))
+        else:
+            results = await self.pipeline.publish_many(subject, map(self.codec.encode, messages))
+        failed = sum(not result.ok for result in results)
+        await logger.adebug("Send messages", subject=subject, count=len(results), failed=failed)
+        return results
+
+    async def flush(self) -> list[PublishResult]:
+        if self.batcher is not None:
+            return await self.batcher.flush()
+        return await self.pipeline.flush()
 
 
 async def main():
@@ -92,13 +269,10 @@ async def main():
     # Создаем поток (Stream) с нужным subject
     await nats_client.create_stream(name="TestStream", subjects=["TestSubject"])
 
-    # Список для хранения временных меток обработки сообщений
-    timestamps = []
-
     # Пример функции коллбека с записью времени
     async def example_callback(msg, x: int):
         await asyncio.sleep(5)
-        data = ormsgpack.unpackb(msg.data)
+        data = msg.payload
         print(f"Received message: {data} x={x}")
         # Проверяем успешность обработки
 
@@ -106,31 +280,29 @@ async def main():
 
     x = 5
 
-    # Добавляем подписку с задержкой в 5 секунд
-    await nats_client.add_subscription(
-        subject="TestSubject",
-        durable_name="TestSubjectConsumer",
-        callback=partial(example_callback, x=x),
-    )
+    # Добавляем подписку с задержкой в 5 секунд; сообщения с одним "text" обрабатываются по порядку,
+    # с разными - параллельно
     await nats_client.add_subscription(
         subject="TestSubject",
         durable_name="TestSubjectConsumer",
         callback=partial(example_callback, x=x),
+        partition=PartitionSettings(by_field("text"), lanes=4),
     )
 
-    # Публикуем несколько сообщений
-    for i in range(10):
-        await nats_client.publish("TestSubject", {"text": f"Hello World {i + 1}!", "result": True if 1 == 2 else False})
+    # Публикуем несколько сообщений конвейером, не дожидаясь каждого PubAck
+    await nats_client.publish_many(
+        "TestSubject",
+        ({"text": f"Hello World {i + 1}!", "result": True if 1 == 2 else False} for i in range(10)),
+    )
 
     # Ждем завершения обработки всех сообщений
     await asyncio.sleep(100)  # Даем время на обработку всех сообщений
 
     await nats_client.disconnect()
 
-    # Выводим временные метки
-    print("\nTimestamps of message processing:")
-    for timestamp in timestamps:
-        print(timestamp.strftime('%H:%M:%S'))
+    # Выводим задержки публикации и обработки сообщений
+    for name, value in nats_client.metrics.snapshot().items():
+        print(name, value)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import importlib
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from src.main.new_app.serialization import Codec
+
+THREAD = "thread"
+PROCESS = "process"
+
+# Исходные функции под offloaded по (модуль, qualname). Атрибут модуля - уже не она:
+# поверх стоят обёртка offloaded и декоратор подписчика FastStream (HandlerCallWrapper),
+# которые не сериализуются. Процесс-исполнитель импортирует модуль, декораторы
+# выполняются заново и заполняют реестр в нём
+_offloaded: dict[tuple[str, str], Callable] = {}
+
+
+def _invoke(fn: Callable, codec: Codec, schema: Optional[type], data) -> Any:
+    # Выполняется в пуле: декодирование тоже уходит с цикла событий
+    return fn(codec.decode(data, schema))
+
+
+def _invoke_by_name(module: str, qualname: str, args: tuple, kwargs: dict) -> Any:
+    fn = _offloaded.get((module, qualname))
+    if fn is None:
+        importlib.import_module(module)
+        fn = _offloaded[(module, qualname)]
+    return fn(*args, **kwargs)
+
+
+class Offload:
+    """
+    Runs CPU-bound handlers in a thread or process pool.
+    At most `max_pending` calls are queued or running; callers above that wait
+    on the loop, which stops the consumer from fetching more messages.
+    Threads get the message as a memoryview (no copy) and help when the handler
+    releases the GIL; processes get one pickled copy of the bytes.
+    """
+
+    def __init__(self, mode: str = THREAD, workers: Optional[int] = None, max_pending: Optional[int] = None):
+        if mode not in (THREAD, PROCESS):
+            raise ValueError(f"Unknown offload mode: {mode}")
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        self.slots = asyncio.Semaphore(self.max_pending)
+        self.executor: Optional[Executor] = None
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.mode} workers:{self.workers} pending:{self.pending}/{self.max_pending}>"
+
+    @property
+    def pending(self) -> int:
+        return self.max_pending - self.slots._value
+
+    def _executor(self) -> Executor:
+        # Пул создаётся при первом вызове, в процессе, где он будет использоваться
+        if self.executor is None:
+            if self.mode == THREAD:
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="offload")
+            else:
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self.executor
+
+    def check(self, *objects: Any):
+        # Для пула процессов функция и кодек должны сериализоваться (функция - импортироваться по имени)
+        if self.mode == PROCESS:
+            for obj in objects:
+                try:
+                    pickle.dumps(obj)
+                except Exception as e:
+                    raise TypeError(f"{obj!r} cannot be sent to a process pool: {e}") from None
+
+    async def run(self, fn: Callable, *args: Any) -> Any:
+        async with self.slots:
+            return await asyncio.get_running_loop().run_in_executor(self._executor(), fn, *args)
+
+    async def call(self, fn: Callable, codec: Codec, schema: Optional[type], data: bytes) -> Any:
+        """Decodes `data` with the codec and calls `fn(payload)` in the pool."""
+        if self.mode == THREAD:
+            data = memoryview(data)
+        return await self.run(_invoke, fn, codec, schema, data)
+
+    def shutdown(self, wait: bool = True):
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=not wait)
+            self.executor = None
+
+
+def offloaded(offload: Offload):
+    """
+    Turns a synchronous FastStream handler into an async one that runs in `offload`.
+    Arguments are resolved (decoded, injected) on the loop; only the body runs in the pool:
+
+        @router.subscriber("heavy", queue="workers")
+        @offloaded(Offload(PROCESS, workers=4))
+        def handle(data: bytes) -> None:
+            ...
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        process = offload.mode == PROCESS
+        if process:
+            if "<locals>" in fn.__qualname__:
+                raise TypeError(f"{fn!r} cannot be sent to a process pool: define it at module level")
+            _offloaded[(fn.__module__, fn.__qualname__)] = fn
+
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if process:
+                # Передаём имя: исполнитель найдёт fn в реестре после импорта модуля
+                return await offload.run(_invoke_by_name, fn.__module__, fn.__qualname__, args, kwargs)
+            return await offload.run(functools.partial(fn, *args, **kwargs))
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,251 @@
+import asyncio
+import collections
+import dataclasses
+import heapq
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+import structlog
+
+from src.main.new_app.flow import current_lease
+from src.main.new_app.metrics import Metrics, instance_name
+
+logger: structlog.BoundLogger = structlog.getLogger("NATSClient")
+
+KeyFunc = Callable[[Any], Hashable]
+
+
+def by_token(index: int) -> KeyFunc:
+    """Key is a token of the subject: by_token(1) for "orders.<id>.created"."""
+    def key(msg) -> Optional[str]:
+        tokens = msg.subject.split(".")
+        return tokens[index] if -len(tokens) <= index < len(tokens) else None
+
+    return key
+
+
+def by_header(name: str) -> KeyFunc:
+    def key(msg) -> Optional[str]:
+        return (msg.headers or {}).get(name)
+
+    return key
+
+
+def by_field(path: str) -> KeyFunc:
+    """
+    Key is a field of the decoded payload; "a.b" looks into nested mappings or attributes.
+    Reads msg.payload of the PayloadMsg that NATSClient passes in, so the payload is
+    decoded once, with the client codec and schema, and the callback reuses it.
+    """
+    parts = path.split(".")
+
+    def key(msg) -> Any:
+        value = msg.payload
+        for part in parts:
+            value = value.get(part) if isinstance(value, dict) else getattr(value, part, None)
+            if value is None:
+                return None
+        return value
+
+    return key
+
+
+@dataclasses.dataclass(slots=True)
+class PartitionSettings:
+    key: KeyFunc  # msg -> ключ; сообщения без ключа (None) идут в одну полосу
+    lanes: int = 8  # Сколько ключей обрабатываются параллельно
+    queue_size: int = 16  # Сообщений в очереди полосы; при переполнении выборка ждёт
+    hot_keys: int = 5  # Сколько самых частых ключей экспортировать в метрики
+    track_keys: int = 10_000  # Потолок учёта ключей, реже встречающиеся забываются
+
+    def __post_init__(self):
+        if self.lanes < 1:
+            raise ValueError("lanes must be >= 1")
+        if self.queue_size < 1:
+            raise ValueError("queue_size must be >= 1")
+
+
+class _Lane:
+    """
+    Bounded FIFO queue whose producers get in strictly in arrival order.
+    asyncio.Queue wakes a blocked put() but lets a new put() take the freed slot
+    first, which would reorder messages of one key.
+    """
+
+    __slots__ = ("size", "items", "putters", "getter")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.items: collections.deque = collections.deque()
+        self.putters: collections.deque[asyncio.Future] = collections.deque()
+        self.getter: Optional[asyncio.Future] = None
+
+    def qsize(self) -> int:
+        return len(self.items)
+
+    async def put(self, item):
+        if self.putters or len(self.items) >= self.size:
+            putter = asyncio.get_running_loop().create_future()
+            self.putters.append(putter)
+            try:
+                await putter
+            except asyncio.CancelledError:
+                self.putters.remove(putter)
+                self._wake_putter()
+                raise
+            # Разбуженный остаётся первым в очереди, пока не положит элемент
+            self.putters.popleft()
+        self.items.append(item)
+        if self.getter is not None and not self.getter.done():
+            self.getter.set_result(None)
+        self._wake_putter()
+
+    async def get(self):
+        while not self.items:
+            self.getter = asyncio.get_running_loop().create_future()
+            await self.getter
+        item = self.items.popleft()
+        self._wake_putter()
+        return item
+
+    def _wake_putter(self):
+        if self.putters and len(self.items) < self.size and not self.putters[0].done():
+            self.putters[0].set_result(None)
+
+    def drain(self) -> list:
+        items = list(self.items)
+        self.items.clear()
+        return items
+
+
+class Partitioner:
+    """
+    Message callback wrapper that routes messages by key to `lanes` sequential workers.
+    Messages with the same key are processed one by one in the order they were
+    received; different keys run in parallel. The wrapper returns when the callback
+    has finished with the message, so ack/nak and flow control stay in PullConsumer.
+    A message parked in its lane gives its PullConsumer slot back, so a hot key
+    holds at most queue_size queued messages plus the ones blocked on its full lane.
+    A nak'ed message is redelivered after the ones that followed it, as without
+    partitioning; the order holds within one process consuming the durable.
+    """
+
+    def __init__(
+            self,
+            callback: Callable[[Any], Awaitable[None]],
+            settings: PartitionSettings,
+            metrics: Optional[Metrics] = None,
+            name: str = ""
+    ):
+        self.callback = callback
+        self.settings = settings
+        self.name = instance_name(name, "partition")
+        self.queues: list[_Lane] = []
+        self.workers: list[asyncio.Task] = []
+        self.processed = [0] * settings.lanes
+        self.keys: dict[Hashable, int] = {}  # Сообщений по ключу
+        self.metrics = metrics
+        if metrics is not None:
+            self.wait_time = metrics.histogram(
+                "nats_partition_wait_seconds", "Time a message waits in its lane", consumer=self.name
+            )
+            metrics.collector(self._collect)
+
+    def __repr__(self):
+        depth = sum(queue.qsize() for queue in self.queues)
+        return f"<{self.__class__.__name__} {self.name} lanes:{self.settings.lanes} queued:{depth}>"
+
+    def lane(self, key: Hashable) -> int:
+        # crc32, а не hash(): распределение одинаково между перезапусками, как у пула соединений
+        if key is None:
+            return 0
+        if not isinstance(key, bytes):
+            key = str(key).encode()
+        return zlib.crc32(key) % self.settings.lanes
+
+    async def __call__(self, msg):
+        if not self.workers:
+            self._start()
+        key = self.settings.key(msg)
+        self._count(key)
+        lane = self.lane(key)
+        done = asyncio.get_running_loop().create_future()
+        lease = current_lease.get()
+        # Полосы FIFO и при переполнении пропускают по порядку: очерёдность сообщений ключа сохраняется
+        await self.queues[lane].put((msg, done, time.perf_counter(), lease))
+        if lease is not None:
+            # Сообщение в очереди полосы: слот PullConsumer освобождается, чтобы горячий ключ
+            # не занял их все и выборка продолжалась для других полос. Очереди ограничены queue_size
+            lease.release()
+        await done
+
+    def _start(self):
+        self.queues = [_Lane(self.settings.queue_size) for _ in range(self.settings.lanes)]
+        self.workers = [asyncio.create_task(self._work(lane)) for lane in range(self.settings.lanes)]
+
+    async def _work(self, lane: int):
+        queue = self.queues[lane]
+        while True:
+            msg, done, queued, lease = await queue.get()
+            if done.cancelled():
+                # Обработка сообщения отменена вместе с циклом выборки
+                continue
+            waited = time.perf_counter() - queued
+            if lease is not None:
+                # Адаптивный лимит считает задержку без ожидания в полосе
+                lease.waited += waited
+            if self.metrics is not None:
+                self.wait_time.record(waited)
+            try:
+                await self.callback(msg)
+            except asyncio.CancelledError:
+                done.cancel()
+                raise
+            except Exception as e:
+                if not done.done():
+                    done.set_exception(e)
+            else:
+                if not done.done():
+                    done.set_result(None)
+            self.processed[lane] += 1
+
+    def _count(self, key: Hashable):
+        keys = self.keys
+        keys[key] = keys.get(key, 0) + 1
+        if len(keys) > self.settings.track_keys:
+            # Оставляем половину самых частых, счётчики остальных теряются
+            keep = heapq.nlargest(self.settings.track_keys // 2, keys.items(), key=lambda item: item[1])
+            self.keys = dict(keep)
+
+    def hot_keys(self, top: Optional[int] = None) -> list[tuple[Hashable, int]]:
+        """Most frequent keys with their message counts."""
+        return heapq.nlargest(top or self.settings.hot_keys, self.keys.items(), key=lambda item: item[1])
+
+    def lane_stats(self) -> list[dict]:
+        return [
+            {"lane": lane, "queued": queue.qsize(), "processed": self.processed[lane]}
+            for lane, queue in enumerate(self.queues)
+        ]
+
+    def _collect(self):
+        result = []
+        for stats in self.lane_stats():
+            labels = {"consumer": self.name, "lane": str(stats["lane"])}
+            result.append(("nats_partition_lane_queued", labels, stats["queued"]))
+            result.append(("nats_partition_lane_processed", labels, stats["processed"]))
+        for key, count in self.hot_keys():
+            result.append(("nats_partition_hot_key_messages", {"consumer": self.name, "key": str(key)}, count))
+        return result
+
+    async def close(self):
+        if self.metrics is not None:
+            self.metrics.remove_collector(self._collect)
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        for queue in self.queues:
+            # Ожидающие вызовы не должны висеть после остановки
+            for _, done, _, _ in queue.drain():
+                done.cancel()
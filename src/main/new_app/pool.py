@@ -0,0 +1,104 @@
+import asyncio
+import zlib
+from typing import Any, Union
+
+import structlog
+from nats.js.api import PubAck
+
+from src.main.new_app.memory import MemoryServer, create_client
+
+logger: structlog.BoundLogger = structlog.getLogger("NATSClient")
+
+# Политики выбора соединения
+HASH = "hash"  # Один subject/ключ всегда идёт через одно соединение: порядок публикаций сохраняется
+LEAST_LOADED = "least_loaded"  # Соединение с наименьшим числом запросов в полёте
+
+
+class _Member:
+    __slots__ = ("index", "nc", "js", "in_flight", "connected", "reconnects")
+
+    def __init__(self, index: int, nc):
+        self.index = index
+        self.nc = nc
+        self.js = None
+        self.in_flight = 0
+        self.connected = False
+        self.reconnects = 0
+
+    def __repr__(self):
+        state = "up" if self.connected else "down"
+        return f"<member {self.index} {state} in_flight:{self.in_flight} reconnects:{self.reconnects}>"
+
+
+class ConnectionPool:
+    """
+    N connections to the same servers, each with its own socket and read/flush loop.
+    Members reconnect independently; while a member is down, its share of
+    subjects is routed to the next connected member.
+    """
+
+    def __init__(self, size: int = 1, policy: str = HASH, transport: Union[str, MemoryServer, None] = None):
+        if size < 1:
+            raise ValueError("size must be >= 1")
+        if policy not in (HASH, LEAST_LOADED):
+            raise ValueError(f"Unknown pool policy: {policy}")
+        self.policy = policy
+        self.members = [_Member(i, create_client(transport)) for i in range(size)]
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    @property
+    def primary(self) -> _Member:
+        # Первое соединение: служебные запросы (стримы, бакеты, наблюдения)
+        return self.members[0]
+
+    async def connect(self, servers: list[str], **options: Any):
+        await asyncio.gather(*(self._connect(member, servers, options) for member in self.members))
+
+    async def _connect(self, member: _Member, servers: list[str], options: dict):
+        async def disconnected():
+            member.connected = False
+            await logger.awarning("Pool member disconnected", member=member.index)
+
+        async def reconnected():
+            member.connected = True
+            member.reconnects += 1
+            await logger.ainfo("Pool member reconnected", member=member.index, reconnects=member.reconnects)
+
+        if len(self.members) > 1:
+            options = {"disconnected_cb": disconnected, "reconnected_cb": reconnected, **options}
+        await member.nc.connect(servers=servers, **options)
+        member.js = member.nc.jetstream()
+        member.connected = True
+
+    def pick(self, key: str) -> _Member:
+        members = self.members
+        if len(members) == 1:
+            return members[0]
+        if self.policy == LEAST_LOADED:
+            live = [member for member in members if member.connected] or members
+            return min(live, key=lambda member: member.in_flight)
+        start = zlib.crc32(key.encode()) % len(members)
+        for i in range(len(members)):
+            member = members[(start + i) % len(members)]
+            if member.connected:
+                return member
+        return members[start]
+
+    async def publish(self, subject: str, payload: bytes = b"", **kwargs: Any) -> PubAck:
+        member = self.pick(subject)
+        member.in_flight += 1
+        try:
+            return await member.js.publish(subject, payload, **kwargs)
+        finally:
+            member.in_flight -= 1
+
+    async def flush(self, timeout: float = 10):
+        # Общий flush: ждём отправки буферов всех соединений параллельно
+        await asyncio.gather(*(m.nc.flush(timeout) for m in self.members if m.connected))
+
+    async def close(self):
+        await asyncio.gather(*(m.nc.close() for m in self.members), return_exceptions=True)
+        for member in self.members:
+            member.connected = False
@@ -0,0 +1,132 @@
+import asyncio
+import dataclasses
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+import structlog
+from nats.errors import TimeoutError as NATSTimeoutError
+from nats.js.api import Header, PubAck
+from nats.js.errors import NoStreamResponseError, ServiceUnavailableError
+
+from src.main.new_app.metrics import Metrics
+
+logger: structlog.BoundLogger = structlog.getLogger("NATSClient")
+
+# Ошибки, после которых публикацию имеет смысл повторить
+RETRYABLE_ERRORS = (NATSTimeoutError, NoStreamResponseError, ServiceUnavailableError)
+
+Sender = Callable[..., Awaitable[PubAck]]
+
+
+@dataclasses.dataclass(slots=True)
+class PublishResult:
+    subject: str
+    ack: Optional[PubAck] = None
+    error: Optional[BaseException] = None
+    attempts: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class PublishPipeline:
+    """
+    Windowed JetStream publisher: up to `window` messages wait for a PubAck at once.
+    With `dedup` every publish carries a Nats-Msg-Id, so a retry after a lost PubAck
+    is dropped by the server. The server keeps every ID for the stream's
+    duplicate_window (2 minutes by default), which costs memory at high rates.
+    Without it a retried publish may be stored twice.
+    """
+
+    def __init__(
+            self,
+            send: Sender,
+            window: int = 256,
+            retries: int = 2,
+            retry_backoff: float = 0.1,
+            metrics: Optional[Metrics] = None,
+            name: str = "",
+            dedup: bool = False
+    ):
+        if window < 1:
+            raise ValueError("window must be >= 1")
+        self.send = send
+        self.window = window
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.dedup = dedup
+        self.slots = asyncio.Semaphore(window)
+        self.pending: set[asyncio.Task] = set()
+        self.metrics = metrics
+        if metrics is not None:
+            self.ack_latency = metrics.histogram(
+                "nats_publish_ack_seconds", "Publish to PubAck latency", client=name
+            )
+            self.retried = metrics.counter(
+                "nats_publish_retries_total", "Publish attempts after a failure", client=name
+            )
+            self.failed = metrics.counter(
+                "nats_publish_errors_total", "Publishes that failed after retries", client=name
+            )
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.pending)
+
+    async def submit(self, subject: str, payload: bytes, **kwargs: Any) -> asyncio.Task:
+        # Ждём свободное место в окне, но не ждём PubAck
+        await self.slots.acquire()
+        task = asyncio.create_task(self._publish(subject, payload, kwargs))
+        self.pending.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    async def publish_many(self, subject: str, payloads: Iterable[bytes], **kwargs: Any) -> list[PublishResult]:
+        tasks = [await self.submit(subject, payload, **kwargs) for payload in payloads]
+        return list(await asyncio.gather(*tasks))
+
+    async def flush(self) -> list[PublishResult]:
+        # Дожидаемся всех PubAck, отправленных к этому моменту
+        if not self.pending:
+            return []
+        return list(await asyncio.gather(*self.pending))
+
+    def _done(self, task: asyncio.Task):
+        self.pending.discard(task)
+        self.slots.release()
+
+    async def _publish(self, subject: str, payload: bytes, kwargs: dict) -> PublishResult:
+        result = PublishResult(subject=subject)
+        if self.dedup:
+            # Публикация с таймаутом могла сохраниться: повтор с тем же Nats-Msg-Id
+            # сервер отбросит как дубликат в пределах duplicate_window
+            headers = dict(kwargs.get("headers") or {})
+            headers.setdefault(Header.MSG_ID.value, uuid.uuid4().hex)
+            kwargs = {**kwargs, "headers": headers}
+        while True:
+            result.attempts += 1
+            started = time.perf_counter()
+            try:
+                result.ack = await self.send(subject, payload, **kwargs)
+                result.error = None
+                if self.metrics is not None:
+                    self.ack_latency.record(time.perf_counter() - started)
+                return result
+            except RETRYABLE_ERRORS as e:
+                result.error = e
+                if result.attempts > self.retries:
+                    break
+                if self.metrics is not None:
+                    self.retried.inc()
+                await asyncio.sleep(self.retry_backoff * result.attempts)
+            except Exception as e:
+                result.error = e
+                break
+        if self.metrics is not None:
+            self.failed.inc()
+        await logger.awarning(
+            "Publish failed", subject=subject, attempts=result.attempts, error=repr(result.error)
+        )
+        return result
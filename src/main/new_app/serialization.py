@@ -0,0 +1,150 @@
+import abc
+import dataclasses
+from typing import Any, Optional, Union
+
+import ormsgpack
+
+# Данные из NATS передаём в декодер как memoryview, без копирования
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+def build(schema: Optional[type], data: Any) -> Any:
+    # Типизированное декодирование: pydantic-модель, dataclass или любой вызываемый тип
+    if schema is None:
+        return data
+    validate = getattr(schema, "model_validate", None)
+    if validate is not None:
+        return validate(data)
+    if dataclasses.is_dataclass(schema) and isinstance(data, dict):
+        return schema(**data)
+    return schema(data)
+
+
+class Codec(abc.ABC):
+    name: str = ""
+
+    @abc.abstractmethod
+    def encode(self, obj: Any) -> bytes:
+        ...
+
+    @abc.abstractmethod
+    def decode(self, data: Buffer, schema: Optional[type] = None) -> Any:
+        ...
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.name}>"
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+
+    def __init__(self, option: int = ormsgpack.OPT_SERIALIZE_PYDANTIC | ormsgpack.OPT_NON_STR_KEYS):
+        # dataclass'ы и pydantic-модели ormsgpack сериализует сам, без промежуточного dict
+        self.option = option
+
+    def encode(self, obj: Any) -> bytes:
+        return ormsgpack.packb(obj, option=self.option)
+
+    def decode(self, data: Buffer, schema: Optional[type] = None) -> Any:
+        return build(schema, ormsgpack.unpackb(data))
+
+
+class JsonCodec(Codec):
+    name = "json"
+
+    def __init__(self):
+        # orjson нужен только тем, кто выбрал JSON
+        import orjson
+
+        self.orjson = orjson
+
+    @staticmethod
+    def _default(obj: Any) -> Any:
+        dump = getattr(obj, "model_dump", None)
+        if dump is not None:
+            return dump()
+        raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+    def encode(self, obj: Any) -> bytes:
+        return self.orjson.dumps(obj, default=self._default)
+
+    def decode(self, data: Buffer, schema: Optional[type] = None) -> Any:
+        return build(schema, self.orjson.loads(data))
+
+
+class RawCodec(Codec):
+    name = "raw"
+
+    def encode(self, obj: Any) -> bytes:
+        if isinstance(obj, (bytes, bytearray, memoryview)):
+            return obj
+        if isinstance(obj, str):
+            return obj.encode()
+        raise TypeError(f"RawCodec expects bytes-like payload, got {type(obj).__name__}")
+
+    def decode(self, data: Buffer, schema: Optional[type] = None) -> Any:
+        return build(schema, data)
+
+
+CODECS: dict[str, type[Codec]] = {
+    MsgpackCodec.name: MsgpackCodec,
+    JsonCodec.name: JsonCodec,
+    RawCodec.name: RawCodec,
+}
+_instances: dict[str, Codec] = {}
+
+
+def get_codec(codec: Union[str, Codec, None] = None) -> Codec:
+    if isinstance(codec, Codec):
+        return codec
+    name = codec or MsgpackCodec.name
+    if name not in _instances:
+        try:
+            _instances[name] = CODECS[name]()
+        except KeyError:
+            raise ValueError(f"Unknown codec {name!r}, expected one of {sorted(CODECS)}") from None
+    return _instances[name]
+
+
+class LazyPayload:
+    """Raw message bytes that are decoded on first access and then cached."""
+
+    __slots__ = ("raw", "codec", "schema", "_value", "_decoded")
+
+    def __init__(self, data: Buffer, codec: Codec, schema: Optional[type] = None):
+        self.raw = memoryview(data)
+        self.codec = codec
+        self.schema = schema
+        self._value = None
+        self._decoded = False
+
+    @property
+    def value(self) -> Any:
+        if not self._decoded:
+            self._value = self.codec.decode(self.raw, self.schema)
+            self._decoded = True
+        return self._value
+
+    def as_(self, schema: type) -> Any:
+        return self.codec.decode(self.raw, schema)
+
+
+class PayloadMsg:
+    """Msg proxy with a lazily decoded `payload`; everything else goes to the wrapped Msg."""
+
+    __slots__ = ("msg", "_payload")
+
+    def __init__(self, msg, codec: Codec, schema: Optional[type] = None):
+        self.msg = msg
+        self._payload = LazyPayload(msg.data, codec, schema)
+
+    @property
+    def payload(self) -> Any:
+        return self._payload.value
+
+    @property
+    def raw(self) -> memoryview:
+        return self._payload.raw
+
+    def __getattr__(self, item):
+        return getattr(self.msg, item)
@@ -0,0 +1,156 @@
+import asyncio
+import dataclasses
+from typing import Any, AsyncIterator, Iterable, Optional
+
+from src.main.new_app.kv_cache import MISSING
+from src.main.new_app.kv_watch import KVEvent, subject_matches
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class StateUpdate:
+    key: str
+    value: Any  # None для удалённого ключа
+    version: int  # Версия хранилища на момент изменения
+    revision: Optional[int] = None  # Ревизия KV, если изменение пришло из бакета
+    deleted: bool = False
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class Snapshot:
+    version: int
+    values: dict[str, Any]
+
+    def __getitem__(self, key: str) -> Any:
+        return self.values[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.values.get(key, default)
+
+
+class _Subscriber:
+    # Подписчик видит последнее значение каждого изменённого ключа, а не каждую запись:
+    # медленный читатель не копит очередь
+    __slots__ = ("keys", "dirty", "waiter")
+
+    def __init__(self, keys: Optional[str]):
+        self.keys = keys
+        self.dirty: dict[str, None] = {}
+        self.waiter: Optional[asyncio.Future] = None
+
+    def mark(self, key: str):
+        if self.keys is None or subject_matches(self.keys, key):
+            self.dirty[key] = None
+            if self.waiter is not None and not self.waiter.done():
+                self.waiter.set_result(None)
+
+
+class StateStore:
+    """
+    Versioned in-process state with change notifications.
+    Every change bumps the store version; readers wait for a key to change
+    (`changed`), iterate updates (`updates`) or take a consistent `snapshot`.
+    Fed by KV watches through `apply` or written directly with `set`/`delete`.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.items: dict[str, StateUpdate] = {}
+        self.waiters: dict[str, list[asyncio.Future]] = {}
+        self.subscribers: set[_Subscriber] = set()
+
+    def __len__(self) -> int:
+        return sum(not item.deleted for item in self.items.values())
+
+    def __contains__(self, key: str) -> bool:
+        item = self.items.get(key)
+        return item is not None and not item.deleted
+
+    def get(self, key: str, default: Any = None) -> Any:
+        item = self.items.get(key)
+        return default if item is None or item.deleted else item.value
+
+    def version_of(self, key: str) -> int:
+        item = self.items.get(key)
+        return item.version if item is not None else 0
+
+    def set(self, key: str, value: Any, revision: Optional[int] = None) -> int:
+        return self._update(key, value, revision, deleted=False)
+
+    def delete(self, key: str, revision: Optional[int] = None) -> int:
+        return self._update(key, None, revision, deleted=True)
+
+    def _update(self, key: str, value: Any, revision: Optional[int], deleted: bool) -> int:
+        current = self.items.get(key)
+        if revision is not None and current is not None and current.revision is not None:
+            if revision <= current.revision:
+                # Повторная или запоздавшая доставка из бакета
+                return current.version
+        self.version += 1
+        self.items[key] = StateUpdate(key, value, self.version, revision, deleted)
+        for waiter in self.waiters.pop(key, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+        for subscriber in self.subscribers:
+            subscriber.mark(key)
+        return self.version
+
+    async def apply(self, event: KVEvent):
+        # Коллбек для NATSKeyValueClient.watch_bucket / WatchManager.watch
+        if event.deleted:
+            self.delete(event.key, event.revision)
+        else:
+            self.set(event.key, event.value, event.revision)
+
+    async def follow(self, kv_client, bucket: str, keys: str = ">"):
+        """Keeps the store in sync with a KV bucket; returns the Watch."""
+        return await kv_client.watch_bucket(bucket, self.apply, keys=keys)
+
+    async def changed(self, key: str, since_version: int = 0, timeout: Optional[float] = None) -> StateUpdate:
+        """Returns as soon as `key` has a version above `since_version`."""
+        item = self.items.get(key)
+        while item is None or item.version <= since_version:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.setdefault(key, []).append(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            finally:
+                # Таймаут или отмена ожидающего: сработавший waiter уже снят в _update
+                waiters = self.waiters.get(key)
+                if waiters and waiter in waiters:
+                    waiters.remove(waiter)
+                    if not waiters:
+                        del self.waiters[key]
+            item = self.items.get(key)
+        return item
+
+    def snapshot(self, keys: Optional[Iterable[str]] = None) -> Snapshot:
+        # Цикл событий однопоточный: копия делается между изменениями и согласована
+        if keys is None:
+            values = {key: item.value for key, item in self.items.items() if not item.deleted}
+        else:
+            values = {key: self.get(key, MISSING) for key in keys}
+            values = {key: value for key, value in values.items() if value is not MISSING}
+        return Snapshot(self.version, values)
+
+    async def updates(self, keys: Optional[str] = None, since_version: int = 0) -> AsyncIterator[StateUpdate]:
+        """
+        Yields changes of keys matching the `keys` pattern (NATS wildcards, None - all keys).
+        Keys changed after `since_version` are yielded first; a reader that falls behind
+        gets only the latest state of each key.
+        """
+        subscriber = _Subscriber(keys)
+        for key, item in sorted(self.items.items(), key=lambda pair: pair[1].version):
+            if item.version > since_version:
+                subscriber.mark(key)
+        self.subscribers.add(subscriber)
+        try:
+            while True:
+                if not subscriber.dirty:
+                    subscriber.waiter = asyncio.get_running_loop().create_future()
+                    await subscriber.waiter
+                    subscriber.waiter = None
+                key = next(iter(subscriber.dirty))
+                del subscriber.dirty[key]
+                yield self.items[key]
+        finally:
+            self.subscribers.discard(subscriber)
@@ -0,0 +1,296 @@
+import asyncio
+import dataclasses
+from typing import Any, Optional
+
+import structlog
+from nats.js.api import ConsumerConfig, ConsumerInfo, KeyValueConfig, StreamConfig, StreamInfo
+from nats.js.errors import NotFoundError
+
+from src.main.new_app.kv_watch import subject_matches
+
+logger: structlog.BoundLogger = structlog.getLogger("NATSClient")
+
+CREATE = "create"
+UPDATE = "update"
+UNCHANGED = "unchanged"
+
+# Поля KeyValueConfig и соответствующие поля StreamConfig бакета
+_BUCKET_FIELDS = {
+    "description": "description",
+    "history": "max_msgs_per_subject",
+    "ttl": "max_age",
+    "max_bytes": "max_bytes",
+    "max_value_size": "max_msg_size",
+    "storage": "storage",
+    "replicas": "num_replicas",
+}
+
+# Поля консюмера, которые сервер не меняет у существующего ("ack policy can not be updated"):
+# при расхождении они остаются как на сервере, клиент подстраивается по consumer_info
+IMMUTABLE_CONSUMER_FIELDS = (
+    "deliver_policy", "opt_start_seq", "opt_start_time", "ack_policy", "replay_policy",
+    "max_waiting", "flow_control", "idle_heartbeat", "headers_only", "mem_storage",
+)
+
+
+@dataclasses.dataclass(slots=True)
+class Change:
+    kind: str  # stream / bucket / consumer
+    name: str
+    action: str  # create / update / unchanged
+    diff: dict[str, tuple[Any, Any]] = dataclasses.field(default_factory=dict)  # поле -> (на сервере, объявлено)
+
+
+class TopologyError(Exception):
+    """Reconcile failed for one or more objects; `errors` holds every failure."""
+
+    def __init__(self, errors: list[BaseException]):
+        self.errors = errors
+        super().__init__(f"{len(errors)} topology operation(s) failed: " + "; ".join(map(repr, errors)))
+
+
+def diff(declared, actual, fields: dict[str, str]) -> dict[str, tuple[Any, Any]]:
+    # Сравниваются только явно переданные поля (fields: поле объявления -> поле на сервере).
+    # Остальные nats-py заполняет своими умолчаниями (duplicate_window=0), а сервер - своими (120s):
+    # это не расхождение
+    result = {}
+    for declared_name, actual_name in fields.items():
+        want = getattr(declared, declared_name)
+        if want is None:
+            continue
+        have = getattr(actual, actual_name, None)
+        if isinstance(want, (list, tuple)) and have is not None:
+            same = sorted(want) == sorted(have)
+        else:
+            same = want == have
+        if not same:
+            result[declared_name] = (have, want)
+    return result
+
+
+def bucket_stream(bucket: str) -> str:
+    return f"KV_{bucket}"
+
+
+class Topology:
+    """
+    Streams, KV buckets and durable consumers declared once and reconciled with the server.
+    `reconcile` lists the server state with one request per stream, then creates
+    missing objects and updates drifted ones in parallel. The resulting infos are
+    cached, so `ensure_*` calls for declared objects make no requests.
+    Every failure is collected into one TopologyError.
+    """
+
+    def __init__(self, concurrency: int = 16):
+        self.concurrency = concurrency
+        self.streams: dict[str, StreamConfig] = {}
+        self.buckets: dict[str, KeyValueConfig] = {}
+        self.consumers: dict[tuple[str, str], ConsumerConfig] = {}
+        self.stream_infos: dict[str, StreamInfo] = {}  # Кэш состояния сервера после сверки
+        self.consumer_infos: dict[tuple[str, str], ConsumerInfo] = {}
+        # Поля, переданные при объявлении, по (вид, ключ): только они сверяются с сервером
+        self.fields: dict[tuple[str, Any], dict[str, str]] = {}
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__} streams:{len(self.streams)} buckets:{len(self.buckets)} "
+            f"consumers:{len(self.consumers)}>"
+        )
+
+    def stream(self, name: str, subjects: list[str], **config: Any) -> StreamConfig:
+        declared = StreamConfig(name=name, subjects=list(subjects), **config)
+        self.fields[("stream", name)] = {field: field for field in ("subjects", *config)}
+        self._declare(self.streams, name, declared, self.stream_infos)
+        return declared
+
+    def bucket(self, name: str, **config: Any) -> KeyValueConfig:
+        declared = KeyValueConfig(bucket=name, **config)
+        self.fields[("bucket", name)] = {field: _BUCKET_FIELDS[field] for field in config if field in _BUCKET_FIELDS}
+        self._declare(self.buckets, name, declared, self.stream_infos, bucket_stream(name))
+        return declared
+
+    def consumer(self, stream: str, durable: str, **config: Any) -> ConsumerConfig:
+        declared = ConsumerConfig(name=durable, durable_name=durable, **config)
+        self.fields[("consumer", (stream, durable))] = {field: field for field in config}
+        self._declare(self.consumers, (stream, durable), declared, self.consumer_infos)
+        return declared
+
+    @staticmethod
+    def _declare(declarations: dict, key, declared, cache: dict, cache_key=None):
+        # Изменённое объявление сверяется с сервером заново
+        if declarations.get(key) != declared:
+            declarations[key] = declared
+            cache.pop(cache_key or key, None)
+
+    def _fields(self, kind: str, key, declared) -> dict[str, str]:
+        fields = self.fields.get((kind, key))
+        if fields is not None:
+            return fields
+        # Конфиг положен в словарь напрямую, не через stream/bucket/consumer: сверяются все поля
+        if kind == "bucket":
+            return _BUCKET_FIELDS
+        return {field.name: field.name for field in dataclasses.fields(declared)}
+
+    def stream_for(self, subject: str) -> Optional[str]:
+        for name, config in self.streams.items():
+            if any(subject_matches(pattern, subject) for pattern in config.subjects):
+                return name
+        return None
+
+    def invalidate(self):
+        self.stream_infos.clear()
+        self.consumer_infos.clear()
+
+    async def reconcile(self, js) -> list[Change]:
+        """Brings the server in line with the declarations; returns what was done."""
+        limit = asyncio.Semaphore(self.concurrency)
+        existing = {info.config.name: info for info in await self._list_streams(js)}
+
+        async def bounded(coro):
+            async with limit:
+                return await coro
+
+        changes = await self._gather(
+            [bounded(self._stream(js, config, existing.get(name))) for name, config in self.streams.items()]
+            + [bounded(self._bucket(js, config, existing.get(bucket_stream(name))))
+               for name, config in self.buckets.items()]
+        )
+        # Консюмеры - после стримов, по одному запросу списка на стрим
+        by_stream: dict[str, list[tuple[str, ConsumerConfig]]] = {}
+        for (stream, durable), config in self.consumers.items():
+            by_stream.setdefault(stream, []).append((durable, config))
+        # Ограничение - на каждом запросе внутри: вложенный захват семафора мог бы заблокировать сверку
+        consumers = await self._gather(
+            [self._stream_consumers(js, stream, declared, limit) for stream, declared in by_stream.items()]
+        )
+        for group in consumers:
+            changes.extend(group)
+        await logger.adebug("Topology reconciled", changes=sum(c.action != UNCHANGED for c in changes))
+        return changes
+
+    @staticmethod
+    async def _gather(coros: list) -> list:
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        errors = []
+        for result in results:
+            if isinstance(result, TopologyError):
+                # Ошибки консюмеров стрима уже записаны в лог
+                errors.extend(result.errors)
+            elif isinstance(result, BaseException):
+                await logger.aerror("Topology reconcile failed", error=repr(result))
+                errors.append(result)
+        if errors:
+            # Все ошибки разом: исправлять по одной за перезапуск неудобно
+            raise TopologyError(errors) from errors[0]
+        return results
+
+    @staticmethod
+    async def _list_streams(js) -> list[StreamInfo]:
+        # STREAM.LIST отдаёт страницы по 256 стримов
+        infos, offset = [], 0
+        while True:
+            page = await js.streams_info(offset=offset)
+            infos.extend(page)
+            if len(page) < 256:
+                return infos
+            offset += len(page)
+
+    async def _stream(self, js, config: StreamConfig, info: Optional[StreamInfo]) -> Change:
+        if info is None:
+            info = await js.add_stream(config)
+            action, changed = CREATE, {}
+        else:
+            changed = diff(config, info.config, self._fields("stream", config.name, config))
+            action = UPDATE if changed else UNCHANGED
+            if changed:
+                info = await js.update_stream(dataclasses.replace(info.config, **{k: v[1] for k, v in changed.items()}))
+        self.stream_infos[config.name] = info
+        return await self._changed(Change("stream", config.name, action, changed))
+
+    async def _bucket(self, js, config: KeyValueConfig, info: Optional[StreamInfo]) -> Change:
+        name = bucket_stream(config.bucket)
+        if info is None:
+            await js.create_key_value(config)
+            info = await js.stream_info(name)
+            action, changed = CREATE, {}
+        else:
+            changed = diff(config, info.config, self._fields("bucket", config.bucket, config))
+            action = UPDATE if changed else UNCHANGED
+            if changed:
+                update = {_BUCKET_FIELDS[field]: values[1] for field, values in changed.items()}
+                info = await js.update_stream(dataclasses.replace(info.config, **update))
+        self.stream_infos[name] = info
+        return await self._changed(Change("bucket", config.bucket, action, changed))
+
+    async def _stream_consumers(
+            self,
+            js,
+            stream: str,
+            declared: list[tuple[str, ConsumerConfig]],
+            limit: Optional[asyncio.Semaphore] = None
+    ) -> list[Change]:
+        limit = limit or asyncio.Semaphore(self.concurrency)
+        async with limit:
+            existing = {info.name: info for info in await js.consumers_info(stream)}
+
+        async def apply(durable: str, config: ConsumerConfig) -> Change:
+            info = existing.get(durable)
+            if info is None:
+                action, changed = CREATE, {}
+            else:
+                changed = diff(config, info.config, self._fields("consumer", (stream, durable), config))
+                fixed = {field: changed.pop(field) for field in IMMUTABLE_CONSUMER_FIELDS if field in changed}
+                if fixed:
+                    await logger.awarning(
+                        "Consumer fields can not be updated, keeping the server values",
+                        name=f"{stream}.{durable}", diff={field: list(values) for field, values in fixed.items()},
+                    )
+                    config = dataclasses.replace(config, **{field: getattr(info.config, field) for field in fixed})
+                action = UPDATE if changed else UNCHANGED
+            if action != UNCHANGED:
+                # CONSUMER.CREATE с тем же именем обновляет изменяемые поля консюмера
+                async with limit:
+                    info = await js.add_consumer(stream, config)
+            self.consumer_infos[(stream, durable)] = info
+            return await self._changed(Change("consumer", f"{stream}.{durable}", action, changed))
+
+        return await self._gather([apply(durable, config) for durable, config in declared])
+
+    @staticmethod
+    async def _changed(change: Change) -> Change:
+        if change.action != UNCHANGED:
+            await logger.ainfo(
+                "Topology changed", kind=change.kind, name=change.name, action=change.action,
+                diff={field: list(values) for field, values in change.diff.items()},
+            )
+        return change
+
+    async def ensure_stream(self, js, name: str) -> StreamInfo:
+        """Cached info of a declared stream; reconciles just this stream on a miss."""
+        info = self.stream_infos.get(name)
+        if info is None:
+            await self._stream(js, self.streams[name], await self._stream_info(js, name))
+            info = self.stream_infos[name]
+        return info
+
+    async def ensure_bucket(self, js, name: str) -> StreamInfo:
+        stream = bucket_stream(name)
+        info = self.stream_infos.get(stream)
+        if info is None:
+            await self._bucket(js, self.buckets[name], await self._stream_info(js, stream))
+            info = self.stream_infos[stream]
+        return info
+
+    async def ensure_consumer(self, js, stream: str, durable: str) -> ConsumerInfo:
+        info = self.consumer_infos.get((stream, durable))
+        if info is None:
+            await self._stream_consumers(js, stream, [(durable, self.consumers[(stream, durable)])])
+            info = self.consumer_infos[(stream, durable)]
+        return info
+
+    @staticmethod
+    async def _stream_info(js, name: str) -> Optional[StreamInfo]:
+        try:
+            return await js.stream_info(name)
+        except NotFoundError:
+            return None
@@ -0,0 +1,102 @@
+"""
+Cold start profile of the entry points.
+`python -m src.main.subs --profile-startup` (also src.main.main and src.main.supervisor)
+measures the module imports in a fresh interpreter (-X importtime) and the init
+phases of the entry point up to the first network call, prints the report and exits.
+"""
+
+import contextlib
+import dataclasses
+import subprocess
+import sys
+import time
+from typing import Iterator, Optional
+
+FLAG = "--profile-startup"
+
+
+@dataclasses.dataclass(slots=True)
+class ImportTime:
+    """
+    Attributes
+    ----------
+    module (str): Imported module.
+    self_us (int): Import time of the module itself, microseconds.
+    cumulative_us (int): Import time including the modules it imported, microseconds.
+    depth (int): Nesting level in the import tree, 0 for modules imported directly.
+    """
+
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(output: str) -> list[ImportTime]:
+    # Строки вида "import time:  self [us] | cumulative | <отступ>module"
+    result = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        result.append(ImportTime(name.strip(), int(self_us), int(cumulative_us), depth))
+    return result
+
+
+def measure_imports(module: str) -> list[ImportTime]:
+    """Imports `module` in a fresh interpreter, so modules already loaded here do not hide the cost."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Cannot import {module}: {completed.stderr.strip().splitlines()[-1:]}")
+    return parse_importtime(completed.stderr)
+
+
+class StartupProfile:
+    """Wall time of the init phases of an entry point and the import cost of its module."""
+
+    def __init__(self, module: str):
+        self.module = module
+        self.started = time.perf_counter()
+        self.phases: list[tuple[str, float]] = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def report(self, top: int = 15, imports: Optional[list[ImportTime]] = None) -> str:
+        imports = measure_imports(self.module) if imports is None else imports
+        total = next((item.cumulative_us for item in reversed(imports) if item.module == self.module), 0)
+        lines = [f"Startup profile of {self.module}", "", f"import {self.module:<40} {total / 1000:>9.1f} ms"]
+        # Пакеты верхнего уровня: кто именно тянет время импорта
+        packages: dict[str, int] = {}
+        for item in imports:
+            package = item.module.split(".", 1)[0]
+            packages[package] = packages.get(package, 0) + item.self_us
+        lines.append("")
+        lines.append(f"{'package':<47} {'self ms':>9}")
+        for package, self_us in sorted(packages.items(), key=lambda pair: -pair[1])[:top]:
+            lines.append(f"{package:<47} {self_us / 1000:>9.1f}")
+        lines.append("")
+        lines.append(f"{'slowest modules':<36} {'self ms':>9} {'cumul ms':>9}")
+        for item in sorted(imports, key=lambda item: -item.self_us)[:top]:
+            lines.append(f"{item.module[:36]:<36} {item.self_us / 1000:>9.1f} {item.cumulative_us / 1000:>9.1f}")
+        lines.append("")
+        lines.append(f"{'init phase':<47} {'ms':>9}")
+        for name, seconds in self.phases:
+            lines.append(f"{name:<47} {seconds * 1000:>9.1f}")
+        lines.append(f"{'total (in this process)':<47} {(time.perf_counter() - self.started) * 1000:>9.1f}")
+        return "\n".join(lines)
+
+
+def requested(argv: Optional[list[str]] = None) -> bool:
+    return FLAG in (sys.argv[1:] if argv is None else argv)
@@ -1,19 +1,26 @@
 import asyncio
 import sys
+from typing import TYPE_CHECKING
 
 import structlog
 from dishka import make_async_container, AsyncContainer, FromDishka
-from dishka.integrations.faststream import setup_dishka, FastStreamProvider, inject
-from faststream import FastStream, context
+from dishka.integrations.faststream import FastStreamProvider
+from faststream import FastStream
 from faststream.nats import NatsBroker, NatsRouter, KvWatch
 from faststream.nats.annotations import NatsMessage
-from faststream import ContextRepo
 
 from src.infrastructure.logger.loggers import InitLoggers
+from src.main import startup
+from src.main.di import StateProvider
+from src.main.injection import setup_injection
+from src.main.new_app.state import StateStore
 # from src.main.di import ConfigProvider#, t_config
 
+if TYPE_CHECKING:
+    # Супервизор нужен только при запуске через него, отдельный запуск его не импортирует
+    from src.main.supervisor import WorkerContext
+
 logger = structlog.getLogger(InitLoggers.main.name)
-router = NatsRouter()
 
 # @router.subscriber(subject="test", no_ack=True)
 # async def sub_test(msg: str, nats_msg: NatsMessage):
@@ -23,41 +30,90 @@ router = NatsRouter()
 #
 #     return "New test2 msg"
 
-@router.subscriber(
-    subject="result",
-    kv_watch=KvWatch(bucket="miniapp")
-)
-@inject
-async def miniapp_sub(new_value: int, config: FromDishka[ContextRepo]):
-    await logger.ainfo(new_value, t_config=type(config), c=config)
-    config.set_global("result", new_value)
+async def miniapp_sub(new_value: int, state: FromDishka[StateStore], msg: NatsMessage):
+    await logger.ainfo(new_value, t_state=type(state))
+    # Ревизия записи KV: повторная или запоздавшая доставка не перезапишет более новое значение
+    state.set("result", new_value, revision=msg.raw_message.revision)
+
+
+def create_router() -> NatsRouter:
+    # FastStream связывает обработчик с DI один раз за процесс, при запуске первого брокера:
+    # второму брокеру (тесты, бенчмарки) нужен свой роутер со своими обёртками
+    new_router = NatsRouter()
+    new_router.subscriber(subject="result", kv_watch=KvWatch(bucket="miniapp"))(miniapp_sub)
+    return new_router
+
+
+router = create_router()
 
 ##########
 async def miniapp(container: AsyncContainer):
-    config = await container.get(ContextRepo)
+    state = await container.get(StateStore)
 
+    # Просыпаемся только при изменении значения, без опроса
+    version = 0
     while True:
-        await asyncio.sleep(1)
-        await logger.ainfo("App", result=config.get("result"))
+        update = await state.changed("result", version)
+        version = update.version
+        await logger.ainfo("App", result=update.value)
 ##########
 
-async def main() -> None:
-    container = make_async_container(FastStreamProvider())
+def create_app() -> tuple[AsyncContainer, FastStream]:
+    container = make_async_container(FastStreamProvider(), StateProvider())
 
     broker = NatsBroker(
         servers=["nats://127.0.0.1:30114"]
     )
     broker.include_router(router)
-    await broker.connect()
 
     app = FastStream(broker)
-    setup_dishka(container=container, app=app, auto_inject=True)
+    # APP-зависимости (StateStore) связываются с обработчиком один раз, без контейнера на сообщение
+    setup_injection(container, app)
+    return container, app
+
+
+async def main() -> None:
+    container, app = create_app()
+    await app.broker.connect()
 
     try:
         await asyncio.gather(app.run(), miniapp(container))
     except KeyboardInterrupt:
         sys.exit(0)
 
+async def worker(ctx: "WorkerContext") -> None:
+    # Точка входа для src.main.supervisor: в каждом процессе своё подключение.
+    # KV-наблюдение получает каждый воркер; подписки на subject делим через queue=...
+    # Не app.run(): он ставит свои обработчики сигналов поверх обработчиков супервизора,
+    # остановкой здесь управляет ctx.stopping
+    container, app = create_app()
+    app.after_startup(ctx.ready)
+
+    await app.start()
+    poll = asyncio.create_task(miniapp(container))
+    stopping = asyncio.create_task(ctx.stopping.wait())
+    try:
+        await asyncio.wait((poll, stopping), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        poll.cancel()
+        stopping.cancel()
+        await asyncio.gather(poll, stopping, return_exceptions=True)
+        await app.stop()
+    if not poll.cancelled() and poll.exception() is not None:
+        raise poll.exception()
+
+def profile_startup() -> None:
+    profile = startup.StartupProfile(__spec__.name if __spec__ else "src.main.subs")
+    with profile.phase("logger setup"):
+        InitLoggers()
+    with profile.phase("container, broker, app"):
+        create_app()
+    print(profile.report())
+
+
 if __name__ == "__main__":
-    InitLoggers()
-    asyncio.run(main())
\ No newline at end of file
+    if startup.requested():
+        profile_startup()
+    else:
+        InitLoggers()
+        asyncio.run(main())
\ No newline at end of file
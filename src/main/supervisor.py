@@ -0,0 +1,360 @@
+"""
+Multi-process runner for consumers.
+The supervisor starts N worker processes, each with its own event loop and broker
+connection, watches their heartbeats, restarts crashed or hung workers and stops
+all of them together on SIGINT/SIGTERM.
+Workers scale a consumer across cores when they share the work on the server side:
+one durable pull consumer (NATSClient.add_subscription with the same durable_name)
+or a queue group (router.subscriber(..., queue="...")).
+Run: python -m src.main.supervisor --workers 4 [--target src.main.subs:worker]
+"""
+
+import argparse
+import ast
+import asyncio
+import collections
+import dataclasses
+import importlib
+import importlib.util
+import multiprocessing
+import signal
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+import structlog
+
+from src.infrastructure.logger.loggers import InitLoggers
+from src.main import startup
+
+logger = structlog.getLogger(InitLoggers.main.name)
+
+DEFAULT_TARGET = "src.main.subs:worker"
+
+
+@dataclasses.dataclass(slots=True)
+class WorkerContext:
+    """
+    Passed to the worker coroutine.
+    Attributes
+    ----------
+    worker_id (int): Number of the worker, from 0.
+    workers (int): Total number of workers.
+    stopping (asyncio.Event): Set when the supervisor asks the worker to finish.
+    """
+
+    worker_id: int
+    workers: int
+    stopping: asyncio.Event
+    heartbeat: Any  # multiprocessing.Value("d"): 0 - ещё не готов, иначе время последнего сигнала
+
+    def ready(self):
+        """Marks the worker as started: heartbeats begin and startup_timeout stops applying."""
+        self.heartbeat.value = time.time()
+
+
+WorkerTarget = Callable[[WorkerContext], Awaitable[None]]
+
+
+def split_target(path: str) -> tuple[str, str]:
+    module, _, name = path.partition(":")
+    if not name:
+        raise ValueError(f"Target must look like 'package.module:function', got {path!r}")
+    return module, name
+
+
+def check_target(path: str):
+    # Модуль ищется, но не импортируется: его зависимости грузят только воркеры.
+    # Имя функции проверяется по исходнику модуля через ast
+    module, name = split_target(path)
+    spec = importlib.util.find_spec(module)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {module!r}", name=module)
+    get_source = getattr(spec.loader, "get_source", None)
+    source = get_source(module) if get_source is not None else None
+    if source is None:
+        # Расширение или модуль без исходника: проверит импорт в воркере
+        return
+    names = _module_names(ast.parse(source, filename=spec.origin or module).body)
+    if names is not None and name not in names:
+        raise AttributeError(f"Module {module!r} has no attribute {name!r}", name=name)
+
+
+def _module_names(body: list[ast.stmt]) -> Optional[set[str]]:
+    # Все имена, которые код уровня модуля может связать: присваивания, for/with/except/match,
+    # импорты, def/class и global внутри функций. Тела функций и классов свои имена модуля не дают.
+    # Лишнее имя безопасно (проверку сделает импорт в воркере), пропущенное - нет.
+    # None - набор имён статически не известен (import * или __getattr__ модуля)
+    names = set()
+    nodes = list(body)
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+            names.update(n for g in ast.walk(node) if isinstance(g, ast.Global) for n in g.names)
+            # Декораторы выполняются на уровне модуля (например, name := register(...))
+            nodes.extend(node.decorator_list)
+            continue
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name == "*":
+                    return None
+                names.add(alias.asname or alias.name.partition(".")[0])
+            continue
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            names.add(node.id)
+        elif isinstance(node, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+        nodes.extend(ast.iter_child_nodes(node))
+    return None if "__getattr__" in names else names
+
+
+def load_target(path: str) -> WorkerTarget:
+    module, name = split_target(path)
+    return getattr(importlib.import_module(module), name)
+
+
+async def _beat(ctx: WorkerContext, stop, interval: float):
+    # Пульс пишется из цикла событий: заблокированный цикл перестаёт его обновлять
+    while True:
+        await asyncio.sleep(interval)
+        if ctx.heartbeat.value:
+            ctx.heartbeat.value = time.time()
+        if stop.is_set() and not ctx.stopping.is_set():
+            ctx.stopping.set()
+
+
+async def _run_worker(target: WorkerTarget, ctx: WorkerContext, stop, interval: float, grace: float):
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, ctx.stopping.set)
+    beat = asyncio.create_task(_beat(ctx, stop, interval))
+    main = asyncio.create_task(target(ctx))
+    try:
+        stopping = asyncio.create_task(ctx.stopping.wait())
+        await asyncio.wait((main, stopping), return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
+        if not main.done():
+            # Даём воркеру завершиться самому, затем отменяем
+            done, _ = await asyncio.wait((main,), timeout=grace)
+            if not done:
+                await logger.awarning("Worker did not stop in time, cancelling")
+                main.cancel()
+        await asyncio.gather(main, return_exceptions=True)
+        if not main.cancelled() and main.exception() is not None:
+            raise main.exception()
+    finally:
+        beat.cancel()
+
+
+def _worker_main(path: str, worker_id: int, workers: int, heartbeat, stop, interval: float, grace: float):
+    # Ctrl+C приходит всей группе процессов: останавливает супервизор, а не воркеры напрямую
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    InitLoggers()
+    structlog.contextvars.bind_contextvars(worker=worker_id)
+    target = load_target(path)
+
+    async def run():
+        ctx = WorkerContext(worker_id, workers, asyncio.Event(), heartbeat)
+        await _run_worker(target, ctx, stop, interval, grace)
+
+    asyncio.run(run())
+
+
+@dataclasses.dataclass(slots=True)
+class _Worker:
+    worker_id: int
+    heartbeat: Any
+    process: Optional[multiprocessing.process.BaseProcess] = None
+    started_at: float = 0.0
+    restart_at: float = 0.0  # Когда можно перезапустить после падения (backoff)
+    restarts: collections.deque = dataclasses.field(default_factory=collections.deque)
+
+
+class Supervisor:
+    """
+    Starts, watches and restarts worker processes.
+    Attributes
+    ----------
+    target (str): Worker coroutine as "package.module:function", called with a WorkerContext.
+    workers (int): Number of worker processes.
+    heartbeat_interval (float): How often a worker reports that its event loop is alive, seconds.
+    heartbeat_timeout (float): A started worker silent for this long is killed and restarted.
+    startup_timeout (float): A worker that has not called ctx.ready() in time is restarted.
+    grace (float): Time given to workers to finish on shutdown before they are killed.
+    max_restarts (int): Restarts of one worker allowed within restart_window; above that the supervisor exits.
+    restart_window (float): Window for max_restarts, seconds.
+    """
+
+    def __init__(
+            self,
+            target: str = DEFAULT_TARGET,
+            workers: int = 1,
+            heartbeat_interval: float = 1.0,
+            heartbeat_timeout: float = 10.0,
+            startup_timeout: float = 30.0,
+            grace: float = 10.0,
+            max_restarts: int = 5,
+            restart_window: float = 60.0,
+            start_method: str = "spawn"
+    ):
+        if workers < 1:
+            raise ValueError("workers must be >= 1")
+        check_target(target)  # Ошибку в пути лучше получить до запуска процессов
+        self.target = target
+        self.workers = workers
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.grace = grace
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        # spawn: asyncio и потоки логгера не переживают fork корректно
+        self.mp = multiprocessing.get_context(start_method)
+        self.stop_event = self.mp.Event()
+        self.pool = [_Worker(i, self.mp.Value("d", 0.0, lock=False)) for i in range(workers)]
+        self.failed = False
+
+    def run(self) -> int:
+        """Blocks until shutdown; returns the exit code for the process."""
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
+        logger.info("Starting workers", workers=self.workers, target=self.target)
+        for worker in self.pool:
+            self._start(worker)
+        try:
+            while not self.stop_event.is_set():
+                time.sleep(min(self.heartbeat_interval, 0.5))
+                for worker in self.pool:
+                    self._check(worker)
+        finally:
+            self._shutdown()
+        return 1 if self.failed else 0
+
+    def _on_signal(self, signum, frame):
+        logger.info("Shutdown requested", signal=signal.Signals(signum).name)
+        self.stop_event.set()
+
+    def _start(self, worker: _Worker):
+        worker.heartbeat.value = 0.0
+        worker.process = self.mp.Process(
+            target=_worker_main,
+            args=(
+                self.target, worker.worker_id, self.workers, worker.heartbeat,
+                self.stop_event, self.heartbeat_interval, self.grace,
+            ),
+            name=f"worker-{worker.worker_id}",
+            daemon=False,
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        logger.info("Worker started", worker=worker.worker_id, pid=worker.process.pid)
+
+    def _check(self, worker: _Worker):
+        now = time.monotonic()
+        process = worker.process
+        if process is None:
+            if now >= worker.restart_at:
+                self._start(worker)
+            return
+        if not process.is_alive():
+            logger.error("Worker exited", worker=worker.worker_id, exitcode=process.exitcode)
+            self._restart(worker)
+            return
+        beat = worker.heartbeat.value
+        if not beat:
+            if now - worker.started_at > self.startup_timeout:
+                logger.error("Worker did not start in time", worker=worker.worker_id)
+                self._kill(process)
+                self._restart(worker)
+        elif time.time() - beat > self.heartbeat_timeout:
+            logger.error("Worker heartbeat lost", worker=worker.worker_id, silent=round(time.time() - beat, 1))
+            self._kill(process)
+            self._restart(worker)
+
+    def _restart(self, worker: _Worker):
+        now = time.monotonic()
+        worker.process = None
+        worker.restarts.append(now)
+        while worker.restarts and now - worker.restarts[0] > self.restart_window:
+            worker.restarts.popleft()
+        if len(worker.restarts) > self.max_restarts:
+            logger.critical(
+                "Worker keeps failing, stopping", worker=worker.worker_id, restarts=len(worker.restarts)
+            )
+            self.failed = True
+            self.stop_event.set()
+            return
+        # Экспоненциальная задержка, чтобы не крутить падающий воркер вхолостую
+        worker.restart_at = now + min(0.5 * 2 ** (len(worker.restarts) - 1), 30.0)
+
+    @staticmethod
+    def _kill(process):
+        process.terminate()
+        process.join(5)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def _shutdown(self):
+        # Воркеры видят stop_event по пульсу и завершаются сами
+        self.stop_event.set()
+        processes = [w.process for w in self.pool if w.process is not None]
+        deadline = time.monotonic() + self.grace + self.heartbeat_interval + 1
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+        for process in processes:
+            if process.is_alive():
+                logger.warning("Killing worker", pid=process.pid)
+                self._kill(process)
+        logger.info("All workers stopped")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m src.main.supervisor", description="Run consumers in N processes")
+    parser.add_argument("--workers", "-w", type=int, default=multiprocessing.cpu_count(), help="number of processes")
+    parser.add_argument("--target", default=DEFAULT_TARGET, help="worker coroutine, package.module:function")
+    parser.add_argument("--heartbeat-interval", type=float, default=1.0)
+    parser.add_argument("--heartbeat-timeout", type=float, default=10.0)
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--grace", type=float, default=10.0, help="seconds to finish on shutdown")
+    parser.add_argument("--max-restarts", type=int, default=5, help="per worker within --restart-window")
+    parser.add_argument("--restart-window", type=float, default=60.0)
+    parser.add_argument(startup.FLAG, action="store_true", help="print the worker cold start profile and exit")
+    return parser.parse_args(argv)
+
+
+def profile_startup(target: str) -> None:
+    # Профиль запуска одного воркера: импорт целевого модуля и загрузка функции
+    module, _ = split_target(target)
+    profile = startup.StartupProfile(module)
+    with profile.phase("logger setup"):
+        InitLoggers()
+    with profile.phase("check target"):
+        check_target(target)
+    with profile.phase("import worker target"):
+        load_target(target)
+    print(profile.report())
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.profile_startup:
+        profile_startup(args.target)
+        return 0
+    supervisor = Supervisor(
+        target=args.target,
+        workers=args.workers,
+        heartbeat_interval=args.heartbeat_interval,
+        heartbeat_timeout=args.heartbeat_timeout,
+        startup_timeout=args.startup_timeout,
+        grace=args.grace,
+        max_restarts=args.max_restarts,
+        restart_window=args.restart_window,
+    )
+    return supervisor.run()
+
+
+if __name__ == "__main__":
+    InitLoggers()
+    raise SystemExit(main())
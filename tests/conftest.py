@@ -0,0 +1,88 @@
+import asyncio
+import inspect
+from typing import Awaitable, Callable
+
+import pytest
+
+from src.main.new_app.memory import MemoryClient, MemoryServer
+from src.main.new_app.nats_app import NATSKeyValueClient
+from src.main.new_app.nats_stream import NATSClient
+from src.main.new_app.pool import HASH, ConnectionPool
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    # async def тесты выполняются в своём цикле событий; клиенты фабрик закрываются в нём же
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    kwargs = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    closers = pyfuncitem.funcargs.get("closers", [])
+
+    async def run():
+        try:
+            await pyfuncitem.obj(**kwargs)
+        finally:
+            for close in reversed(closers):
+                await close()
+
+    asyncio.run(run())
+    return True
+
+
+@pytest.fixture
+def closers() -> list[Callable[[], Awaitable[None]]]:
+    # Повторное закрытие безопасно: тест может отключить клиента сам, до проверок
+    return []
+
+
+@pytest.fixture
+def server() -> MemoryServer:
+    # Свой сервер на тест: durable и бакеты не переходят между тестами
+    return MemoryServer()
+
+
+@pytest.fixture
+def stream_client(server, closers):
+    async def make(**kwargs) -> NATSClient:
+        client = NATSClient(transport=server, **kwargs)
+        await client.connect()
+        closers.append(client.disconnect)
+        await client.create_stream("S", ["s.>"])
+        return client
+
+    return make
+
+
+@pytest.fixture
+def kv_client(server, closers):
+    async def make(**kwargs) -> NATSKeyValueClient:
+        client = NATSKeyValueClient(transport=server, **kwargs)
+        await client.connect()
+        closers.append(client.disconnect)
+        await client.create_bucket("B")
+        return client
+
+    return make
+
+
+@pytest.fixture
+def memory_js(server, closers):
+    async def make() -> tuple[MemoryClient, object]:
+        client = MemoryClient(server)
+        await client.connect()
+        closers.append(client.close)
+        return client, client.jetstream()
+
+    return make
+
+
+@pytest.fixture
+def connection_pool(server, closers):
+    async def make(size: int, policy: str = HASH) -> ConnectionPool:
+        pool = ConnectionPool(size, policy, server)
+        await pool.connect([])
+        closers.append(pool.close)
+        await pool.primary.js.add_stream(name="S", subjects=["s.>"])
+        return pool
+
+    return make
@@ -0,0 +1,12 @@
+import asyncio
+import time
+from typing import Callable
+
+
+async def eventually(predicate: Callable[[], bool], timeout: float = 5.0, interval: float = 0.01):
+    # Ждём условия, не полагаясь на фиксированные sleep
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(interval)
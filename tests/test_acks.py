@@ -0,0 +1,76 @@
+import asyncio
+import collections
+
+from nats.js.api import AckPolicy
+
+from src.main.new_app.acks import AckSettings
+from src.main.new_app.consumer import PullSettings
+from tests.helpers import eventually
+
+
+async def test_cumulative_acks_cover_the_contiguous_run(stream_client):
+    client = await stream_client()
+    done = []
+
+    async def callback(msg):
+        done.append(msg.payload)
+        await msg.ack()
+
+    settings = PullSettings(flow=None, acks=AckSettings(max_count=8))
+    await client.add_subscription("s.a", "D", callback, settings=settings)
+    await client.publish_many("s.a", list(range(50)))
+    await eventually(lambda: len(done) == 50)
+    await eventually(lambda: client.consumers["D"].acks.sequences == [])
+    info = await client.js.consumer_info("S", "D")
+    await client.disconnect()
+    assert info.num_ack_pending == 0 and sorted(done) == list(range(50))
+
+
+async def test_acks_held_back_by_a_slow_callback_are_not_redelivered(stream_client):
+    client = await stream_client()
+    deliveries = collections.Counter()
+
+    async def callback(msg):
+        deliveries[msg.payload] += 1
+        if msg.payload == 0:
+            await asyncio.sleep(1.0)  # Дольше ack_wait: задерживает кумулятивный ack остальных
+        await msg.ack()
+
+    settings = PullSettings(ack_wait=0.3, flow=None, acks=AckSettings())
+    await client.add_subscription("s.a", "D", callback, settings=settings)
+    await client.publish_many("s.a", list(range(5)))
+    await asyncio.sleep(1.4)
+    info = await client.js.consumer_info("S", "D")
+    await client.disconnect()
+    assert deliveries == {n: 1 for n in range(5)}
+    assert info.num_ack_pending == 0
+
+
+async def test_cumulative_settings_fall_back_on_an_explicit_durable(stream_client, memory_js):
+    _, js = await memory_js()
+    # Стрим S объявляется клиентом (топология), стрим X - нет (консюмер ищет nats-py)
+    await js.add_stream(name="X", subjects=["x.>"])
+    client = await stream_client()
+    for stream, subject in (("S", "s.a"), ("X", "x.a")):
+        await js.add_consumer(stream, durable_name="D", filter_subject=subject, ack_policy=AckPolicy.EXPLICIT)
+    done = []
+
+    async def callback(msg):
+        done.append(msg.subject)
+        await msg.ack()
+
+    settings = PullSettings(flow=None, acks=AckSettings())
+    await client.add_subscription("s.a", "D", callback, settings=settings)
+    topology_consumer = client.consumers["D"]
+    await client.add_subscription("x.a", "D", callback, settings=settings)
+    for consumer in (topology_consumer, client.consumers["D"]):
+        assert consumer.acks.settings.cumulative is False
+    await client.publish_many("s.a", list(range(10)))
+    await client.publish_many("x.a", list(range(10)))
+    await eventually(lambda: len(done) == 20)
+    # Подтверждения по одному: на EXPLICIT-консюмере ничего не остаётся неподтверждённым
+    await eventually(lambda: not topology_consumer.acks.buffered and not client.consumers["D"].acks.buffered)
+    infos = [await js.consumer_info(stream, "D") for stream in ("S", "X")]
+    await client.disconnect()
+    assert [info.config.ack_policy for info in infos] == [AckPolicy.EXPLICIT] * 2
+    assert [info.num_ack_pending for info in infos] == [0, 0]
@@ -0,0 +1,92 @@
+import asyncio
+import os
+
+import pytest
+
+from src.main.new_app.batching import (
+    COUNT_HEADER, ENCODING_HEADER, ENVELOPE_HEADER, BatchSettings, Compression, ZlibCompression,
+    get_compression, pack, unpack,
+)
+from src.main.new_app.metrics import Metrics
+from tests.helpers import eventually
+
+
+def test_compression_is_abstract():
+    with pytest.raises(TypeError):
+        Compression()
+
+    class Partial(Compression):
+        def compress(self, data):
+            return data
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_default_compression_needs_no_extra_packages():
+    assert isinstance(get_compression(BatchSettings().compression), ZlibCompression)
+    with pytest.raises(ValueError):
+        get_compression("brotli")
+
+
+def test_envelope_roundtrip():
+    payloads = [b"x" * 100 for _ in range(10)]
+    body, headers = pack(payloads, get_compression("zlib"), min_size=512)
+    assert headers[ENCODING_HEADER] == "zlib"
+    assert unpack(body, headers) == payloads
+    # Маленькие и несжимаемые конверты уходят без сжатия
+    small, headers = pack([b"x"], get_compression("zlib"), min_size=512)
+    assert ENCODING_HEADER not in headers and unpack(small, headers) == [b"x"]
+    noise = [os.urandom(1000)]
+    body, headers = pack(noise, get_compression("zlib"))
+    assert ENCODING_HEADER not in headers and unpack(body, headers) == noise
+
+
+async def test_batched_messages_reach_the_callback_one_by_one(stream_client):
+    client = await stream_client(batching=BatchSettings(max_count=10, linger=0.01))
+    results = await client.publish_many("s.a", [{"n": i, "body": "x" * 100} for i in range(25)])
+    assert all(result.ok for result in results)
+    info = await client.js.stream_info("S")
+    assert info.state.messages == 3  # 10 + 10 + 5
+
+    received = []
+
+    async def callback(msg):
+        received.append(msg.payload["n"])
+
+    await client.add_subscription("s.>", "C", callback)
+    for _ in range(200):
+        if len(received) == 25:
+            break
+        await asyncio.sleep(0.01)
+    await client.disconnect()
+    assert received == list(range(25))
+
+
+async def test_only_marked_envelopes_are_unpacked_and_corrupt_ones_are_terminated(stream_client):
+    client = await stream_client(metrics=Metrics())
+    received = []
+
+    async def callback(msg):
+        received.append(bytes(msg.raw))
+        await msg.ack()
+
+    await client.add_subscription("s.>", "C", callback)
+    plain = client.codec.encode("plain")
+    # Чужой Batch-Count без маркера - обычное сообщение
+    await client.js.publish("s.a", plain, headers={COUNT_HEADER: "3"})
+    body, headers = pack([b"x"])
+    for bad_headers, data in (
+            ({**headers, ENVELOPE_HEADER: "2"}, body),  # Неизвестная версия
+            (headers, b"\xc1garbage"),
+            ({**headers, COUNT_HEADER: "5"}, body),
+            ({**headers, ENCODING_HEADER: "zlib"}, body),
+    ):
+        await client.js.publish("s.a", data, headers=bad_headers)
+    await eventually(lambda: received == [plain])
+    await eventually(lambda: client.metrics.snapshot().get('nats_envelope_malformed_total{consumer="C"}') == 4)
+    await asyncio.sleep(0.1)
+    info = await client.js.consumer_info("S", "C")
+    await client.disconnect()
+    assert received == [plain]
+    assert info.num_ack_pending == 0 and info.num_redelivered == 0
@@ -0,0 +1,43 @@
+import pytest
+
+from src.benchmarks import core, faststream_cases, nats_cases
+from src.benchmarks.__main__ import parse_args, select_cases
+
+
+@pytest.mark.parametrize("name", sorted(nats_cases.CASES))
+async def test_nats_case_runs_on_memory_transport(name):
+    result = await core.run_case(
+        name, nats_cases.CASES[name], None, payload_size=16, concurrency=4, messages=40,
+        alloc_messages=8, transport="memory",
+    )
+    assert result.messages == 40 and result.msgs_per_s > 0
+    assert result.p99_ms >= result.p50_ms > 0
+    assert result.alloc_peak_kib > 0
+
+
+@pytest.mark.parametrize("name", sorted(faststream_cases.CASES))
+async def test_faststream_case_runs_in_memory(name):
+    result = await core.run_case(name, faststream_cases.CASES[name], None, 16, 4, 40)
+    assert result.msgs_per_s > 0
+
+
+def test_results_roundtrip_and_regression(tmp_path):
+    old = [core.BenchResult("kv.put_value", 64, 1, 100, 1.0, 1000.0, 0.5, 1.0)]
+    new = [core.BenchResult("kv.put_value", 64, 1, 100, 1.0, 800.0, 0.5, 1.0),
+           core.BenchResult("kv.get_value", 64, 1, 100, 1.0, 900.0, 0.5, 1.0)]
+    path = str(tmp_path / "old.json")
+    core.save(old, path, "nats")
+    assert core.load(path) == old
+    table, regressed = core.compare(core.load(path), new, threshold=0.1)
+    assert regressed
+    assert "-20.0% !" in table and "new" in table
+    assert not core.compare(old, new, threshold=0.25)[1]
+
+
+def test_case_selection():
+    assert set(select_cases(parse_args(["--target", "nats"]))) == set(nats_cases.CASES)
+    args = parse_args(["--cases", "kv.get_value,faststream.miniapp_sub", "--payloads", "8,16"])
+    assert list(select_cases(args)) == ["kv.get_value", "faststream.miniapp_sub"]
+    assert args.payloads == [8, 16]
+    with pytest.raises(SystemExit):
+        select_cases(parse_args(["--cases", "nope"]))
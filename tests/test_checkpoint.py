@@ -0,0 +1,69 @@
+import asyncio
+
+from src.main.new_app.memory import MemoryServer
+from src.main.new_app.nats_app import NATSKeyValueClient
+from tests.helpers import eventually
+
+
+async def _client(server: MemoryServer, directory, **config) -> NATSKeyValueClient:
+    client = NATSKeyValueClient(transport=server, checkpoint_dir=str(directory))
+    await client.connect()
+    await client.create_bucket("B", **config)
+    return client
+
+
+async def _first_run(server: MemoryServer, directory, **config) -> int:
+    # Наблюдение, несколько записей и снимок при отключении
+    client = await _client(server, directory, **config)
+    await client.watch_bucket("B", lambda event: asyncio.sleep(0))
+    for key in ("a", "b", "c"):
+        await client.put_value(key, key)
+    await eventually(lambda: client.watcher.revision("B") == 3)
+    await client.disconnect()
+    return 3
+
+
+async def test_restart_resumes_from_the_snapshot(server, tmp_path):
+    await _first_run(server, tmp_path)
+    client = await _client(server, tmp_path)
+    await client.kv.delete("a")
+    seen = {}
+
+    async def callback(event):
+        seen[event.key] = event.value
+
+    snapshot = await client.checkpoint.restore("B")
+    await client.watch_bucket("B", callback)
+    await eventually(lambda: client.watcher.revision("B") == 4)
+    await client.disconnect()
+    assert snapshot.revision == 3
+    assert seen == {"a": None, "b": "b", "c": "c"}
+
+
+async def test_snapshot_is_rejected_when_history_after_it_is_gone(server, tmp_path):
+    revision = await _first_run(server, tmp_path)
+    client = await _client(server, tmp_path)
+    await client.kv.delete("a")
+    stream = server.stream("KV_B")
+    # Удаление "a" после снимка потеряно вместе с началом стрима
+    for seq in range(1, revision + 2):
+        stream.remove(seq)
+    await client.put_value("d", "d")
+    assert await client.checkpoint.restore("B") is None
+    seen = {}
+
+    async def callback(event):
+        seen[event.key] = event.value
+
+    await client.watch_bucket("B", callback)
+    await eventually(lambda: "d" in seen)
+    await client.disconnect()
+    assert seen == {"d": "d"}
+
+
+async def test_snapshot_of_a_bucket_with_ttl_is_not_used(server, tmp_path):
+    await _first_run(server, tmp_path, ttl=3600)
+    client = await _client(server, tmp_path)
+    assert await client.checkpoint.restore("B") is None
+    await client.disconnect()
+    assert not (tmp_path / "B.kvsnap").exists()
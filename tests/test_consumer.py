@@ -0,0 +1,151 @@
+import asyncio
+
+from nats.js.errors import FetchTimeoutError
+
+from src.main.new_app.consumer import PullConsumer, PullSettings
+from tests.helpers import eventually
+
+
+async def test_in_flight_is_bounded(stream_client):
+    client = await stream_client()
+    running, peak, done = 0, 0, []
+
+    async def callback(msg):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.005)
+        running -= 1
+        done.append(msg.payload)
+        await msg.ack()
+
+    await client.add_subscription("s.a", "D", callback, settings=PullSettings(max_in_flight=4, flow=None))
+    await client.publish_many("s.a", list(range(100)))
+    await eventually(lambda: len(done) == 100)
+    await client.disconnect()
+    assert peak == 4
+    assert sorted(done) == list(range(100))
+
+
+async def test_failed_callback_is_redelivered(stream_client):
+    client = await stream_client()
+    attempts, done = {}, []
+
+    async def callback(msg):
+        n = msg.payload
+        attempts[n] = attempts.get(n, 0) + 1
+        if n % 5 == 0 and attempts[n] == 1:
+            raise RuntimeError("boom")
+        done.append(n)
+        await msg.ack()
+
+    await client.add_subscription("s.a", "D", callback, settings=PullSettings(flow=None))
+    await client.publish_many("s.a", list(range(20)))
+    await eventually(lambda: len(done) == 20)
+    await client.disconnect()
+    assert sorted(done) == list(range(20))
+    assert all(attempts[n] == 2 for n in range(0, 20, 5))
+
+
+async def test_long_callback_is_kept_alive(stream_client):
+    client = await stream_client()
+    calls = []
+
+    async def callback(msg):
+        calls.append(msg.payload)
+        await asyncio.sleep(0.8)  # Дольше ack_wait: in_progress не даёт сообщению вернуться
+        await msg.ack()
+
+    await client.add_subscription("s.a", "D", callback, settings=PullSettings(ack_wait=0.3, flow=None))
+    await client.publish("s.a", 1)
+    await asyncio.sleep(1.2)
+    await client.disconnect()
+    assert calls == [1]
+
+
+async def test_pause_right_after_add_subscription(stream_client):
+    client = await stream_client()
+    done = []
+
+    async def callback(msg):
+        done.append(msg.payload)
+        await msg.ack()
+
+    # Консюмер доступен сразу, до первого шага цикла выборки
+    consumer = await client.add_subscription("s.a", "D", callback)
+    assert client.consumers["D"] is consumer
+    await client.pause("D")
+    await client.publish_many("s.a", list(range(5)))
+    await asyncio.sleep(0.2)
+    assert done == []
+    await client.resume("D")
+    await eventually(lambda: len(done) == 5)
+    await client.disconnect()
+
+
+async def test_max_ack_pending_is_left_to_the_server_unless_configured(stream_client):
+    client = await stream_client()
+
+    async def callback(msg):
+        await msg.ack()
+
+    await client.add_subscription("s.a", "A", callback)
+    await client.add_subscription("s.b", "B", callback, settings=PullSettings(max_in_flight=8).for_workers(4))
+    info_a = await client.js.consumer_info("S", "A")
+    info_b = await client.js.consumer_info("S", "B")
+    await client.disconnect()
+    assert info_a.config.max_ack_pending is None
+    assert info_b.config.max_ack_pending == 32
+
+
+class _FlakyMsg:
+    subject = "s.a"
+
+    def __init__(self):
+        self.progress = 0
+        self.acks = 0
+
+    async def in_progress(self):
+        self.progress += 1
+        if self.progress == 1:
+            raise ConnectionError("reconnecting")
+
+    async def ack(self):
+        self.acks += 1
+
+
+class _OneShotSub:
+    def __init__(self, msg):
+        self.msgs = [msg]
+
+    async def fetch(self, batch, timeout, heartbeat=None):
+        if not self.msgs:
+            await asyncio.sleep(timeout)
+            raise FetchTimeoutError
+        return [self.msgs.pop()]
+
+    async def unsubscribe(self):
+        pass
+
+
+async def test_keep_alive_survives_in_progress_errors_and_stops_after_ack():
+    msg = _FlakyMsg()
+    done = asyncio.Event()
+    progress_at_ack = None
+
+    async def callback(received):
+        nonlocal progress_at_ack
+        await asyncio.sleep(0.2)
+        await received.ack()
+        progress_at_ack = msg.progress
+        await asyncio.sleep(0.15)  # После ack in_progress больше не отправляется
+        done.set()
+
+    consumer = PullConsumer(_OneShotSub(msg), callback, PullSettings(progress_interval=0.04, flow=None))
+    task = asyncio.create_task(consumer.run())
+    await asyncio.wait_for(done.wait(), 2)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    # Первый in_progress упал, следующие всё равно отправлялись
+    assert progress_at_ack >= 3 and msg.progress == progress_at_ack
+    assert msg.acks == 1
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+from dishka import FromDishka, Provider, Scope, make_async_container, provide
+from faststream import FastStream
+
+from src.main.injection import PrecompiledInjector, setup_injection
+
+
+class Settings:
+    pass
+
+
+class SlowProvider(Provider):
+    calls = 0
+
+    @provide(scope=Scope.APP)
+    async def settings(self) -> Settings:
+        SlowProvider.calls += 1
+        await asyncio.sleep(0.01)
+        return Settings()
+
+
+async def handler(value: int, settings: FromDishka[Settings]) -> tuple[int, Settings]:
+    return value, settings
+
+
+async def test_concurrent_first_calls_share_one_resolution():
+    SlowProvider.calls = 0
+    container = make_async_container(SlowProvider())
+    injector = PrecompiledInjector(container)
+    injected = injector.inject(handler)
+    # Первые сообщения приходят одновременно, до after_startup
+    results = await asyncio.gather(*(injected(i) for i in range(5)))
+    assert [value for value, _ in results] == list(range(5))
+    assert len({id(settings) for _, settings in results}) == 1
+    assert SlowProvider.calls == 1 and not injector.pending
+    await container.close()
+
+
+def test_setup_injection_requires_call_decorators():
+    class Broker:
+        pass
+
+    app = FastStream(Broker(), logger=None)
+    with pytest.raises(RuntimeError):
+        setup_injection(make_async_container(SlowProvider()), app)
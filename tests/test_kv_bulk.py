@@ -0,0 +1,21 @@
+async def test_put_many_and_get_many(kv_client):
+    client = await kv_client()
+    revisions = await client.put_many({f"k{i}": i for i in range(50)})
+    assert len(set(revisions.values())) == 50
+    await client.kv.delete("k3")
+    found = await client.get_many(["k1", "k3", "missing", "k49"])
+    await client.disconnect()
+    assert found == {"k1": 1, "k49": 49}
+
+
+async def test_snapshot_by_prefix(kv_client):
+    client = await kv_client()
+    await client.put_many([("a.1", 1), ("a.2", 2), ("ab", 3), ("b.1", 4)])
+    await client.kv.delete("a.2")
+    by_token = await client.snapshot("a.")
+    by_string = await client.snapshot("a")
+    everything = await client.snapshot()
+    await client.disconnect()
+    assert by_token == {"a.1": 1}
+    assert by_string == {"a.1": 1, "ab": 3}
+    assert everything == {"a.1": 1, "ab": 3, "b.1": 4}
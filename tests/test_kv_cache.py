@@ -0,0 +1,43 @@
+from src.main.new_app.kv_cache import MISSING, KVCache
+from src.main.new_app.serialization import get_codec
+from tests.helpers import eventually
+
+codec = get_codec()
+
+
+def test_older_revision_is_ignored():
+    cache = KVCache(codec.decode, max_size=2)
+    cache.put("a", codec.encode(2), 2)
+    assert not cache.put("a", codec.encode(1), 1)
+    assert cache.get("a") == 2
+    cache.delete("a", 3)
+    assert cache.get("a") is MISSING
+    assert not cache.put("a", codec.encode(1), 2)
+
+
+def test_lru_eviction():
+    cache = KVCache(codec.decode, max_size=2)
+    for i, key in enumerate("abc"):
+        cache.put(key, codec.encode(i), i + 1)
+    assert "a" not in cache and "c" in cache
+    assert cache.stats.evictions == 1
+
+
+def test_mutating_a_read_does_not_change_the_cache():
+    cache = KVCache(codec.decode)
+    cache.put("a", codec.encode({"n": [1]}), 1, value={"n": [1]})
+    cache.get("a")["n"].append(2)
+    assert cache.get("a") == {"n": [1]}
+
+
+async def test_client_cache_follows_the_bucket(kv_client):
+    client = await kv_client(cache_size=16)
+    writer = await kv_client()
+    await writer.put_value("k", {"v": 1})
+    value = await client.get_value("k")
+    value["v"] = 100  # Вызывающий меняет полученный объект
+    assert client.cached_value("k") == {"v": 1}
+    await writer.put_value("k", {"v": 2})
+    await eventually(lambda: client.cached_value("k") == {"v": 2})
+    await writer.disconnect()
+    await client.disconnect()
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from nats.js.errors import KeyWrongLastSequenceError
+
+from src.main.new_app.metrics import Metrics
+
+
+async def test_unconditional_writes_merge(kv_client):
+    # Интервал больше длительности теста: записи уходят только по flush()
+    client = await kv_client(coalesce=60, metrics=Metrics())
+    for i in range(5):
+        await client.put_value("k", i)
+    revisions = await client.flush()
+    info = await client.js.stream_info("KV_B")
+    await client.disconnect()
+    assert revisions == {"k": 1} and info.state.messages == 1
+    assert client.metrics.snapshot()[f'nats_kv_coalesced_writes_total{{client="{client.name}"}}'] == 4
+
+
+async def test_conditional_write_after_a_pending_put_conflicts(kv_client):
+    client = await kv_client(coalesce=60, metrics=Metrics())
+    revision = await client.kv.put("k", client.codec.encode(0))
+    await client.put_value("k", 1)
+    # Ревизия прочитана до put_value: без буфера запись получила бы конфликт
+    update = asyncio.ensure_future(client.update_value("k", 2, revision))
+    await asyncio.sleep(0)
+    await client.flush()
+    with pytest.raises(KeyWrongLastSequenceError):
+        await update
+    value = await client.get_value("k")
+    await client.disconnect()
+    assert value == 1
+
+
+async def test_put_after_a_pending_conditional_write_keeps_both(kv_client):
+    client = await kv_client(coalesce=60, metrics=Metrics())
+    revision = await client.kv.put("k", client.codec.encode(0))
+    update = asyncio.ensure_future(client.update_value("k", 1, revision))
+    second = asyncio.ensure_future(client.update_value("k", 2, revision))
+    await asyncio.sleep(0)
+    await client.put_value("k", 3)
+    await client.flush()
+    assert await update == revision + 1
+    # Вторая условная запись с той же ревизией не сливается с первой
+    with pytest.raises(KeyWrongLastSequenceError):
+        await second
+    entry = await client.kv.get("k")
+    await client.disconnect()
+    assert (client.codec.decode(entry.value), entry.revision) == (3, revision + 2)
+
+
+async def test_bulk_operations_see_pending_writes(kv_client):
+    client = await kv_client(coalesce=60, metrics=Metrics())
+    await client.kv.put("a.2", client.codec.encode(2))
+    await client.put_value("a.1", 10)
+    await client.put_value("a.3", 3)
+    assert await client.get_many(["a.1", "a.2", "a.3"]) == {"a.1": 10, "a.2": 2, "a.3": 3}
+    assert await client.snapshot("a.") == {"a.1": 10, "a.2": 2, "a.3": 3}
+    # put_many идёт через тот же буфер: накопленное значение не перепишет его
+    put_many = asyncio.ensure_future(client.put_many({"a.3": 30}))
+    await asyncio.sleep(0)
+    await client.flush()
+    revisions = await put_many
+    value = (await client.kv.get("a.3")).value
+    await client.disconnect()
+    assert list(revisions) == ["a.3"] and client.codec.decode(value) == 30
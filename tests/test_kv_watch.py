@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from nats.js.api import DeliverPolicy
+
+from src.main.new_app.kv_watch import WatchManager, subject_matches
+from src.main.new_app.nats_app import NATSKeyValueClient
+from tests.helpers import eventually
+
+
+def test_subject_matches():
+    assert subject_matches("a.*", "a.b")
+    assert not subject_matches("a.*", "a.b.c")
+    assert subject_matches("a.>", "a.b.c")
+    assert not subject_matches("a.>", "a")
+
+
+async def test_watches_share_one_consumer_and_filter_keys(kv_client):
+    client = await kv_client()
+    users, orders = [], []
+    await client.watch_bucket("B", lambda e: _append(users, e), keys="user.*")
+    await client.watch_bucket("B", lambda e: _append(orders, e), keys="order.>")
+    await client.put_value("user.1", 1)
+    await client.put_value("order.1.item", 2)
+    await eventually(lambda: users and orders)
+    assert len(client.watcher.buckets) == 1
+    await client.disconnect()
+    assert [e.key for e in users] == ["user.1"]
+    assert [e.key for e in orders] == ["order.1.item"]
+
+
+async def test_late_watch_gets_each_key_in_order(kv_client):
+    client = await kv_client()
+    await client.watch_bucket("B", lambda e: _noop())
+    await client.put_many({f"k{i}": 0 for i in range(50)})
+    await eventually(lambda: client.watcher.revision("B") == 50)
+    seen, writes = [], []
+
+    async def late(event):
+        if not writes:
+            # Новые значения пишутся, пока подписчику ещё отдаются текущие
+            writes.append(asyncio.create_task(client.put_many({f"k{i}": 1 for i in range(50)})))
+        if event.revision <= 50:
+            await asyncio.sleep(0.001)  # Медленно отдаются только текущие значения
+        seen.append((event.key, event.revision))
+
+    await client.watch_bucket("B", late)
+    await writes[0]
+    await eventually(lambda: client.watcher.revision("B") == 100)
+    await asyncio.sleep(0.05)
+    await client.disconnect()
+    assert len(seen) == 100
+    by_key = {}
+    for key, revision in seen:
+        by_key.setdefault(key, []).append(revision)
+    for revisions in by_key.values():
+        assert revisions == sorted(set(revisions))
+
+
+async def test_conflicting_policy_for_existing_bucket_is_rejected(kv_client):
+    client = await kv_client()
+    await client.watch_bucket("B", lambda e: _noop(), deliver_policy=DeliverPolicy.ALL)
+    await client.watch_bucket("B", lambda e: _noop())  # Без своей политики - подключается к существующей
+    with pytest.raises(ValueError):
+        await client.watch_bucket("B", lambda e: _noop(), deliver_policy=DeliverPolicy.NEW)
+    with pytest.raises(ValueError):
+        await client.watch_bucket("B", lambda e: _noop(), from_revision=5)
+    await client.disconnect()
+
+
+async def test_disconnect_without_connect(server):
+    await NATSKeyValueClient(transport=server).disconnect()
+
+
+async def test_manager_close_stops_consumers(kv_client):
+    client = await kv_client()
+    manager = WatchManager(client.js)
+    watch = await manager.watch("B", lambda e: _noop())
+    await watch.stop()
+    assert not manager.buckets
+    await manager.close()
+    await client.disconnect()
+
+
+async def _append(events, event):
+    events.append(event)
+
+
+async def _noop():
+    pass
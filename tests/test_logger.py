@@ -0,0 +1,72 @@
+import logging
+import threading
+
+import structlog
+
+from src.infrastructure.logger.handlers import BLOCK_POLICY, DROP_POLICY, LogQueue, QueueBoundLogger
+
+
+class _Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records: list[logging.LogRecord] = []
+        self.threads: set[str] = set()
+
+    def emit(self, record):
+        self.records.append(record)
+        self.threads.add(threading.current_thread().name)
+
+
+def _queued_logger(name: str, log_queue: LogQueue, target: logging.Handler) -> logging.Logger:
+    std_logger = logging.getLogger(name)
+    std_logger.handlers = [log_queue.handler([target])]
+    std_logger.setLevel(logging.DEBUG)
+    std_logger.propagate = False
+    return std_logger
+
+
+def test_records_are_written_by_the_writer_thread():
+    log_queue = LogQueue(maxsize=100)
+    target = _Collect()
+    std_logger = _queued_logger("test.queue.writer", log_queue, target)
+    log_queue.start()
+    for i in range(10):
+        std_logger.info("record %s", i)
+    log_queue.stop()
+    assert [record.getMessage() for record in target.records] == [f"record {i}" for i in range(10)]
+    assert target.threads == {"log-writer"}
+    assert log_queue.written == 10
+
+
+def test_full_queue_drops_records():
+    log_queue = LogQueue(maxsize=3, policy=DROP_POLICY)
+    target = _Collect()
+    std_logger = _queued_logger("test.queue.drop", log_queue, target)
+    for i in range(5):  # Поток записи не запущен: очередь переполняется
+        std_logger.info("record %s", i)
+    assert log_queue.dropped == 2
+    log_queue.start()
+    log_queue.stop()
+    assert len(target.records) == 3
+
+
+async def test_queue_bound_logger_logs_in_place():
+    log_queue = LogQueue(maxsize=100, policy=BLOCK_POLICY)
+    target = _Collect()
+    std_logger = _queued_logger("test.queue.async", log_queue, target)
+    logger = structlog.wrap_logger(
+        std_logger,
+        wrapper_class=QueueBoundLogger,
+        processors=[structlog.processors.KeyValueRenderer(key_order=["event"])],
+    )
+    await logger.ainfo("hello", user=1)
+    try:
+        raise RuntimeError("boom")
+    except RuntimeError:
+        await logger.aexception("failed")
+    # Запись уже в очереди: без перехода в пул потоков
+    assert log_queue.queue.qsize() == 2
+    log_queue.start()
+    log_queue.stop()
+    assert target.records[0].getMessage() == "event='hello' user=1"
+    assert target.records[1].exc_info[0] is RuntimeError
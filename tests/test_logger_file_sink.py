@@ -0,0 +1,77 @@
+import glob
+import gzip
+import logging
+
+from src.infrastructure.logger.handlers import BufferedRotatingFileHandler, FileSink, RenderOnceFormatter
+
+
+def _record(message: str, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.LogRecord("test", level, __file__, 1, message, None, None)
+
+
+def _handler(tmp_path, **settings) -> BufferedRotatingFileHandler:
+    handler = BufferedRotatingFileHandler(FileSink(filename=str(tmp_path / "app.log"), **settings))
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    return handler
+
+
+def test_records_are_buffered_until_flush(tmp_path):
+    handler = _handler(tmp_path, buffer_records=10, flush_interval=60)
+    for i in range(3):
+        handler.emit(_record(f"line {i}"))
+    assert (tmp_path / "app.log").read_text() == ""
+    handler.flush()
+    assert (tmp_path / "app.log").read_text() == "line 0\nline 1\nline 2\n"
+    handler.close()
+
+
+def test_errors_are_written_immediately(tmp_path):
+    handler = _handler(tmp_path, buffer_records=10, flush_interval=60)
+    handler.emit(_record("info"))
+    handler.emit(_record("error", logging.ERROR))
+    assert (tmp_path / "app.log").read_text() == "info\nerror\n"
+    handler.close()
+
+
+def test_rotation_by_size_compresses_and_prunes(tmp_path):
+    handler = _handler(tmp_path, max_bytes=100, backup_count=2, buffer_records=1, flush_interval=60)
+    for i in range(20):
+        handler.emit(_record(f"{i:02d}" + "x" * 40))
+    handler.close()
+    assert handler.rotations >= 5
+    segments = sorted(glob.glob(str(tmp_path / "app.log.*")))
+    # Сжатие в фоне дождались в close(): остались только последние сжатые сегменты
+    assert len(segments) == 2
+    assert all(segment.endswith(".gz") for segment in segments)
+    with gzip.open(segments[-1], "rt") as file:
+        lines = file.read().splitlines()
+    assert lines and all(len(line) == 42 for line in lines)
+
+
+def test_rotation_by_time(tmp_path):
+    handler = _handler(tmp_path, max_bytes=0, rotate_interval=0.05, compress=False, flush_interval=0.02)
+    handler.emit(_record("first"))
+    handler._opened_at -= 1  # Файл открыт "давно": следующая запись ротирует его
+    handler.emit(_record("second", logging.ERROR))
+    handler.close()
+    assert handler.rotations == 1
+    [segment] = glob.glob(str(tmp_path / "app.log.*"))
+    with open(segment) as file:
+        assert file.read() == "first\nsecond\n"
+
+
+def test_shared_formatter_renders_once():
+    calls = []
+
+    def renderer(logger, method_name, event_dict):
+        calls.append(event_dict["event"])
+        return event_dict["event"]
+
+    formatter = RenderOnceFormatter(processor=renderer)
+    record = _record("hello")
+    # Консоль и файл с одним форматтером: вторая запись берёт готовую строку
+    assert formatter.format(record) == formatter.format(record) == "hello"
+    assert calls == ["hello"]
+    # Другой форматтер не подхватывает чужой результат
+    assert RenderOnceFormatter(processor=renderer).format(record) == "hello"
+    assert calls == ["hello", "hello"]
@@ -0,0 +1,53 @@
+import logging
+
+import structlog
+
+from src.infrastructure.logger.profiles import GatedCallsite, LevelGatedBoundLogger
+
+
+class _Capture:
+    def __init__(self):
+        self.events: list[dict] = []
+
+    def __call__(self, logger, method_name, event_dict):
+        self.events.append(dict(event_dict))
+        raise structlog.DropEvent
+
+
+def _logger(name: str, level: int, processors: list):
+    std_logger = logging.getLogger(name)
+    std_logger.setLevel(level)
+    std_logger.propagate = False
+    return structlog.wrap_logger(std_logger, wrapper_class=LevelGatedBoundLogger, processors=processors)
+
+
+async def test_records_below_level_skip_processors():
+    capture = _Capture()
+    logger = _logger("test.profiles.gate", logging.WARNING, [capture])
+
+    logger.debug("hidden")
+    logger.info("hidden")
+    logger.log(logging.INFO, "hidden")
+    logger.warning("shown")
+    logger.log(logging.ERROR, "shown")
+    await logger.ainfo("hidden")
+    await logger.awarning("shown")
+    assert [event["event"] for event in capture.events] == ["shown"] * 3
+
+
+def test_callsite_is_captured_from_warning_or_for_listed_loggers():
+    capture = _Capture()
+    callsite = GatedCallsite(loggers=["test.profiles.always"], min_level=logging.WARNING)
+    quiet = _logger("test.profiles.quiet", logging.DEBUG, [callsite, capture])
+    always = _logger("test.profiles.always", logging.DEBUG, [callsite, capture])
+
+    quiet.info("no callsite")
+    quiet.warning("callsite")
+    always.info("callsite")
+
+    assert "logger" not in capture.events[0]
+    name = test_callsite_is_captured_from_warning_or_for_listed_loggers.__name__
+    for event in capture.events[1:]:
+        filename, func_name, lineno = event["logger"].split(":")
+        assert (filename, func_name) == ("test_logger_profiles.py", name)
+        assert int(lineno) > 0
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+from nats.errors import TimeoutError as NATSTimeoutError
+from nats.js.api import AckPolicy, ConsumerConfig, DeliverPolicy
+from nats.js.errors import KeyNotFoundError, KeyWrongLastSequenceError, NotFoundError
+
+
+async def test_clients_share_the_server_and_dedup_by_msg_id(memory_js):
+    _, first = await memory_js()
+    _, second = await memory_js()
+    await first.add_stream(name="S", subjects=["s.>"])
+    ack = await first.publish("s.1", b"a", headers={"Nats-Msg-Id": "1"})
+    again = await second.publish("s.1", b"a", headers={"Nats-Msg-Id": "1"})
+    assert ack.seq == 1 and not ack.duplicate
+    assert again.seq == 1 and again.duplicate
+    info = await second.stream_info("S")
+    assert (info.state.messages, info.state.last_seq) == (1, 1)
+    with pytest.raises(NotFoundError):
+        await first.stream_info("missing")
+
+
+async def test_stream_limits(memory_js):
+    _, js = await memory_js()
+    await js.add_stream(name="S", subjects=["s.>"], max_msgs=3, max_msgs_per_subject=1)
+    for i in range(3):
+        await js.publish("s.a", str(i).encode())
+    for subject in ("s.b", "s.c", "s.d"):
+        await js.publish(subject, b"x")
+    info = await js.stream_info("S")
+    assert (info.state.messages, info.state.first_seq, info.state.last_seq) == (3, 4, 6)
+
+
+async def test_pull_consumer_acks_naks_and_redelivers_after_ack_wait(memory_js):
+    _, js = await memory_js()
+    await js.add_stream(name="S", subjects=["s.>"])
+    for i in range(3):
+        await js.publish("s.x", str(i).encode())
+    sub = await js.pull_subscribe("s.>", durable="C", config=ConsumerConfig(ack_wait=0.2, max_deliver=2))
+    first, second, third = await sub.fetch(3, timeout=1)
+    await first.ack()
+    await second.nak()
+    [redelivered] = await sub.fetch(1, timeout=1)
+    assert redelivered.data == b"1" and redelivered.metadata.num_delivered == 2
+    await redelivered.ack()
+    # third не подтверждён: вернётся после ack_wait
+    [late] = await sub.fetch(1, timeout=1)
+    assert late.data == b"2" and late.metadata.num_delivered == 2
+    # max_deliver исчерпан: больше не доставляется
+    with pytest.raises(NATSTimeoutError):
+        await sub.fetch(1, timeout=0.4)
+    info = await sub.consumer_info()
+    assert info.num_pending == 0
+
+
+async def test_ack_policy_all_acks_everything_before(memory_js):
+    _, js = await memory_js()
+    await js.add_stream(name="S", subjects=["s.>"])
+    for i in range(5):
+        await js.publish("s.x", str(i).encode())
+    sub = await js.pull_subscribe("s.>", durable="C", config=ConsumerConfig(ack_policy=AckPolicy.ALL))
+    msgs = await sub.fetch(5, timeout=1)
+    await msgs[3].ack()
+    info = await sub.consumer_info()
+    assert info.num_ack_pending == 1
+
+
+async def test_push_subscription_delivers_new_messages_in_order(memory_js):
+    _, js = await memory_js()
+    await js.add_stream(name="S", subjects=["s.>"])
+    await js.publish("s.old", b"old")
+    received = []
+
+    async def callback(msg):
+        received.append(msg.data)
+
+    await js.subscribe("s.>", cb=callback, config=ConsumerConfig(deliver_policy=DeliverPolicy.NEW))
+    for i in range(10):
+        await js.publish("s.new", str(i).encode())
+    for _ in range(100):
+        if len(received) == 10:
+            break
+        await asyncio.sleep(0.01)
+    assert received == [str(i).encode() for i in range(10)]
+
+
+async def test_key_value_revisions(memory_js):
+    _, js = await memory_js()
+    kv = await js.create_key_value(bucket="B", history=5)
+    first = await kv.put("a", b"1")
+    second = await kv.update("a", b"2", last=first)
+    with pytest.raises(KeyWrongLastSequenceError):
+        await kv.update("a", b"3", last=first)
+    assert (await kv.get("a")).value == b"2"
+    assert (await kv.get("a", revision=first)).value == b"1"
+    await kv.delete("a")
+    with pytest.raises(KeyNotFoundError):
+        await kv.get("a")
+    assert await kv.create("a", b"again") > second
+    assert [entry.value for entry in await kv.history("a")] == [b"1", b"2", b"", b"again"]
+    await kv.put("b.c", b"x")
+    assert sorted(await kv.keys()) == ["a", "b.c"]
+    assert await kv.keys(filters=["b.*"]) == ["b.c"]
+
+
+async def test_key_value_watch(memory_js):
+    _, js = await memory_js()
+    kv = await js.create_key_value(bucket="B")
+    await kv.put("a", b"1")
+    watcher = await kv.watchall()
+    initial = await watcher.updates(timeout=1)
+    assert (initial.key, initial.value) == ("a", b"1")
+    assert await watcher.updates(timeout=1) is None  # Конец начальных значений
+    await kv.put("b", b"2")
+    update = await watcher.updates(timeout=1)
+    assert (update.key, update.value) == ("b", b"2")
+    await watcher.stop()
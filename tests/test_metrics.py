@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+from nats.js.errors import KeyNotFoundError
+
+from src.main.new_app.consumer import PullConsumer, PullSettings
+from src.main.new_app.metrics import Histogram, Metrics, serve_metrics
+from src.main.new_app.partition import Partitioner, PartitionSettings, by_token
+
+
+def test_histogram_percentiles_are_within_bucket_error():
+    histogram = Histogram()
+    for i in range(1, 1001):
+        histogram.record(i / 1000)
+    assert abs(histogram.percentile(50) - 0.5) / 0.5 < 0.04
+    assert abs(histogram.percentile(99) - 0.99) / 0.99 < 0.04
+    assert histogram.percentile(100) == 1.0
+    assert histogram.cumulative()[-1] == (10, 1000)
+
+
+def test_prometheus_text():
+    metrics = Metrics()
+    metrics.counter("requests_total", "Requests", client="a").inc(3)
+    metrics.histogram("latency_seconds", "Latency").record(0.002)
+    text = metrics.render_prometheus()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{client="a"} 3' in text
+    assert 'latency_seconds_bucket{le="0.0025"} 1' in text
+    assert "latency_seconds_count 1" in text
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics()
+    metrics.counter("keys_total", key='a\\b"c\nd').inc()
+    assert 'keys_total{key="a\\\\b\\"c\\nd"} 1' in metrics.render_prometheus()
+
+
+async def test_publish_series_carry_the_client_label(stream_client):
+    metrics = Metrics()
+    first = await stream_client(metrics=metrics, name="orders")
+    second = await stream_client(metrics=metrics)
+    for client in (first, second):
+        await client.publish("s.a", {"n": 1})
+    snapshot = metrics.snapshot()
+    assert snapshot['nats_publish_ack_seconds{client="orders"}']["count"] == 1
+    assert snapshot[f'nats_publish_ack_seconds{{client="{second.name}"}}']["count"] == 1
+    assert second.name != first.name
+
+
+async def test_kv_client_series_are_labeled_and_collector_is_removed(kv_client):
+    metrics = Metrics()
+    first = await kv_client(cache_size=10, metrics=metrics, name="orders")
+    second = await kv_client(cache_size=10, metrics=metrics)
+    with pytest.raises(KeyNotFoundError):
+        await first.get_value("missing")
+    snapshot = metrics.snapshot()
+    assert snapshot['nats_kv_cache_misses_total{client="orders",bucket="B"}'] == 1
+    assert snapshot[f'nats_kv_cache_misses_total{{client="{second.name}",bucket="B"}}'] == 0
+    assert second.name != first.name
+    text = metrics.render_prometheus()
+    assert "# TYPE nats_kv_cache_misses_total counter" in text
+    assert "# TYPE nats_kv_cache_size gauge" in text
+    await first.disconnect()
+    await second.disconnect()
+    assert metrics.collectors == []
+
+
+async def test_consumer_and_partitioner_collectors_are_removed(kv_client):
+    metrics = Metrics()
+    client = await kv_client()
+    await client.js.add_stream(name="S", subjects=["s.>"])
+    sub = await client.js.pull_subscribe("s.>", durable="C")
+
+    async def callback(msg):
+        await msg.ack()
+
+    partitioner = Partitioner(callback, PartitionSettings(by_token(1)), metrics)
+    first = PullConsumer(sub, partitioner, PullSettings(), metrics)
+    second = PullConsumer(sub, partitioner, PullSettings(), metrics)
+    # Консюмеры без имени не сливаются в одну серию consumer=""
+    assert len({first.name, second.name, partitioner.name}) == 3 and "" not in {first.name, second.name}
+    task = asyncio.create_task(first.run())
+    await asyncio.sleep(0.05)
+    assert len(metrics.collectors) == 3
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await partitioner.close()
+    assert metrics.collectors == [second._flow_metrics]
+    await client.disconnect()
+
+
+async def test_metrics_endpoint_listens_on_localhost_by_default():
+    metrics = Metrics()
+    metrics.counter("up").inc()
+    server = await serve_metrics(metrics, port=0)
+    host, port = server.sockets[0].getsockname()[:2]
+    assert host == "127.0.0.1"
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b"GET /metrics HTTP/1.1\r\nHost: x\r\n\r\n")
+    response = await reader.read()
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    assert response.startswith(b"HTTP/1.1 200 OK") and response.endswith(b"up 1\n")
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import threading
+
+import pytest
+from faststream.nats import NatsBroker, NatsRouter, TestNatsBroker
+
+from src.main.new_app.offload import PROCESS, THREAD, Offload, offloaded
+from src.main.new_app.serialization import Codec
+
+PROCESSES = Offload(PROCESS, workers=1)
+router = NatsRouter()
+
+
+class UpperCodec(Codec):
+    """Не зарегистрирован в CODECS: доходит до пула только как экземпляр."""
+
+    name = "upper"
+
+    def encode(self, obj):
+        return obj.encode()
+
+    def decode(self, data, schema=None):
+        return bytes(data).decode().upper()
+
+
+def where(payload):
+    return payload, os.getpid(), threading.current_thread().name
+
+
+# Под декоратором подписчика атрибут модуля - HandlerCallWrapper FastStream, а не функция
+@router.subscriber("offload.process")
+@offloaded(PROCESSES)
+def handle(data: str) -> str:
+    return f"{data}:{os.getpid()}"
+
+
+async def test_offloaded_handler_runs_in_a_process():
+    broker = NatsBroker()
+    broker.include_router(router)
+    async with TestNatsBroker(broker):
+        try:
+            response = await broker.publish("abc", "offload.process", rpc=True)
+        finally:
+            PROCESSES.shutdown()
+    data, pid = response.split(":")
+    assert data == "abc" and int(pid) != os.getpid()
+
+
+def test_offloaded_rejects_local_functions():
+    with pytest.raises(TypeError):
+        @offloaded(PROCESSES)
+        def local(data):
+            return data
+
+
+@pytest.mark.parametrize("mode", [THREAD, PROCESS])
+async def test_custom_codec_instance_is_used_in_the_pool(mode):
+    offload = Offload(mode, workers=1)
+    try:
+        payload, pid, thread = await offload.call(where, UpperCodec(), None, b"hello")
+    finally:
+        offload.shutdown()
+    assert payload == "HELLO"
+    if mode == PROCESS:
+        assert pid != os.getpid()
+    else:
+        assert thread.startswith("offload")
+
+
+def test_unpicklable_callback_is_rejected_for_processes():
+    offload = Offload(PROCESS)
+    with pytest.raises(TypeError):
+        offload.check(lambda payload: payload)
+    offload.check(where, UpperCodec())
+
+
+async def test_subscription_offloads_with_the_client_codec(stream_client):
+    client = await stream_client(codec=UpperCodec())
+    results = []
+    offload = Offload(THREAD, workers=2)
+    await client.add_subscription("s.>", "C", lambda payload: results.append(payload), offload=offload)
+    await client.publish("s.1", "hi")
+    for _ in range(200):
+        if results:
+            break
+        await asyncio.sleep(0.01)
+    await client.disconnect()
+    offload.shutdown()
+    assert results == ["HI"]
@@ -0,0 +1,85 @@
+import asyncio
+import types
+
+from src.main.new_app.consumer import PullSettings
+from src.main.new_app.flow import AdaptiveLimit, SlotLease, current_lease
+from src.main.new_app.partition import PartitionSettings, Partitioner, by_field, by_token
+from src.main.new_app.serialization import JsonCodec
+from tests.helpers import eventually
+
+
+async def test_same_key_in_order_and_hot_key_does_not_starve_others(stream_client):
+    client = await stream_client()
+    partition = PartitionSettings(by_field("key"), lanes=4)
+    probe = Partitioner(None, partition)
+    cold = next(f"c{i}" for i in range(100) if probe.lane(f"c{i}") != probe.lane("hot"))
+    done = []
+
+    async def callback(msg):
+        if msg.payload["key"] == "hot":
+            await asyncio.sleep(0.02)
+        done.append((msg.payload["key"], msg.payload["n"]))
+        await msg.ack()
+
+    # Начальный адаптивный лимит - 5 слотов на 4 полосы
+    await client.add_subscription("s.a", "D", callback, settings=PullSettings(max_in_flight=10), partition=partition)
+    await client.publish_many("s.a", [{"key": "hot", "n": n} for n in range(20)] + [{"key": cold, "n": 0}])
+    await eventually(lambda: len(done) == 21, timeout=5)
+    await client.disconnect()
+    assert [n for key, n in done if key == "hot"] == list(range(20))
+    # Сообщение другого ключа не ждёт, пока разойдётся очередь горячего
+    assert done.index((cold, 0)) < 5
+
+
+async def test_lane_wait_releases_the_slot_and_is_not_latency():
+    limit = AdaptiveLimit(10)
+    partitioner = Partitioner(lambda msg: asyncio.sleep(0.05), PartitionSettings(by_token(1), lanes=2))
+
+    async def handle(lease: SlotLease):
+        current_lease.set(lease)
+        await partitioner(types.SimpleNamespace(subject="s.k"))
+
+    leases = []
+    for _ in range(2):
+        await limit.acquire()
+        leases.append(SlotLease(limit))
+    await asyncio.gather(*(handle(lease) for lease in leases))
+    await partitioner.close()
+    assert limit.in_use == 0 and not any(lease.held for lease in leases)
+    # Второе сообщение ключа ждало первое в полосе
+    assert leases[0].waited < 0.02 <= 0.04 < leases[1].waited
+
+
+class CountingJson(JsonCodec):
+    decoded = 0
+
+    def decode(self, data, schema=None):
+        CountingJson.decoded += 1
+        return super().decode(data, schema)
+
+
+def collect(payload):
+    return payload
+
+
+async def test_by_field_uses_the_client_codec_and_decodes_once(stream_client):
+    CountingJson.decoded = 0
+    client = await stream_client(codec=CountingJson())
+    done = []
+
+    async def callback(msg):
+        done.append((msg.payload["key"], msg.payload["n"]))
+        await msg.ack()
+
+    partition = PartitionSettings(by_field("key"), lanes=2)
+    await client.add_subscription("s.a", "A", callback, partition=partition)
+    # С offload ключ тоже читается из payload, а в пул уходят сырые байты
+    await client.add_subscription("s.b", "B", collect, offload="thread", partition=partition)
+    await client.publish_many("s.a", [{"key": n % 3, "n": n} for n in range(12)])
+    await eventually(lambda: len(done) == 12)
+    assert CountingJson.decoded == 12
+    await client.publish_many("s.b", [{"key": n % 3, "n": n} for n in range(6)])
+    await eventually(lambda: sum(client.partitioners[1].processed) == 6)
+    await client.disconnect()
+    for key in range(3):
+        assert [n for k, n in done if k == key] == list(range(key, 12, 3))
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from src.main.new_app.pool import LEAST_LOADED, ConnectionPool
+
+
+def test_invalid_settings():
+    with pytest.raises(ValueError):
+        ConnectionPool(0)
+    with pytest.raises(ValueError):
+        ConnectionPool(2, "random")
+
+
+async def test_hash_routing_is_stable_and_spreads_subjects(connection_pool):
+    pool = await connection_pool(4)
+    picks = {f"s.{i}": pool.pick(f"s.{i}").index for i in range(100)}
+    assert picks == {subject: pool.pick(subject).index for subject in picks}
+    assert len(set(picks.values())) == 4
+    await pool.close()
+
+
+async def test_down_member_share_goes_to_the_next_one(connection_pool):
+    pool = await connection_pool(3)
+    subject = next(f"s.{i}" for i in range(100) if pool.pick(f"s.{i}").index == 1)
+    pool.members[1].connected = False
+    assert pool.pick(subject).index == 2
+    ack = await pool.publish(subject, b"x")
+    assert ack.seq == 1
+    await pool.close()
+    assert not any(member.connected for member in pool.members)
+
+
+async def test_least_loaded_picks_the_idle_member(connection_pool):
+    pool = await connection_pool(3, LEAST_LOADED)
+    pool.members[0].in_flight = 5
+    pool.members[1].in_flight = 1
+    pool.members[2].in_flight = 3
+    assert pool.pick("s.a").index == 1
+    pool.members[1].connected = False
+    assert pool.pick("s.a").index == 2
+    await pool.close()
+
+
+async def test_publishes_through_all_members_keep_per_subject_order(connection_pool):
+    pool = await connection_pool(4)
+    await asyncio.gather(*(pool.publish(f"s.{i % 8}", str(i).encode()) for i in range(80)))
+    await pool.flush()
+    assert all(member.in_flight == 0 for member in pool.members)
+    sub = await pool.primary.js.pull_subscribe("s.>", durable="C")
+    msgs = await sub.fetch(80, timeout=1)
+    for subject in {msg.subject for msg in msgs}:
+        values = [int(msg.data) for msg in msgs if msg.subject == subject]
+        assert values == sorted(values)
+    await pool.close()
+
+
+async def test_kv_client_spreads_keys_over_the_pool(kv_client):
+    client = await kv_client(pool_size=3)
+    assert len(client.kvs) == 3
+    await client.put_many({f"k{i}": i for i in range(30)})
+    assert await client.get_many([f"k{i}" for i in range(30)]) == {f"k{i}": i for i in range(30)}
+    await client.disconnect()
@@ -0,0 +1,59 @@
+from nats.errors import TimeoutError as NATSTimeoutError
+
+
+async def test_retry_after_timeout_does_not_duplicate(stream_client):
+    client = await stream_client(publish_dedup=True)
+    send = client.pool.publish
+    calls = 0
+
+    async def lossy_send(subject, data, **kwargs):
+        # Сообщение сохранено, но PubAck потерялся
+        nonlocal calls
+        calls += 1
+        ack = await send(subject, data, **kwargs)
+        if calls == 1:
+            raise NATSTimeoutError
+        return ack
+
+    client.pipeline.send = lossy_send
+    client.pipeline.retry_backoff = 0
+    result = await (await client.pipeline.submit("s.a", b"x"))
+    info = await client.js.stream_info("S")
+    await client.disconnect()
+    assert result.ok and result.attempts == 2
+    assert result.ack.duplicate
+    assert info.state.messages == 1
+
+
+async def test_window_bounds_pending_publishes(stream_client):
+    client = await stream_client(publish_window=8)
+    peak = 0
+    send = client.pipeline.send
+
+    async def tracking_send(subject, data, **kwargs):
+        nonlocal peak
+        peak = max(peak, client.pipeline.in_flight)
+        return await send(subject, data, **kwargs)
+
+    client.pipeline.send = tracking_send
+    results = await client.publish_many("s.a", range(100))
+    await client.disconnect()
+    assert all(result.ok for result in results)
+    assert peak <= 8
+
+
+async def test_msg_id_is_added_only_with_dedup(stream_client):
+    headers = {}
+    for dedup in (False, True):
+        client = await stream_client(publish_dedup=dedup)
+        send = client.pipeline.send
+
+        async def recording_send(subject, data, **kwargs):
+            headers[dedup] = kwargs.get("headers")
+            return await send(subject, data, **kwargs)
+
+        client.pipeline.send = recording_send
+        await (await client.pipeline.submit("s.a", b"x"))
+        await client.disconnect()
+    assert headers[False] is None
+    assert "Nats-Msg-Id" in headers[True]
@@ -0,0 +1,70 @@
+import dataclasses
+
+import pytest
+
+from src.main.new_app.serialization import Codec, LazyPayload, PayloadMsg, get_codec
+
+
+@dataclasses.dataclass
+class Point:
+    x: int
+    y: int
+
+
+@pytest.mark.parametrize("name", ["msgpack", "json"])
+def test_round_trip_with_schema(name):
+    codec = get_codec(name)
+    data = codec.encode({"x": 1, "y": 2})
+    assert codec.decode(memoryview(data)) == {"x": 1, "y": 2}
+    assert codec.decode(data, Point) == Point(1, 2)
+
+
+def test_raw_codec_passes_bytes():
+    codec = get_codec("raw")
+    assert codec.encode(b"abc") == b"abc"
+    assert codec.encode("abc") == b"abc"
+    with pytest.raises(TypeError):
+        codec.encode(1)
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        get_codec("xml")
+
+
+def test_codec_is_abstract():
+    with pytest.raises(TypeError):
+        Codec()
+
+    class Partial(Codec):
+        def encode(self, obj):
+            return b""
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_payload_is_decoded_once():
+    calls = []
+
+    class Counting(Codec):
+        name = "counting"
+
+        def encode(self, obj):
+            return bytes(obj)
+
+        def decode(self, data, schema=None):
+            calls.append(1)
+            return bytes(data)
+
+    payload = LazyPayload(b"abc", Counting())
+    assert payload.value == b"abc" and payload.value == b"abc"
+    assert len(calls) == 1
+
+    class Msg:
+        data = b"xyz"
+        subject = "s"
+
+    msg = PayloadMsg(Msg(), Counting())
+    assert msg.subject == "s"
+    assert msg.payload == b"xyz"
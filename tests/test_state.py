@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from dishka import make_async_container
+from dishka.integrations.faststream import FastStreamProvider, setup_dishka
+from faststream import FastStream
+from faststream.nats import NatsBroker, TestNatsBroker
+from nats.js.kv import KeyValue
+
+from src.main import subs
+from src.main.di import StateProvider
+from src.main.injection import setup_injection
+from src.main.new_app.state import StateStore
+
+
+def test_stale_revision_does_not_overwrite():
+    state = StateStore()
+    state.set("a", 2, revision=5)
+    state.set("a", 1, revision=4)
+    assert state.get("a") == 2
+    state.delete("a", revision=6)
+    assert "a" not in state and len(state) == 0
+
+
+async def test_changed_wakes_on_update():
+    state = StateStore()
+    waiter = asyncio.create_task(state.changed("a"))
+    await asyncio.sleep(0)
+    version = state.set("a", 1)
+    update = await waiter
+    assert (update.value, update.version) == (1, version)
+    # Уже изменённый ключ возвращается сразу
+    assert (await state.changed("a", 0)).value == 1
+
+
+async def test_changed_removes_its_waiter_on_timeout_and_cancel():
+    state = StateStore()
+    with pytest.raises(asyncio.TimeoutError):
+        await state.changed("a", timeout=0.01)
+    assert state.waiters == {}
+    task = asyncio.create_task(state.changed("a"))
+    await asyncio.sleep(0)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    assert state.waiters == {}
+
+
+async def test_updates_coalesce_for_slow_readers():
+    state = StateStore()
+    state.set("a", 1)
+    updates = state.updates("a")
+    assert (await updates.__anext__()).value == 1
+    state.set("a", 2)
+    state.set("a", 3)
+    state.set("b", 1)  # Не подходит под фильтр
+    assert (await updates.__anext__()).value == 3
+    await updates.aclose()
+    assert not state.subscribers
+    assert state.snapshot().values == {"a": 3, "b": 1}
+
+
+@pytest.mark.parametrize("precompiled", [False, True])
+async def test_miniapp_sub_stores_the_kv_revision(precompiled):
+    broker = NatsBroker(logger=None)
+    broker.include_router(subs.create_router())
+    app = FastStream(broker, logger=None)
+    container = make_async_container(FastStreamProvider(), StateProvider())
+    if precompiled:
+        injector = setup_injection(container, app)
+    else:
+        setup_dishka(container=container, app=app, auto_inject=True)
+    async with TestNatsBroker(broker):
+        if precompiled:
+            await injector.resolve()
+        subscriber = next(
+            sub for sub in broker._subscribers.values() if getattr(sub, "kv_watch", None) is not None
+        )
+        # Запоздавшая ревизия 1 приходит после ревизии 2
+        for value, revision in ((b"20", 2), (b"10", 1)):
+            entry = KeyValue.Entry(
+                bucket="miniapp", key="result", value=value,
+                revision=revision, delta=0, created=None, operation=None,
+            )
+            await subscriber.process_message(entry)
+        state = await container.get(StateStore)
+        assert state.get("result") == 20
+        assert state.items["result"].revision == 2
+    await container.close()
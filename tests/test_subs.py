@@ -0,0 +1,29 @@
+import asyncio
+import multiprocessing
+import signal
+
+from faststream.nats import TestNatsBroker
+
+from src.main import subs
+from src.main.supervisor import WorkerContext
+
+
+async def test_worker_runs_under_supervisor_control(monkeypatch):
+    container, app = subs.create_app()
+    monkeypatch.setattr(subs, "create_app", lambda: (container, app))
+    heartbeat = multiprocessing.Value("d", 0.0, lock=False)
+
+    async with TestNatsBroker(app.broker):
+        ctx = WorkerContext(0, 1, asyncio.Event(), heartbeat)
+        handlers = signal.getsignal(signal.SIGINT), signal.getsignal(signal.SIGTERM)
+        task = asyncio.create_task(subs.worker(ctx))
+        for _ in range(100):
+            if heartbeat.value:
+                break
+            await asyncio.sleep(0.01)
+        assert heartbeat.value, "ctx.ready() is called after startup"
+        # Обработчики сигналов остаются за супервизором
+        assert (signal.getsignal(signal.SIGINT), signal.getsignal(signal.SIGTERM)) == handlers
+        assert not task.done()
+        ctx.stopping.set()
+        await asyncio.wait_for(task, 5)
@@ -0,0 +1,72 @@
+import sys
+
+import pytest
+
+from src.main.supervisor import check_target
+
+
+def test_check_target_validates_module_and_function():
+    check_target("src.main.subs:worker")
+    with pytest.raises(ValueError):
+        check_target("src.main.subs")
+    with pytest.raises(ModuleNotFoundError):
+        check_target("src.main.missing:worker")
+    with pytest.raises(AttributeError):
+        check_target("src.main.subs:wroker")
+
+
+def test_check_target_reads_the_source_without_importing(tmp_path, monkeypatch):
+    (tmp_path / "target_mod.py").write_text(
+        "import os.path as p\n"
+        "raise RuntimeError('must not be imported')\n"
+        "try:\n"
+        "    from fast import worker\n"
+        "except ImportError:\n"
+        "    async def worker(ctx):\n"
+        "        pass\n"
+        "if p:\n"
+        "    other = lambda ctx: None\n"
+    )
+    (tmp_path / "lazy_mod.py").write_text("def __getattr__(name):\n    return None\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    check_target("target_mod:worker")
+    check_target("target_mod:other")
+    check_target("target_mod:p")
+    with pytest.raises(AttributeError):
+        check_target("target_mod:missing")
+    # Имена модуля с __getattr__ статически не известны
+    check_target("lazy_mod:anything")
+    assert "target_mod" not in sys.modules
+
+
+def test_check_target_sees_every_module_level_binding(tmp_path, monkeypatch):
+    (tmp_path / "bindings_mod.py").write_text(
+        "import contextlib\n"
+        "for looped in range(1):\n"
+        "    pass\n"
+        "with contextlib.nullcontext(None) as managed:\n"
+        "    pass\n"
+        "try:\n"
+        "    import os as guarded\n"
+        "except ImportError as failure:\n"
+        "    pass\n"
+        "match {'k': 1}:\n"
+        "    case {'k': matched, **rest}:\n"
+        "        pass\n"
+        "if (walrus := 1):\n"
+        "    pass\n"
+        "def setup():\n"
+        "    global late\n"
+        "    late = None\n"
+        "    local = None\n"
+        "class Holder:\n"
+        "    attribute = None\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    for name in ("looped", "managed", "guarded", "failure", "matched", "rest", "walrus", "late", "Holder"):
+        check_target(f"bindings_mod:{name}")
+    for name in ("local", "attribute"):
+        with pytest.raises(AttributeError):
+            check_target(f"bindings_mod:{name}")
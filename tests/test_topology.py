@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from src.main.new_app.topology import CREATE, UNCHANGED, UPDATE, Topology, TopologyError
+
+
+def declared() -> Topology:
+    topology = Topology()
+    topology.stream("ORDERS", ["orders.>"])
+    topology.bucket("config", history=1)
+    for i in range(6):
+        topology.consumer("ORDERS", f"worker-{i}", max_ack_pending=100)
+    return topology
+
+
+async def test_reconcile_creates_then_updates(memory_js):
+    _, js = await memory_js()
+    topology = declared()
+    changes = await topology.reconcile(js)
+    assert {c.action for c in changes} == {CREATE} and len(changes) == 8
+
+    topology.consumer("ORDERS", "worker-0", max_ack_pending=10)
+    changes = {c.name: c for c in await topology.reconcile(js)}
+    assert changes["ORDERS.worker-0"].action == UPDATE
+    assert changes["ORDERS.worker-0"].diff == {"max_ack_pending": (100, 10)}
+    assert changes["ORDERS.worker-1"].action == UNCHANGED
+    info = await topology.ensure_consumer(js, "ORDERS", "worker-0")
+    assert info.config.max_ack_pending == 10
+
+
+async def test_consumers_of_a_stream_are_created_in_parallel(memory_js):
+    _, js = await memory_js()
+    add_consumer, running, peak = js.add_consumer, 0, 0
+
+    async def slow_add_consumer(*args, **kwargs):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return await add_consumer(*args, **kwargs)
+
+    js.add_consumer = slow_add_consumer
+    await declared().reconcile(js)
+    assert peak == 6
+
+
+async def test_all_failures_are_reported_together(memory_js):
+    _, js = await memory_js()
+    add_consumer = js.add_consumer
+
+    async def failing_add_consumer(stream, config=None, **kwargs):
+        if config.durable_name in ("worker-1", "worker-4"):
+            raise RuntimeError(config.durable_name)
+        return await add_consumer(stream, config, **kwargs)
+
+    js.add_consumer = failing_add_consumer
+    topology = declared()
+    with pytest.raises(TopologyError) as exc:
+        await topology.reconcile(js)
+    assert sorted(str(error) for error in exc.value.errors) == ["worker-1", "worker-4"]
+    # Остальные консюмеры созданы и закэшированы
+    assert len(topology.consumer_infos) == 4
+
+
+async def test_server_defaults_are_not_drift(memory_js):
+    _, js = await memory_js()
+    topology = declared()
+    topology.stream("EVENTS", ["events.>"], max_age=3600)
+    await topology.reconcile(js)
+    info = await js.stream_info("EVENTS")
+    # Сервер подставил своё окно дубликатов вместо duplicate_window=0 из nats-py
+    assert info.config.duplicate_window == 120.0
+
+    updates = []
+    update_stream = js.update_stream
+
+    async def tracking_update_stream(*args, **kwargs):
+        updates.append(args)
+        return await update_stream(*args, **kwargs)
+
+    js.update_stream = tracking_update_stream
+    topology.invalidate()
+    changes = await topology.reconcile(js)
+    await topology.ensure_stream(js, "EVENTS")
+    assert {c.action for c in changes} == {UNCHANGED} and updates == []
+
+    # Явно переданное поле по-прежнему сверяется
+    topology.stream("EVENTS", ["events.>"], max_age=60)
+    change = (await topology.reconcile(js))[1]
+    assert (change.name, change.action, change.diff) == ("EVENTS", UPDATE, {"max_age": (3600, 60)})